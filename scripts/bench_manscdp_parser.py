@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+MANSCDP 查询解析微基准与一致性检查
+以 ElementTree 完整解析（parse_xml_message）为参照，校验字段提取器的结果一致，并对比两者耗时
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from xml_builder import QUERY_FIELDS, parse_manscdp, parse_xml_message  # noqa: E402
+
+CATALOG = (
+    '<?xml version="1.0" encoding="GB2312"?>\r\n'
+    "<Query>\r\n"
+    "<CmdType>Catalog</CmdType>\r\n"
+    "<SN>17430</SN>\r\n"
+    "<DeviceID>34020000001320000001</DeviceID>\r\n"
+    "</Query>\r\n"
+)
+
+PTZ = (
+    '<?xml version="1.0"?>\n'
+    "<Control>\n"
+    "<CmdType>DeviceControl</CmdType>\n"
+    "<SN>11</SN>\n"
+    "<DeviceID>34020000001310000001</DeviceID>\n"
+    "<PTZCmd>A50F010800FA00B7</PTZCmd>\n"
+    "<Info><ControlPriority>5</ControlPriority></Info>\n"
+    "</Control>\n"
+)
+
+RECORD_INFO = (
+    '<?xml version="1.0" encoding="GB2312"?>\r\n'
+    "<Query>\r\n"
+    "<CmdType>RecordInfo</CmdType>\r\n"
+    "<SN>5</SN>\r\n"
+    "<DeviceID>34020000001310000001</DeviceID>\r\n"
+    "<StartTime>2024-01-01T00:00:00</StartTime>\r\n"
+    "<EndTime>2024-01-02T00:00:00</EndTime>\r\n"
+    "<Secrecy>0</Secrecy>\r\n"
+    "<Type>all</Type>\r\n"
+    "</Query>\r\n"
+)
+
+# 非常规文档：需回退到 ElementTree 或包含空字段
+UNUSUAL = [
+    "<Query><CmdType>Catalog</CmdType><SN></SN><DeviceID>1</DeviceID></Query>",
+    "<Query><CmdType>Catalog</CmdType><SN/><DeviceID>1</DeviceID></Query>",
+    "<Query><!-- comment --><CmdType>Catalog</CmdType><SN>1</SN></Query>",
+    "<Query><CmdType><![CDATA[Catalog]]></CmdType><SN>2</SN></Query>",
+    "<Query><CmdType>Catalog</CmdType><SN>3</SN><DeviceID>a&amp;b</DeviceID></Query>",
+    '<Query><CmdType>Catalog</CmdType><SN type="x">4</SN></Query>',
+    "<Query><CmdType>DeviceStatus</CmdType><SN>5</SN></Query>",
+    "<Query>\n  <CmdType> Catalog </CmdType>\n  <SN>6</SN>\n</Query>",
+]
+
+
+def selected(parsed: dict) -> dict:
+    """参照结果中与提取器对应的部分"""
+    return {key: parsed[key] for key in ("root_tag",) + QUERY_FIELDS if key in parsed}
+
+
+def check():
+    """提取器与 ElementTree 解析结果中的查询字段一致"""
+    for document in [CATALOG, PTZ, RECORD_INFO] + UNUSUAL:
+        expected = selected(parse_xml_message(document))
+        for data in (document, document.encode("utf-8"), memoryview(document.encode("utf-8"))):
+            assert selected(parse_manscdp(data)) == expected, document
+
+
+def bench(name: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    per_call = seconds / number * 1e6
+    print(f"  {name:<36} {per_call:8.2f} µs/msg")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MANSCDP 查询解析微基准与一致性检查")
+    parser.add_argument("number", nargs="?", type=int, default=20000, help="每轮执行次数（共 5 轮，取最快一轮）")
+    args = parser.parse_args()
+    number = args.number
+    check()
+    print(f"MANSCDP 查询解析基准（{number} 次 × 5 轮，取最快一轮）")
+
+    for title, document in (("Catalog 查询", CATALOG), ("PTZ 控制", PTZ), ("RecordInfo 查询", RECORD_INFO)):
+        raw = document.encode("utf-8")
+        print(f"{title}：")
+        # 原有路径：SIP 层与处理器各解析一次
+        old = bench("decode + parse_xml_message × 2",
+                    lambda: (parse_xml_message(raw.decode("utf-8")), parse_xml_message(raw.decode("utf-8"))),
+                    number)
+        new = bench("parse_manscdp", lambda: parse_manscdp(raw), number)
+        print(f"  加速比: {old / new:.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
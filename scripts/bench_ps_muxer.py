@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+PS 封装一致性检查与基准
+用合成的 H.264 MP4（假 SPS / PPS 和 NAL 数据）检查样本表解析、PS 结构（pack header、system header、
+PSM CRC、PES 时间戳）和 RTP 切分，再测量封装速度
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from mp4_reader import MP4VideoTrack  # noqa: E402
+from ps_muxer import PSMuxer, RTP_CLOCK, _crc32_mpeg2, iter_rtp_payloads, split_buffers  # noqa: E402
+from rtp_replay import RTPCache, RTP_HEADER_SIZE, build_ps_cache  # noqa: E402
+
+SPS = b"\x67\x42\xc0\x1e\xda\x02\x80\xbf\xe5\x84"
+PPS = b"\x68\xce\x3c\x80"
+TIMESCALE = 12800
+FRAME_DELTA = 512  # 25 fps
+GOP = 25
+
+
+def _box(kind: bytes, *parts: bytes) -> bytes:
+    body = b"".join(parts)
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def _full(kind: bytes, *parts: bytes, version: int = 0) -> bytes:
+    return _box(kind, struct.pack(">I", version << 24), *parts)
+
+
+def synth_frames(count: int, size: int):
+    """生成帧：每帧两个 NAL（关键帧为 IDR），负载按帧号填充"""
+    frames = []
+    for index in range(count):
+        first = (0x65 if index % GOP == 0 else 0x41).to_bytes(1, "big")
+        nals = [first + bytes([index & 0xFF]) * max(1, size - 30), b"\x06" + bytes([(index + 1) & 0xFF]) * 20]
+        frames.append(nals)
+    return frames
+
+
+def synth_mp4(path: str, frames, chunk_size: int = 7, b_frames: bool = False):
+    """写入只有一个视频轨道的 MP4（mdat 在 moov 之前，每个 chunk 含 chunk_size 个样本）"""
+    samples = [b"".join(struct.pack(">I", len(nal)) + nal for nal in nals) for nals in frames]
+    ftyp = _box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomavc1")
+    mdat_start = len(ftyp) + 8
+    data = b"".join(samples)
+
+    chunks, offset = [], mdat_start
+    for start in range(0, len(samples), chunk_size):
+        chunks.append(offset)
+        offset += sum(len(sample) for sample in samples[start:start + chunk_size])
+    last_run = len(samples) % chunk_size
+    stsc_entries = [(1, chunk_size, 1)]
+    if last_run:
+        stsc_entries.append((len(chunks), last_run, 1))
+
+    avcc = _box(b"avcC", bytes((1, 0x42, 0xC0, 0x1E, 0xFF, 0xE1)), struct.pack(">H", len(SPS)), SPS,
+                b"\x01", struct.pack(">H", len(PPS)), PPS)
+    avc1 = _box(b"avc1", bytes(6), struct.pack(">H", 1), bytes(16), struct.pack(">HH", 640, 360),
+                bytes(50), avcc)
+    stsd = _full(b"stsd", struct.pack(">I", 1), avc1)
+    stts = _full(b"stts", struct.pack(">III", 1, len(samples), FRAME_DELTA))
+    stss_list = [index + 1 for index in range(len(samples)) if index % GOP == 0]
+    stss = _full(b"stss", struct.pack(">I", len(stss_list)), struct.pack(f">{len(stss_list)}I", *stss_list))
+    stsz = _full(b"stsz", struct.pack(">II", 0, len(samples)),
+                 struct.pack(f">{len(samples)}I", *(len(sample) for sample in samples)))
+    stsc = _full(b"stsc", struct.pack(">I", len(stsc_entries)),
+                 b"".join(struct.pack(">III", *entry) for entry in stsc_entries))
+    stco = _full(b"stco", struct.pack(">I", len(chunks)), struct.pack(f">{len(chunks)}I", *chunks))
+    tables = [stsd, stts, stss, stsz, stsc, stco]
+    if b_frames:
+        # 负偏移（version 1）：读取时应整体平移到 >= 0
+        entries = [(1, (-FRAME_DELTA if index % 2 else FRAME_DELTA)) for index in range(len(samples))]
+        tables.insert(2, _full(b"ctts", struct.pack(">I", len(entries)),
+                               b"".join(struct.pack(">Ii", *entry) for entry in entries), version=1))
+    stbl = _box(b"stbl", *tables)
+    hdlr = _full(b"hdlr", bytes(4), b"vide", bytes(12), b"video\x00")
+    mdhd = _full(b"mdhd", struct.pack(">IIII", 0, 0, TIMESCALE, len(samples) * FRAME_DELTA), bytes(4))
+    mdia = _box(b"mdia", mdhd, hdlr, _box(b"minf", stbl))
+    moov = _box(b"moov", _box(b"trak", mdia))
+    with open(path, "wb") as f:
+        f.write(ftyp + struct.pack(">I4s", 8 + len(data), b"mdat") + data + moov)
+
+
+def _read_timestamp(data: bytes, pos: int) -> int:
+    return (((data[pos] >> 1) & 0x07) << 30 | data[pos + 1] << 22 | (data[pos + 2] >> 1) << 15 |
+            data[pos + 3] << 7 | data[pos + 4] >> 1)
+
+
+def parse_ps(data: bytes):
+    """独立解析 PS 流，返回 [(是否关键帧, SCR, PTS, DTS, ES 数据)]"""
+    frames, pos = [], 0
+    while pos < len(data):
+        assert data[pos:pos + 3] == b"\x00\x00\x01", pos
+        code = data[pos + 3]
+        if code == 0xBA:
+            assert data[pos + 4] >> 6 == 0x01
+            b4, b5, b6, b7, b8 = data[pos + 4:pos + 9]
+            scr = ((b4 >> 3) & 0x07) << 30 | (b4 & 0x03) << 28 | b5 << 20 | ((b6 >> 3) & 0x1F) << 15 | \
+                (b6 & 0x03) << 13 | b7 << 5 | b8 >> 3
+            frames.append([False, scr, None, None, bytearray()])
+            pos += 14 + (data[pos + 13] & 0x07)
+            continue
+        length = struct.unpack_from(">H", data, pos + 4)[0]
+        body = data[pos + 6:pos + 6 + length]
+        if code == 0xBB:
+            frames[-1][0] = True
+        elif code == 0xBC:
+            assert _crc32_mpeg2(data[pos:pos + 6 + length - 4]) == struct.unpack(">I", body[-4:])[0]
+            assert body[6] == 0x1B and body[7] == 0xE0
+        elif code == 0xE0:
+            flags, header_length = body[1], body[2]
+            if flags & 0x80:
+                frames[-1][2] = _read_timestamp(body, 3)
+                frames[-1][3] = _read_timestamp(body, 8) if flags & 0x40 else frames[-1][2]
+            frames[-1][4] += body[3 + header_length:]
+        pos += 6 + length
+    return frames
+
+
+def annexb(nals) -> bytes:
+    return b"".join(b"\x00\x00\x00\x01" + nal for nal in nals)
+
+
+def check(directory: str):
+    """样本表解析、PS 结构与 ES 还原、RTP 切分、缓存文件"""
+    for b_frames in (False, True):
+        frames = synth_frames(60, 3000)
+        path = os.path.join(directory, f"check_{b_frames}.mp4")
+        synth_mp4(path, frames, b_frames=b_frames)
+        track = MP4VideoTrack(path)
+        assert track.count == 60 and track.codec == "avc1" and (track.width, track.height) == (640, 360)
+        assert track.parameter_sets == [SPS, PPS] and track.timescale == TIMESCALE
+        assert [bytes(nal) for nal in track.nal_units(31)] == frames[31]
+        assert list(track.keyframes) == [int(index % GOP == 0) for index in range(60)]
+        assert min(track.cts) == 0 and (max(track.cts) > 0) == b_frames
+
+        muxer = PSMuxer(track.parameter_sets)
+        scale = RTP_CLOCK / TIMESCALE
+        stream = b""
+        for index in range(track.count):
+            dts = round(track.dts[index] * scale)
+            pts = round((track.dts[index] + track.cts[index]) * scale)
+            stream += b"".join(muxer.mux_frame(track.nal_units(index), pts, dts, bool(track.keyframes[index])))
+        parsed = parse_ps(stream)
+        assert len(parsed) == 60
+        for index, (key, scr, pts, dts, es) in enumerate(parsed):
+            expected_dts = round(index * FRAME_DELTA * scale)
+            assert key == (index % GOP == 0) and scr == dts == expected_dts
+            assert pts == round((track.dts[index] + track.cts[index]) * scale) and pts >= dts
+            assert bytes(es) == annexb(([SPS, PPS] if key else []) + frames[index])
+
+        # RTP 切分：负载不超过上限，每帧最后一个包带 marker，同一帧时间戳相同
+        payloads = list(iter_rtp_payloads(track, 1400))
+        joined = b"".join(b"".join(bytes(view) for view in payload) for _, _, _, payload in payloads)
+        assert [frame[1:] for frame in parse_ps(joined)] == [frame[1:] for frame in parsed]
+        assert all(sum(len(view) for view in payload) <= 1400 for _, _, _, payload in payloads)
+        assert sum(marker for _, _, marker, _ in payloads) == 60
+        assert [offset for offset, _, _, _ in payloads] == sorted(offset for offset, _, _, _ in payloads)
+        stamps = [(stamp, marker) for _, stamp, marker, _ in payloads]
+        assert all((following[0] == stamp) != marker for (stamp, marker), following in zip(stamps, stamps[1:]))
+        del payloads
+        track.close()
+
+    # 大于 64KB 的帧拆分为多个 PES，ES 完整且只有首个 PES 带时间戳
+    big = [[b"\x65" + bytes(range(256)) * 600]]
+    output = PSMuxer([SPS, PPS]).mux_frame([memoryview(big[0][0])], 3600, 3600, True)
+    assert any(isinstance(buffer, memoryview) and buffer.obj is big[0][0] for buffer in output)
+    parsed = parse_ps(b"".join(output))
+    assert len(parsed) == 1 and bytes(parsed[0][4]) == annexb([SPS, PPS] + big[0]) and parsed[0][2] == 3600
+    assert all(len(chunk) <= 3 for chunk in split_buffers([b"abc", b"de", b"f"], 3))
+
+    # 缓存文件：负载类型 96、marker 原样保留、循环周期等于轨道时长
+    path = os.path.join(directory, "check_False.mp4")
+    build_ps_cache(path, path + ".rtp")
+    cache = RTPCache(path + ".rtp")
+    assert cache.payload_type == 96 and abs(cache.seconds - 60 * FRAME_DELTA / TIMESCALE) < 1e-6
+    markers = [cache.view[pos + 1] & 0x80 for pos in cache.positions]
+    assert sum(1 for marker in markers if marker) == 60
+    stream = b"".join(bytes(cache.view[pos + RTP_HEADER_SIZE:pos + length])
+                      for pos, length in zip(cache.positions, cache.lengths))
+    assert len(parse_ps(stream)) == 60
+    assert list(cache.stamps) == sorted(cache.stamps) and cache.stamps[-1] == 59 * FRAME_DELTA * 90000 // TIMESCALE
+    cache.close()
+
+
+def bench(directory: str, seconds: float, mbps: float):
+    """把合成文件封装为 PS 缓存，统计封装速度"""
+    count = int(seconds * 25)
+    frames = synth_frames(count, int(mbps * 1e6 / 8 / 25))
+    path = os.path.join(directory, f"bench_{mbps}.mp4")
+    synth_mp4(path, frames)
+
+    wall, cpu = time.monotonic(), time.process_time()
+    packets, _ = build_ps_cache(path, path + ".rtp")
+    wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    print(f"  {seconds:.0f} 秒 × {mbps} Mbit/s：{packets:,} 个 RTP 包，封装 {wall:.2f} 秒"
+          f"（{seconds / wall:.0f} 倍实时，CPU {cpu:.2f} 秒）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PS 封装一致性检查与基准")
+    parser.add_argument("seconds", nargs="?", type=float, default=60.0, help="合成视频的时长（秒）")
+    args = parser.parse_args()
+    seconds = args.seconds
+    with tempfile.TemporaryDirectory() as directory:
+        check(directory)
+        print("PS 封装基准（MP4 样本表 → PS → RTP 缓存文件，不经过 FFmpeg）")
+        for mbps in (2.0, 8.0):
+            bench(directory, seconds, mbps)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+RTP 发送调度精度基准
+多路回放会话发送到本机 UDP 接收进程，按每个包的到达时间与计划发送时间之差统计迟发分布和到达抖动，
+比较不同调度精度（tick）下的发送精度和 CPU 占用
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from rtp_replay import RTPCache, ReplayStream, write_packets, RTP_CLOCK  # noqa: E402
+from rtp_scheduler import RTPScheduler  # noqa: E402
+
+PAYLOAD_SIZE = 1316
+
+
+def make_cache(path: str, seconds: float, mbps: float) -> RTPCache:
+    """生成固定码率的缓存文件（包大小相同、发送间隔均匀）"""
+    count = int(seconds * mbps * 1e6 / 8 / PAYLOAD_SIZE)
+    interval = seconds * RTP_CLOCK / count
+    payload = bytes(PAYLOAD_SIZE)
+    packets = ((int(index * interval), int(index * interval), False, (payload,)) for index in range(count))
+    write_packets(packets, path, 33, int(seconds * RTP_CLOCK))
+    return RTPCache(path)
+
+
+def sink(sock: socket.socket, seconds: float, conn):
+    """接收进程：记录每个包的到达时间（单调时钟，纳秒）、SSRC 和序号"""
+    arrivals, ssrcs, seqs = array("q"), array("L"), array("H")
+    sock.settimeout(0.2)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            packet = sock.recv(2048)
+        except socket.timeout:
+            continue
+        arrivals.append(time.monotonic_ns())
+        seq, _, ssrc = struct.unpack_from("!HII", packet, 2)
+        ssrcs.append(ssrc)
+        seqs.append(seq)
+    conn.send((arrivals.tobytes(), ssrcs.tobytes(), seqs.tobytes()))
+    conn.close()
+
+
+def percentile(values, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(cache: RTPCache, streams: int, seconds: float, tick: float, stagger: float = 1.0):
+    """按计划发送时间（会话起点 + 包的发送偏移）计算每个到达包的迟发时间"""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024 * 1024)
+    receiver.bind(("127.0.0.1", 0))
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=sink, args=(receiver, seconds + 0.5, child))
+    process.start()
+    time.sleep(0.2)
+
+    scheduler = RTPScheduler(tick=tick)
+    plan = {}
+    for index in range(streams):
+        stream = ReplayStream(f"bench-{index}", cache, receiver.getsockname(), ssrc=index + 1)
+        # 会话的起点随机错开，接近实际各会话独立建立的情况
+        stream.origin += random.uniform(0, stagger)
+        plan[stream.ssrc] = stream
+        scheduler.add(stream)
+
+    wall, cpu = time.monotonic(), time.process_time()
+    time.sleep(seconds)
+    wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    stats = scheduler.stats()
+    origins = {ssrc: (stream.origin, stream.seq, stream.packets) for ssrc, stream in plan.items()}
+    scheduler.stop()
+
+    arrivals, ssrcs, seqs = (array(code, data) for code, data in zip("qLH", parent.recv()))
+    process.join()
+    receiver.close()
+
+    # 序号从会话的最后序号倒推：第 n 个包的计划时间 = 起点 + (n // 包数 × 周期 + 偏移[n % 包数]) / 90000
+    lateness, jitter = [], {}
+    last_seq = {ssrc: (seq - packets) & 0xFFFF for ssrc, (_, seq, packets) in origins.items()}
+    for arrival, ssrc, seq in zip(arrivals, ssrcs, seqs):
+        origin, _, _ = origins[ssrc]
+        number = (seq - last_seq[ssrc]) & 0xFFFF
+        loop, index = divmod(number, cache.count)
+        planned = origin + (loop * cache.duration + cache.offsets[index]) / RTP_CLOCK
+        late = arrival / 1e9 - planned
+        lateness.append(late)
+        previous, value = jitter.get(ssrc, (late, 0.0))
+        jitter[ssrc] = late, value + (abs(late - previous) - value) / 16
+    lateness.sort()
+    mean_jitter = sum(value for _, value in jitter.values()) / max(1, len(jitter))
+    received, sent = len(arrivals), stats["packets_sent"]
+
+    print(f"  tick {tick * 1000:>4.1f}ms：收到 {received:,}/{sent:,} 包，"
+          f"迟发 p50 {percentile(lateness, 0.5) * 1000:.2f}ms / p99 {percentile(lateness, 0.99) * 1000:.2f}ms / "
+          f"最大 {lateness[-1] * 1000:.2f}ms，到达抖动 {mean_jitter * 1000:.3f}ms"
+          f"（调度器统计 {stats['jitter_ms']:.3f}ms，迟发 {stats['late_packets']} 个），"
+          f"CPU {cpu / wall * 100:.1f}%，醒来 {stats['wakeups'] / wall:,.0f} 次/秒")
+    return lateness, received, sent
+
+
+def check(cache: RTPCache):
+    """单路发送：所有包都到达，迟发不超过调度精度加上系统调度误差"""
+    lateness, received, sent = bench(cache, 1, 1.0, 0.002, stagger=0.0)
+    assert received == sent >= cache.count / cache.seconds * 0.9
+    assert percentile(lateness, 0.5) < 0.005
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RTP 发送调度精度基准")
+    parser.add_argument("streams", nargs="?", type=int, default=200, help="回放路数")
+    parser.add_argument("seconds", nargs="?", type=float, default=5.0, help="每种调度精度的测量时长（秒）")
+    parser.add_argument("mbps", nargs="?", type=float, default=1.0, help="每路码率（Mbit/s）")
+    args = parser.parse_args()
+    streams = args.streams
+    seconds = args.seconds
+    mbps = args.mbps
+    with tempfile.TemporaryDirectory() as directory:
+        cache = make_cache(os.path.join(directory, "pacing.rtp"), 4.0, mbps)
+        print("一致性检查（单路）")
+        check(cache)
+        print(f"RTP 发送调度精度基准（{streams} 路 × {mbps} Mbit/s，{seconds:.0f} 秒，本机 UDP 接收进程计时）")
+        for tick in (0.001, 0.005, 0.010, 0.020):
+            bench(cache, streams, seconds, tick)
+        cache.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
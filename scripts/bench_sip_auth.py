@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+SIP 摘要认证微基准
+对比原有的逐次计算 HA1 + 按逗号拆分挑战头与 sip_auth 模块（HA1 缓存、注册刷新直接携带认证头），
+以单核每秒可完成的注册认证次数表示
+"""
+import argparse
+import hashlib
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from sip_auth import DigestAuth, parse_auth_header, compute_ha1, compute_ha2, digest_response  # noqa: E402
+
+USER = "34020000001320000001"
+PASSWORD = "12345678"
+URI = "sip:192.168.1.10:5060"
+CHALLENGE = ('Digest realm="3402000000", nonce="9bd055a1c3f1e7a0,6d3b", '
+             'opaque="5ccc069c403ebaf9f0171e9517f40e41", qop="auth", algorithm=MD5')
+
+
+def legacy_parse(auth_header: str) -> dict:
+    """原有路径：去掉 Digest 前缀后按逗号拆分"""
+    result = {}
+    if auth_header.startswith("Digest "):
+        auth_header = auth_header[7:]
+    for part in auth_header.split(','):
+        part = part.strip()
+        if '=' in part:
+            key, value = part.split('=', 1)
+            result[key.strip()] = value.strip().strip('"')
+    return result
+
+
+def legacy_authorization(auth_info: dict) -> str:
+    """原有路径：每次注册重新计算 HA1、HA2 和 response"""
+    ha1 = hashlib.md5(f"{USER}:{auth_info.get('realm', '')}:{PASSWORD}".encode()).hexdigest()
+    ha2 = hashlib.md5(f"REGISTER:{URI}".encode()).hexdigest()
+    response = hashlib.md5(f"{ha1}:{auth_info.get('nonce', '')}:{ha2}".encode()).hexdigest()
+    return ", ".join([
+        f'Digest username="{USER}"',
+        f'realm="{auth_info.get("realm", "")}"',
+        f'nonce="{auth_info.get("nonce", "")}"',
+        f'uri="{URI}"',
+        f'response="{response}"',
+        'algorithm=MD5',
+    ])
+
+
+def verify(header: str, password: str, method: str) -> bool:
+    """服务器侧校验 Authorization 头（独立实现，仅用于一致性检查）"""
+    params = parse_auth_header(header)
+    md5 = lambda text: hashlib.md5(text.encode()).hexdigest()  # noqa: E731
+    ha1 = md5(f"{params['username']}:{params['realm']}:{password}")
+    ha2 = md5(f"{method}:{params['uri']}")
+    if "qop" in params:
+        expected = md5(f"{ha1}:{params['nonce']}:{params['nc']}:{params['cnonce']}:{params['qop']}:{ha2}")
+    else:
+        expected = md5(f"{ha1}:{params['nonce']}:{ha2}")
+    return params["response"] == expected
+
+
+def check():
+    """RFC 2617 3.5 示例、引号内逗号、nonce-count 递增与 stale 处理"""
+    ha1 = compute_ha1("Mufasa", "testrealm@host.com", "Circle Of Life")
+    response = digest_response(ha1, "dcd98b7102dd2f0e8b11d0f600bfb0c093", compute_ha2("GET", "/dir/index.html"),
+                               "auth", "00000001", "0a4f113b")
+    assert response == "6629fae49393a05397450978507c4ef1"
+
+    params = parse_auth_header(CHALLENGE)
+    assert params["nonce"] == "9bd055a1c3f1e7a0,6d3b" and params["qop"] == "auth"
+    assert legacy_parse(CHALLENGE)["nonce"] == "9bd055a1c3f1e7a0"  # 原有解析截断了 nonce
+
+    auth = DigestAuth(USER, PASSWORD)
+    assert not auth.ready
+    auth.on_challenge(CHALLENGE)
+    first, second = auth.authorization("REGISTER", URI), auth.authorization("REGISTER", URI)
+    assert verify(first, PASSWORD, "REGISTER") and verify(second, PASSWORD, "REGISTER")
+    assert "nc=00000001" in first and "nc=00000002" in second
+    assert 'opaque="5ccc069c403ebaf9f0171e9517f40e41"' in first
+
+    auth.on_challenge(CHALLENGE.replace("9bd055a1c3f1e7a0,6d3b", "fresh") + ", stale=true")
+    assert auth.stale and "nc=00000001" in auth.authorization("REGISTER", URI)
+
+    # 不带 qop 的挑战与原有实现结果一致
+    plain = 'Digest realm="3402000000", nonce="abc"'
+    auth.on_challenge(plain)
+    assert auth.authorization("REGISTER", URI) == legacy_authorization(legacy_parse(plain))
+
+
+def bench(name: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    rate = number / seconds
+    print(f"  {name:<44} {rate:12,.0f} 次/秒")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SIP 摘要认证微基准")
+    parser.add_argument("number", nargs="?", type=int, default=20000, help="每轮执行次数（共 5 轮，取最快一轮）")
+    args = parser.parse_args()
+    number = args.number
+    check()
+    print(f"注册认证基准（{number} 次 × 5 轮，取最快一轮，单核）")
+
+    plain = 'Digest realm="3402000000", nonce="9bd055a1c3f1e7a0", algorithm=MD5'
+    print("挑战后认证（解析 401 挑战 + 生成 Authorization）：")
+    old = bench("legacy: split + 3× MD5", lambda: legacy_authorization(legacy_parse(plain)), number)
+    auth = DigestAuth(USER, PASSWORD)
+
+    def challenged():
+        auth.on_challenge(plain)
+        return auth.authorization("REGISTER", URI)
+
+    new = bench("DigestAuth: parse + cached HA1/HA2", challenged, number)
+    print(f"  加速比: {new / old:.2f}x")
+
+    print("注册刷新：")
+    old = bench("legacy: 401 往返后重新解析并计算", lambda: legacy_authorization(legacy_parse(plain)), number)
+    new = bench("DigestAuth: 沿用 nonce 直接生成", lambda: auth.authorization("REGISTER", URI), number)
+    print(f"  加速比: {new / old:.2f}x（另省去一次 401 往返）")
+
+    auth.on_challenge(CHALLENGE)
+    bench("DigestAuth: qop=auth（nc/cnonce）", lambda: auth.authorization("REGISTER", URI), number)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
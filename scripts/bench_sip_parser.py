@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+SIP 解析微基准
+对比原有的 decode + split + 头部字典路径与 bytes 定位解析器
+"""
+import argparse
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from sip_parser import parse_message  # noqa: E402
+
+KEEPALIVE_OK = (
+    "SIP/2.0 200 OK\r\n"
+    "Via: SIP/2.0/UDP 192.168.1.100:5060;rport=5060;received=192.168.1.100;branch=z9hG4bK1a2b3c4d5e\r\n"
+    "From: <sip:34020000001320000001@3402000000>;tag=8f3a9c21\r\n"
+    "To: <sip:34020000002000000001@3402000000>;tag=77120934\r\n"
+    "Call-ID: 4c1d8f0e2a7b4e91b3f5c6d7e8f90123@192.168.1.100\r\n"
+    "CSeq: 25 MESSAGE\r\n"
+    "User-Agent: LiveGBS v2.0\r\n"
+    "Content-Length: 0\r\n"
+    "\r\n"
+).encode()
+
+CATALOG_BODY = (
+    '<?xml version="1.0" encoding="GB2312"?>\r\n'
+    "<Query>\r\n"
+    "<CmdType>Catalog</CmdType>\r\n"
+    "<SN>17430</SN>\r\n"
+    "<DeviceID>34020000001320000001</DeviceID>\r\n"
+    "</Query>\r\n"
+)
+
+CATALOG_QUERY = (
+    "MESSAGE sip:34020000001320000001@3402000000 SIP/2.0\r\n"
+    "Via: SIP/2.0/UDP 192.168.1.10:5060;rport;branch=z9hG4bK813264972\r\n"
+    "From: <sip:34020000002000000001@3402000000>;tag=460264972\r\n"
+    "To: <sip:34020000001320000001@3402000000>\r\n"
+    "Call-ID: 176264972\r\n"
+    "CSeq: 20 MESSAGE\r\n"
+    "Content-Type: Application/MANSCDP+xml\r\n"
+    "Max-Forwards: 70\r\n"
+    "User-Agent: LiveGBS v2.0\r\n"
+    f"Content-Length: {len(CATALOG_BODY)}\r\n"
+    "\r\n"
+    f"{CATALOG_BODY}"
+).encode()
+
+
+# 200 OK 响应需要从请求中回填的头部
+ECHOED_HEADERS = ("Via", "From", "To", "Call-ID", "CSeq")
+
+_BRANCH_RE = re.compile(r'branch=([^;,\s]+)')
+
+
+def legacy_response(data: bytes):
+    """原有路径：整包解码、按行拆分、解析全部头部，再从 Via 中取 branch 匹配事务"""
+    message = data.decode('utf-8', errors='ignore')
+    lines = message.split('\r\n')
+    status_code = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip()] = value.strip()
+    return status_code, _BRANCH_RE.search(headers.get("Via", "")).group(1)
+
+
+def legacy_request(data: bytes):
+    """原有路径：解析全部头部并切出消息体，读取 200 OK 响应需要回填的头部"""
+    message = data.decode('utf-8', errors='ignore')
+    lines = message.split('\r\n')
+    method = lines[0].split()[0]
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip()] = value.strip()
+    body = message[message.find('\r\n\r\n') + 4:]
+    echoed = tuple(headers.get(name, "") for name in ECHOED_HEADERS)
+    return method, echoed, body
+
+
+def fast_response(data: bytes):
+    """新路径：只读取状态码和事务匹配所需的 branch"""
+    message = parse_message(data)
+    return message.status_code, message.via_branch
+
+
+def fast_request(data: bytes):
+    """新路径：一次取出需要回填的头部行（原始字节直接写入响应，不解码），消息体按 Content-Length 偏移解码"""
+    message = parse_message(data)
+    echoed = message.echoed_headers()
+    return message.method, echoed, message.body_text()
+
+
+def check():
+    """两条路径对同一消息的解析结果一致"""
+    assert fast_response(KEEPALIVE_OK) == legacy_response(KEEPALIVE_OK)
+    assert parse_message(KEEPALIVE_OK).cseq == (25, "MESSAGE")
+
+    method, echoed, body = fast_request(CATALOG_QUERY)
+    legacy_method, legacy_echoed, legacy_body = legacy_request(CATALOG_QUERY)
+    assert (method, body) == (legacy_method, legacy_body)
+    assert echoed.decode() == "".join(f"{name}: {value}\r\n" for name, value in zip(ECHOED_HEADERS, legacy_echoed))
+
+
+def bench(name: str, func, data: bytes, number: int) -> float:
+    seconds = min(timeit.repeat(lambda: func(data), number=number, repeat=5))
+    per_call = seconds / number * 1e6
+    print(f"  {name:<28} {per_call:8.2f} µs/msg")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SIP 解析微基准")
+    parser.add_argument("number", nargs="?", type=int, default=50000, help="每轮执行次数（共 5 轮，取最快一轮）")
+    args = parser.parse_args()
+    number = args.number
+    check()
+    print(f"SIP 解析基准（{number} 次 × 5 轮，取最快一轮）")
+
+    print("心跳 200 OK 响应：")
+    old = bench("decode + split + dict", legacy_response, KEEPALIVE_OK, number)
+    new = bench("parse_message", fast_response, KEEPALIVE_OK, number)
+    print(f"  加速比: {old / new:.2f}x")
+
+    print("Catalog 查询 MESSAGE：")
+    old = bench("decode + split + dict", legacy_request, CATALOG_QUERY, number)
+    new = bench("parse_message", fast_request, CATALOG_QUERY, number)
+    print(f"  加速比: {old / new:.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+SIP 请求构建微基准
+对比原有的逐行 f-string + join + encode 与预编译字节模板（心跳 MESSAGE 的头部部分）
+"""
+import argparse
+import random
+import string
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from sip_templates import SIPTemplate  # noqa: E402
+from utils import generate_branch, generate_call_id, format_sip_uri  # noqa: E402
+
+SIP_USER = "34020000001320000001"
+SERVER_ID = "34020000002000000001"
+DOMAIN = "3402000000"
+SERVER_IP, SERVER_PORT = "192.168.1.10", 5060
+LOCAL_IP, LOCAL_PORT = "192.168.1.100", 5060
+FROM_TAG = "8f3a9c21d0"
+BODY = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    "<Notify><CmdType>Keepalive</CmdType><SN>1760000000000</SN>"
+    f"<DeviceID>{SIP_USER}</DeviceID><Status>OK</Status></Notify>"
+)
+
+
+def legacy_branch() -> str:
+    """原有 branch 生成方式"""
+    return "z9hG4bK" + ''.join(random.choices(string.ascii_letters + string.digits, k=20))
+
+
+def legacy_call_id() -> str:
+    """原有 Call-ID 生成方式"""
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=32))
+
+
+def legacy_message(body: str, cseq: int, branch: str, call_id: str) -> bytes:
+    """原有路径：每次重新格式化所有头部行"""
+    from_uri = format_sip_uri(SIP_USER, DOMAIN)
+    to_uri = format_sip_uri(SERVER_ID, DOMAIN)
+    lines = [
+        f"MESSAGE sip:{SERVER_IP}:{SERVER_PORT} SIP/2.0",
+        f"Via: SIP/2.0/UDP {LOCAL_IP}:{LOCAL_PORT};rport;branch={branch}",
+        f"From: <{from_uri}>;tag={FROM_TAG}",
+        f"To: <{to_uri}>",
+        f"Call-ID: {call_id}",
+        f"CSeq: {cseq} MESSAGE",
+        f"Content-Type: Application/MANSCDP+xml",
+        f"Max-Forwards: 70",
+        f"Content-Length: {len(body)}",
+        "",
+        body
+    ]
+    return "\r\n".join(lines).encode()
+
+
+TEMPLATE = SIPTemplate(
+    f"MESSAGE sip:{SERVER_IP}:{SERVER_PORT} SIP/2.0",
+    f"Via: SIP/2.0/UDP {LOCAL_IP}:{LOCAL_PORT};rport;branch={{branch}}",
+    f"From: <{format_sip_uri(SIP_USER, DOMAIN)}>;tag={FROM_TAG}",
+    f"To: <{format_sip_uri(SERVER_ID, DOMAIN)}>",
+    "Call-ID: {call_id}",
+    "CSeq: {cseq:d} MESSAGE",
+    "Content-Type: Application/MANSCDP+xml",
+    "Max-Forwards: 70",
+    "Content-Length: {length:d}",
+    "",
+    "{body}",
+)
+
+
+def template_message(body: str, cseq: int, branch: str, call_id: str) -> bytes:
+    """新路径：预编译模板填入变化字段"""
+    payload = body.encode("utf-8")
+    return TEMPLATE.render(branch.encode(), call_id.encode(), cseq, len(payload), payload)
+
+
+def check():
+    """相同字段下两条路径输出的字节完全一致"""
+    for cseq in (1, 25, 100000):
+        branch, call_id = generate_branch(), generate_call_id()
+        assert template_message(BODY, cseq, branch, call_id) == legacy_message(BODY, cseq, branch, call_id)
+
+
+def bench(name: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    per_call = seconds / number * 1e6
+    print(f"  {name:<36} {per_call:8.2f} µs/msg")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SIP 请求构建微基准")
+    parser.add_argument("number", nargs="?", type=int, default=50000, help="每轮执行次数（共 5 轮，取最快一轮）")
+    args = parser.parse_args()
+    number = args.number
+    check()
+    print(f"心跳 MESSAGE 构建基准（{number} 次 × 5 轮，取最快一轮，不含 XML 消息体生成）")
+
+    old = bench("f-string + join + encode", lambda: legacy_message(BODY, 25, "z9hG4bKx", "c"), number)
+    new = bench("SIPTemplate.render", lambda: template_message(BODY, 25, "z9hG4bKx", "c"), number)
+    print(f"  加速比: {old / new:.2f}x")
+
+    print("含 branch / Call-ID 生成：")
+    old = bench("random.choices + f-string", lambda: legacy_message(BODY, 25, legacy_branch(), legacy_call_id()), number)
+    new = bench("getrandbits + SIPTemplate", lambda: template_message(BODY, 25, generate_branch(), generate_call_id()),
+                number)
+    print(f"  加速比: {old / new:.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+XML 构建微基准与一致性检查
+以原有的 ElementTree 构建路径为参照，校验字符串模板路径输出逐字节一致、分片响应不丢失记录，并对比两者耗时
+"""
+import argparse
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from record_index import RecordIndex  # noqa: E402
+from xml_builder import XMLBuilder  # noqa: E402
+
+DEVICE_ID = "34020000001320000001"
+
+
+def _tostring(root) -> str:
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+
+
+def et_keepalive(device_id, status, sn):
+    """参照实现：ElementTree 心跳"""
+    root = ET.Element("Notify")
+    ET.SubElement(root, "CmdType").text = "Keepalive"
+    ET.SubElement(root, "SN").text = sn
+    ET.SubElement(root, "DeviceID").text = device_id
+    ET.SubElement(root, "Status").text = status
+    return _tostring(root)
+
+
+def et_catalog(device_id, sn, channels):
+    """参照实现：ElementTree 目录响应"""
+    root = ET.Element("Response")
+    ET.SubElement(root, "CmdType").text = "Catalog"
+    ET.SubElement(root, "SN").text = sn
+    ET.SubElement(root, "DeviceID").text = device_id
+    ET.SubElement(root, "SumNum").text = str(len(channels))
+    device_list = ET.SubElement(root, "DeviceList")
+    device_list.set("Num", str(len(channels)))
+    for channel in channels:
+        item = ET.SubElement(device_list, "Item")
+        ET.SubElement(item, "DeviceID").text = channel.get("channel_id", "")
+        ET.SubElement(item, "Name").text = channel.get("name", "Camera")
+        ET.SubElement(item, "Manufacturer").text = channel.get("manufacturer", "SimCamera")
+        ET.SubElement(item, "Model").text = channel.get("model", "SC-2000")
+        ET.SubElement(item, "Owner").text = "Owner"
+        ET.SubElement(item, "CivilCode").text = device_id[:9]
+        ET.SubElement(item, "Address").text = "Address"
+        ET.SubElement(item, "Parental").text = "0"
+        ET.SubElement(item, "ParentID").text = device_id
+        ET.SubElement(item, "SafetyWay").text = "0"
+        ET.SubElement(item, "RegisterWay").text = "1"
+        ET.SubElement(item, "Secrecy").text = "0"
+        ET.SubElement(item, "Status").text = "ON"
+    return _tostring(root)
+
+
+def et_device_info(device_id, sn, device_info):
+    """参照实现：ElementTree 设备信息响应"""
+    root = ET.Element("Response")
+    ET.SubElement(root, "CmdType").text = "DeviceInfo"
+    ET.SubElement(root, "SN").text = sn
+    ET.SubElement(root, "DeviceID").text = device_id
+    ET.SubElement(root, "DeviceName").text = device_info.get("name", "SimCamera")
+    ET.SubElement(root, "Manufacturer").text = device_info.get("manufacturer", "SimCamera")
+    ET.SubElement(root, "Model").text = device_info.get("model", "SC-2000")
+    ET.SubElement(root, "Firmware").text = device_info.get("firmware", "V1.0.0")
+    ET.SubElement(root, "Channel").text = str(device_info.get("channel_count", 1))
+    return _tostring(root)
+
+
+def et_device_status(device_id, sn, status):
+    """参照实现：ElementTree 设备状态响应"""
+    root = ET.Element("Response")
+    ET.SubElement(root, "CmdType").text = "DeviceStatus"
+    ET.SubElement(root, "SN").text = sn
+    ET.SubElement(root, "DeviceID").text = device_id
+    ET.SubElement(root, "Result").text = "OK"
+    ET.SubElement(root, "Online").text = "ONLINE" if status == "ON" else "OFFLINE"
+    ET.SubElement(root, "Status").text = status
+    ET.SubElement(root, "Encode").text = "ON"
+    ET.SubElement(root, "Record").text = "OFF"
+    return _tostring(root)
+
+
+# 需要转义、含中文、空值和缺省字段的输入
+NAMES = ["Camera 1", "大门 <东侧> & 停车场", "a>b", "&amp;", '"quoted" \'x\'', "", "\t tab \n line"]
+SNS = ["1", "17430", "", None, "<1&2>"]
+
+
+def make_channels(count: int):
+    channels = []
+    for index in range(count):
+        channels.append({
+            "channel_id": f"{DEVICE_ID[:-3]}{index + 1:03d}",
+            "name": NAMES[index % len(NAMES)],
+            "manufacturer": "SimCamera & Co",
+            "model": "SC-2000",
+        })
+    channels.append({})  # 缺省字段
+    return channels
+
+
+def check():
+    """模板路径与 ElementTree 路径输出逐字节一致"""
+    for sn in SNS:
+        for status in ("OK", "ERROR", ""):
+            if sn is None:
+                # 心跳的 sn=None 表示使用当前时间戳
+                continue
+            assert XMLBuilder.build_keepalive(DEVICE_ID, status, sn=sn) == et_keepalive(DEVICE_ID, status, sn)
+            assert XMLBuilder.prerender_keepalive(DEVICE_ID, status).render(sn) == et_keepalive(DEVICE_ID, status, sn)
+        for status in ("ON", "OFF"):
+            expected = et_device_status(DEVICE_ID, sn, status)
+            assert XMLBuilder.build_device_status_response(DEVICE_ID, sn, status) == expected
+            assert XMLBuilder.prerender_device_status(DEVICE_ID, status).render(sn) == expected
+        for count in (0, 1, 16):
+            channels = make_channels(count) if count else []
+            assert XMLBuilder.build_catalog_response(DEVICE_ID, sn, channels) == et_catalog(DEVICE_ID, sn, channels)
+        for name in NAMES:
+            info = {"name": name, "manufacturer": "Sim<Camera>", "firmware": "", "channel_count": 4}
+            assert XMLBuilder.build_device_info_response(DEVICE_ID, sn, info) == et_device_info(DEVICE_ID, sn, info)
+        assert XMLBuilder.build_device_info_response(DEVICE_ID, sn, {}) == et_device_info(DEVICE_ID, sn, {})
+
+    # 分片目录响应：每片不超过预算，各片 SumNum 相同，合并后的通道与单文档一致
+    channels = make_channels(300)
+    whole = XMLBuilder.build_catalog_response(DEVICE_ID, "17430", channels)
+    for budget in (1200, 4000, 100):
+        parts = XMLBuilder.build_catalog_parts(DEVICE_ID, "17430", channels, max_body_bytes=budget)
+        items = []
+        for part in parts:
+            root = ET.fromstring(part[part.index("?>") + 2:])
+            assert root.findtext("SumNum") == str(len(channels))
+            device_list = root.find("DeviceList")
+            assert device_list.get("Num") == str(len(device_list))
+            assert len(part.encode("utf-8")) <= budget or len(device_list) == 1
+            items.extend(ET.tostring(item, encoding="unicode") for item in device_list)
+        root = ET.fromstring(whole[whole.index("?>") + 2:])
+        assert items == [ET.tostring(item, encoding="unicode") for item in root.find("DeviceList")]
+    assert XMLBuilder.build_catalog_parts(DEVICE_ID, "1", [], max_body_bytes=1200) == \
+        [XMLBuilder.build_catalog_response(DEVICE_ID, "1", [])]
+
+    # 逐片录像响应：不分片时与 ElementTree 版 build_record_info_response 一致，分片后记录不丢失
+    start, end = datetime(2024, 1, 1), datetime(2024, 1, 2)
+    index = RecordIndex(make_channels(2))
+    channels = index.select_channels(None)
+    total = index.count(channels, start, end)
+    records = list(index.iter_records(channels, start, end))
+    assert total == len(records)
+    for sn in ("1", ""):
+        expected = XMLBuilder.build_record_info_response(DEVICE_ID, sn, records[:50])
+        assert list(XMLBuilder.build_record_info_parts(DEVICE_ID, sn, 50, records[:50])) == [expected]
+        assert list(XMLBuilder.build_record_info_parts(DEVICE_ID, sn, 0, [], 1200)) == \
+            [XMLBuilder.build_record_info_response(DEVICE_ID, sn, [])]
+    parts = list(XMLBuilder.build_record_info_parts(DEVICE_ID, "7", total, iter(records), 1200))
+    received = 0
+    for part in parts:
+        assert len(part.encode("utf-8")) <= 1200
+        root = ET.fromstring(part[part.index("?>") + 2:])
+        assert root.findtext("SumNum") == str(total)
+        record_list = root.find("RecordList")
+        assert record_list.get("Num") == str(len(record_list))
+        received += len(record_list)
+    assert received == total
+
+
+def bench(name: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    per_call = seconds / number * 1e6
+    print(f"  {name:<28} {per_call:8.2f} µs/msg")
+    return per_call
+
+
+def compare(title: str, old, new, number: int):
+    print(f"{title}：")
+    old_time = bench("ElementTree", old, number)
+    new_time = bench("string template", new, number)
+    print(f"  加速比: {old_time / new_time:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="XML 构建微基准与一致性检查")
+    parser.add_argument("number", nargs="?", type=int, default=20000, help="每轮执行次数（共 5 轮，取最快一轮）")
+    args = parser.parse_args()
+    number = args.number
+    check()
+    print(f"XML 构建基准（{number} 次 × 5 轮，取最快一轮）")
+
+    keepalive = XMLBuilder.prerender_keepalive(DEVICE_ID)
+    compare("心跳（预渲染）",
+            lambda: et_keepalive(DEVICE_ID, "OK", "1760000000000"),
+            lambda: keepalive.render("1760000000000"), number)
+
+    status = XMLBuilder.prerender_device_status(DEVICE_ID)
+    compare("设备状态（预渲染）",
+            lambda: et_device_status(DEVICE_ID, "17430", "ON"),
+            lambda: status.render("17430"), number)
+
+    info = {"name": "大门摄像机", "manufacturer": "SimCamera", "model": "SC-2000",
+            "firmware": "V1.0.0", "channel_count": 4}
+    compare("设备信息",
+            lambda: et_device_info(DEVICE_ID, "17430", info),
+            lambda: XMLBuilder.build_device_info_response(DEVICE_ID, "17430", info), number)
+
+    channels = make_channels(16)[:16]
+    compare("目录（16 通道）",
+            lambda: et_catalog(DEVICE_ID, "17430", channels),
+            lambda: XMLBuilder.build_catalog_response(DEVICE_ID, "17430", channels), number // 10)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+生成 RTP 包缓存文件（MEDIA_MODE=replay 使用）
+ps 格式：把 H.264 MP4 直接封装为 GB28181 PS（不重新编码，不需要 FFmpeg）
+ts 格式：用 FFmpeg 按编码配置编码一次并打包为 MPEG-TS over RTP
+运行时回放缓存文件不再需要 FFmpeg
+"""
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from media_server import ENCODER_PROFILES, DEFAULT_PROFILE  # noqa: E402
+from rtp_replay import build_cache, build_ps_cache, default_cache_path  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成 RTP 包缓存文件")
+    parser.add_argument("video_file", nargs="?", default=os.getenv("VIDEO_FILE", "media/sample.mp4"),
+                        help="视频文件路径（默认取 VIDEO_FILE）")
+    parser.add_argument("-o", "--output", help="缓存文件路径（默认为视频文件路径加 .rtp）")
+    parser.add_argument("--format", default="ps", choices=("ps", "ts"),
+                        help="负载格式：ps 为进程内 PS 封装（需要 H.264 MP4），ts 为 FFmpeg 编码的 MPEG-TS")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=sorted(ENCODER_PROFILES),
+                        help="编码配置（仅 ts 格式）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if not os.path.exists(args.video_file):
+        print(f"❌ 视频文件不存在: {args.video_file}")
+        return 1
+
+    output = args.output or default_cache_path(args.video_file)
+    try:
+        if args.format == "ps":
+            count, seconds = build_ps_cache(args.video_file, output)
+        else:
+            count, seconds = build_cache(args.video_file, output, ENCODER_PROFILES[args.profile])
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"❌ 生成失败: {e}")
+        return 1
+
+    size = os.path.getsize(output)
+    print(f"✅ 已生成 {output}: {count} 个 RTP 包，循环周期 {seconds:.1f} 秒，"
+          f"{size / 1024 / 1024:.1f} MB（平均 {size * 8 / seconds / 1e6:.2f} Mbit/s）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,9 +3,11 @@
 处理平台的 Catalog 查询请求
 """
 import logging
-from typing import Dict, Any, List
-from datetime import datetime, timedelta
-from xml_builder import XMLBuilder, parse_xml_message
+from typing import Dict, Any, Iterator, List, Callable, Optional, Union
+import itertools
+from datetime import datetime
+from xml_builder import XMLBuilder, PrerenderedXML, SN_SLOT, parse_manscdp
+from record_index import RecordIndex, parse_time_range, DEFAULT_SEGMENT_SECONDS, DEFAULT_ALARMS_PER_HOUR
 from gb28181_protocol import (
     get_device_type_code, extract_device_type_from_id,
     VIDEO_DEVICE_TYPES, RECORDING_DEVICE_TYPES, ALARM_DEVICE_TYPES,
@@ -18,13 +20,32 @@ logger = logging.getLogger(__name__)
 class CatalogHandler:
     """目录查询处理器"""
     
-    def __init__(self, device_config: Dict[str, Any]):
+    def __init__(self, device_config: Dict[str, Any], record_options: Optional[Dict[str, Any]] = None):
         """
         初始化目录处理器
         
         Args:
             device_config: 设备配置
+            record_options: 模拟录像参数（segment_seconds / alarms_per_hour / max_results）
         """
+        record_options = record_options or {}
+        # 响应缓存：查询类型 -> 以 SN 占位预渲染的响应（各分片），配置更新时整体失效
+        self._response_cache: Dict[str, List[PrerenderedXML]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # 目录、录像查询响应每片消息体的字节预算，为 None 时不分片
+        self.part_bytes: Optional[int] = None
+        # 模拟录像参数：定时录像文件时长（秒）、每小时报警录像数、单次查询最多返回的录像数（0 为不限）
+        self.record_segment_seconds = record_options.get("segment_seconds", DEFAULT_SEGMENT_SECONDS)
+        self.record_alarms_per_hour = record_options.get("alarms_per_hour", DEFAULT_ALARMS_PER_HOUR)
+        self.record_max_results = record_options.get("max_results", 0)
+        
+        self._load_config(device_config)
+        
+        logger.info(f"CatalogHandler initialized for device {self.device_id}, type: {self.device_type}")
+    
+    def _load_config(self, device_config: Dict[str, Any]):
+        """读取设备配置中与查询响应相关的字段"""
         self.device_id = device_config.get("device_id")
         self.device_name = device_config.get("name")
         self.manufacturer = device_config.get("manufacturer", "SimCamera")
@@ -32,103 +53,114 @@ class CatalogHandler:
         self.firmware = device_config.get("firmware", "V1.0.0")
         self.channels = device_config.get("channels", [])
         self.device_type = device_config.get("device_type", "IPC")  # 默认为网络摄像机
+        # 设备状态响应除 SN 外固定，预先渲染
+        self.device_status_body = XMLBuilder.prerender_device_status(self.device_id, status="ON")
+        # 录像索引按查询时间范围即时计算，不保存录像列表
+        self.record_index = RecordIndex(self.channels, self.record_segment_seconds, self.record_alarms_per_hour)
+    
+    def update_config(self, device_config: Dict[str, Any]):
+        """
+        更新设备配置，并使已缓存的查询响应失效
         
-        logger.info(f"CatalogHandler initialized for device {self.device_id}, type: {self.device_type}")
+        Args:
+            device_config: 新的设备配置
+        """
+        self._load_config(device_config)
+        # 替换为新字典而非清空：并发中的查询即使写回旧字典也不会污染新缓存
+        self._response_cache = {}
+        logger.info(f"CatalogHandler config updated for device {self.device_id}, response cache invalidated")
     
-    def handle_catalog_query(self, xml_message: str) -> str:
+    def set_part_bytes(self, max_body_bytes: Optional[int]):
+        """
+        设置目录、录像查询响应分片的字节预算（由 SIP 客户端按 MTU 和消息头长度计算）
+        
+        Args:
+            max_body_bytes: 每片消息体的字节预算，为 None 时不分片
+        """
+        if max_body_bytes != self.part_bytes:
+            self.part_bytes = max_body_bytes
+            self._response_cache = {}
+    
+    def cache_stats(self) -> Dict[str, int]:
+        """
+        获取响应缓存统计
+        
+        Returns:
+            dict: 命中次数、未命中次数和缓存条目数
+        """
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "entries": len(self._response_cache),
+        }
+    
+    def _cached_response(self, cmd_type: str, sn: str, build: Callable[[str], List[str]]) -> List[str]:
+        """
+        从缓存中取出响应并填入 SN，未命中时渲染并缓存
+        
+        Args:
+            cmd_type: 查询类型（缓存键）
+            sn: 命令序列号
+            build: 以给定 SN 构建完整响应（各分片）的函数
+            
+        Returns:
+            list: 各分片的 XML 响应消息
+        """
+        cache = self._response_cache
+        cached = cache.get(cmd_type)
+        if cached is None:
+            self.cache_misses += 1
+            cached = cache[cmd_type] = [PrerenderedXML(part) for part in build(SN_SLOT)]
+        else:
+            self.cache_hits += 1
+        return [part.render(sn) for part in cached]
+    
+    def handle_catalog_query(self, xml_message: Union[str, Dict[str, Any]]) -> List[str]:
         """
         处理目录查询请求
         
+        通道较多时按 part_bytes 分为多条响应，各条 SumNum 相同
+        
         Args:
-            xml_message: XML 查询消息
+            xml_message: XML 查询消息，或 parse_manscdp 的解析结果
             
         Returns:
-            str: XML 响应消息
+            list: XML 响应消息（各分片）
         """
         try:
-            parsed = parse_xml_message(xml_message)
+            parsed = parse_manscdp(xml_message)
             sn = parsed.get("SN", "1")
             
             logger.info(f"Processing Catalog query with SN={sn}")
             
-            # 构建通道信息列表
-            channel_list = []
-            for channel in self.channels:
-                channel_info = {
-                    "channel_id": channel.get("channel_id"),
-                    "name": channel.get("name", "Camera"),
-                    "manufacturer": self.manufacturer,
-                    "model": self.model,
-                }
-                channel_list.append(channel_info)
-            
-            # 构建响应
-            response = XMLBuilder.build_catalog_response(
-                device_id=self.device_id,
-                sn=sn,
-                channels=channel_list
-            )
+            parts = self._cached_response("Catalog", sn, self._build_catalog_parts)
             
-            logger.debug(f"Catalog response: {response}")
-            return response
+            logger.debug(f"Catalog response ({len(parts)} part(s)): {parts}")
+            return parts
             
         except Exception as e:
             logger.error(f"Error handling catalog query: {e}", exc_info=True)
             return None
     
-    def handle_device_info_query(self, xml_message: str) -> str:
+    def handle_device_info_query(self, xml_message: Union[str, Dict[str, Any]]) -> str:
         """
         处理设备信息查询请求
         
         Args:
-            xml_message: XML 查询消息
+            xml_message: XML 查询消息，或 parse_manscdp 的解析结果
             
         Returns:
             str: XML 响应消息
         """
         try:
-            parsed = parse_xml_message(xml_message)
+            parsed = parse_manscdp(xml_message)
             sn = parsed.get("SN", "1")
             
             logger.info(f"Processing DeviceInfo query with SN={sn}")
             
-            # 根据设备类型设置设备能力
-            device_info = {
-                "name": self.device_name,
-                "manufacturer": self.manufacturer,
-                "model": self.model,
-                "firmware": self.firmware,
-                "channel_count": len(self.channels)
-            }
-            
-            # 设备类型特定属性
-            if self.device_type in VIDEO_DEVICE_TYPES:
-                if self.device_type not in ["显示器"]:
-                    device_info["ptz_support"] = any(ch.get("ptz_enabled", False) for ch in self.channels)
-            
-            if self.device_type in RECORDING_DEVICE_TYPES:
-                device_info["recording_support"] = True
-            
-            if self.device_type in ALARM_DEVICE_TYPES:
-                if self.device_type == "报警输出设备":
-                    device_info["alarm_output_support"] = True
-                else:
-                    device_info["alarm_support"] = True
-            
-            if self.device_type in AUDIO_DEVICE_TYPES:
-                device_info["audio_support"] = True
-            
-            if self.device_type in DISPLAY_DEVICE_TYPES:
-                device_info["display_support"] = True
-            
-            if self.device_type == "移动传输设备":
-                device_info["mobile_support"] = True
-            
-            response = XMLBuilder.build_device_info_response(
-                device_id=self.device_id,
-                sn=sn,
-                device_info=device_info
-            )
+            response = self._cached_response(
+                "DeviceInfo", sn, lambda slot: [self._build_device_info_response(slot)]
+            )[0]
             
             logger.debug(f"DeviceInfo response: {response}")
             return response
@@ -137,27 +169,99 @@ class CatalogHandler:
             logger.error(f"Error handling device info query: {e}", exc_info=True)
             return None
     
-    def handle_device_status_query(self, xml_message: str) -> str:
+    def _build_catalog_parts(self, sn: str) -> List[str]:
+        """
+        根据当前配置构建目录查询响应（按字节预算分片）
+        
+        Args:
+            sn: 命令序列号
+            
+        Returns:
+            list: 各分片的 XML 响应消息
+        """
+        # 构建通道信息列表
+        channel_list = []
+        for channel in self.channels:
+            channel_info = {
+                "channel_id": channel.get("channel_id"),
+                "name": channel.get("name", "Camera"),
+                "manufacturer": self.manufacturer,
+                "model": self.model,
+            }
+            channel_list.append(channel_info)
+        
+        return XMLBuilder.build_catalog_parts(
+            device_id=self.device_id,
+            sn=sn,
+            channels=channel_list,
+            max_body_bytes=self.part_bytes
+        )
+    
+    def _build_device_info_response(self, sn: str) -> str:
+        """
+        根据当前配置构建设备信息查询响应
+        
+        Args:
+            sn: 命令序列号
+            
+        Returns:
+            str: XML 响应消息
+        """
+        # 根据设备类型设置设备能力
+        device_info = {
+            "name": self.device_name,
+            "manufacturer": self.manufacturer,
+            "model": self.model,
+            "firmware": self.firmware,
+            "channel_count": len(self.channels)
+        }
+        
+        # 设备类型特定属性
+        if self.device_type in VIDEO_DEVICE_TYPES:
+            if self.device_type not in ["显示器"]:
+                device_info["ptz_support"] = any(ch.get("ptz_enabled", False) for ch in self.channels)
+        
+        if self.device_type in RECORDING_DEVICE_TYPES:
+            device_info["recording_support"] = True
+        
+        if self.device_type in ALARM_DEVICE_TYPES:
+            if self.device_type == "报警输出设备":
+                device_info["alarm_output_support"] = True
+            else:
+                device_info["alarm_support"] = True
+        
+        if self.device_type in AUDIO_DEVICE_TYPES:
+            device_info["audio_support"] = True
+        
+        if self.device_type in DISPLAY_DEVICE_TYPES:
+            device_info["display_support"] = True
+        
+        if self.device_type == "移动传输设备":
+            device_info["mobile_support"] = True
+        
+        return XMLBuilder.build_device_info_response(
+            device_id=self.device_id,
+            sn=sn,
+            device_info=device_info
+        )
+    
+    def handle_device_status_query(self, xml_message: Union[str, Dict[str, Any]]) -> str:
         """
         处理设备状态查询请求
         
         Args:
-            xml_message: XML 查询消息
+            xml_message: XML 查询消息，或 parse_manscdp 的解析结果
             
         Returns:
             str: XML 响应消息
         """
         try:
-            parsed = parse_xml_message(xml_message)
+            parsed = parse_manscdp(xml_message)
             sn = parsed.get("SN", "1")
             
             logger.info(f"Processing DeviceStatus query with SN={sn}")
             
-            response = XMLBuilder.build_device_status_response(
-                device_id=self.device_id,
-                sn=sn,
-                status="ON"
-            )
+            response = self.device_status_body.render(sn)
             
             logger.debug(f"DeviceStatus response: {response}")
             return response
@@ -166,18 +270,21 @@ class CatalogHandler:
             logger.error(f"Error handling device status query: {e}", exc_info=True)
             return None
     
-    def handle_record_info_query(self, xml_message: str) -> str:
+    def handle_record_info_query(self, xml_message: Union[str, Dict[str, Any]]) -> Optional[Iterator[str]]:
         """
         处理录像信息查询请求（NVR/DVR 功能）
         
+        录像记录由录像索引按需计算，响应按 part_bytes 分片并逐片生成，
+        长时间范围的查询不会一次性生成全部记录
+        
         Args:
-            xml_message: XML 查询消息
+            xml_message: XML 查询消息，或 parse_manscdp 的解析结果
             
         Returns:
-            str: XML 响应消息
+            iterator: 逐片生成的 XML 响应消息
         """
         try:
-            parsed = parse_xml_message(xml_message)
+            parsed = parse_manscdp(xml_message)
             sn = parsed.get("SN", "1")
             start_time = parsed.get("StartTime", "")
             end_time = parsed.get("EndTime", "")
@@ -185,84 +292,32 @@ class CatalogHandler:
             logger.info(f"Processing RecordInfo query with SN={sn}, StartTime={start_time}, EndTime={end_time}")
             
             # 检查设备类型，只有 NVR/DVR 支持录像查询
+            time_range = None
             if self.device_type not in RECORDING_DEVICE_TYPES:
                 logger.warning(f"Device type {self.device_type} does not support RecordInfo query")
-                # 返回空录像列表
-                response = XMLBuilder.build_record_info_response(
-                    device_id=self.device_id,
-                    sn=sn,
-                    records=[]
-                )
             else:
-                # 为 NVR/DVR 生成模拟录像文件列表
-                # 在实际应用中，这里应该查询真实的录像文件
-                records = self._generate_mock_records(start_time, end_time)
-                response = XMLBuilder.build_record_info_response(
-                    device_id=self.device_id,
-                    sn=sn,
-                    records=records
-                )
+                time_range = parse_time_range(start_time, end_time)
             
-            logger.debug(f"RecordInfo response: {response}")
-            return response
+            if time_range is None:
+                # 返回空录像列表
+                return XMLBuilder.build_record_info_parts(self.device_id, sn, 0, (), self.part_bytes)
+            
+            start_dt, end_dt = time_range
+            channels = self.record_index.select_channels(parsed.get("DeviceID"))
+            total = self.record_index.count(channels, start_dt, end_dt)
+            records = self.record_index.iter_records(channels, start_dt, end_dt)
+            if self.record_max_results and total > self.record_max_results:
+                total = self.record_max_results
+                records = itertools.islice(records, total)
+            
+            logger.info(f"RecordInfo query matched {total} record(s) on {len(channels)} channel(s) "
+                        f"for device {self.device_id}")
+            return XMLBuilder.build_record_info_parts(self.device_id, sn, total, records, self.part_bytes)
             
         except Exception as e:
             logger.error(f"Error handling record info query: {e}", exc_info=True)
             return None
     
-    def _generate_mock_records(self, start_time: str, end_time: str) -> list:
-        """
-        生成模拟录像文件记录（用于测试）
-        
-        Args:
-            start_time: 开始时间
-            end_time: 结束时间
-            
-        Returns:
-            list: 录像文件列表
-        """
-        # 解析时间
-        try:
-            if start_time and end_time:
-                start_dt = datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S")
-                end_dt = datetime.strptime(end_time, "%Y-%m-%dT%H:%M:%S")
-            else:
-                # 如果没有指定时间，返回最近24小时的模拟录像
-                end_dt = datetime.now()
-                start_dt = end_dt - timedelta(hours=24)
-        except (ValueError, TypeError) as e:
-            # 时间解析失败，返回空列表
-            logger.warning(f"Failed to parse time range: {e}")
-            return []
-        
-        # 生成模拟录像文件（每小时一个文件）
-        records = []
-        current = start_dt
-        file_num = 1
-        
-        while current < end_dt and file_num <= 10:  # 最多返回10个文件
-            record_end = min(current + timedelta(hours=1), end_dt)
-            
-            # 为每个通道生成录像
-            for channel in self.channels:
-                record = {
-                    "device_id": channel.get("channel_id"),
-                    "name": f"{channel.get('name', 'Channel')}_Record_{file_num}",
-                    "file_path": f"/record/{current.strftime('%Y%m%d')}/{channel.get('channel_id')}/{file_num}.mp4",
-                    "start_time": current.strftime("%Y-%m-%dT%H:%M:%S"),
-                    "end_time": record_end.strftime("%Y-%m-%dT%H:%M:%S"),
-                    "secrecy": "0",
-                    "type": "time",  # time: 定时录像, alarm: 报警录像, manual: 手动录像
-                    "file_size": "102400"  # 100MB（模拟）
-                }
-                records.append(record)
-            
-            current = record_end
-            file_num += 1
-        
-        logger.info(f"Generated {len(records)} mock record files for device {self.device_id}")
-        return records
-    
     def send_alarm_notification(self, alarm_type: str = "Motion", alarm_priority: int = 3) -> str:
         """
         发送报警通知（用于报警类设备）
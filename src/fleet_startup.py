@@ -0,0 +1,271 @@
+"""
+设备群启动调度器
+按令牌桶速率并发注册设备，支持爬坡曲线、并发上限和实时进度统计
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# 爬坡曲线
+RAMP_CONSTANT = "constant"  # 始终以目标速率启动
+RAMP_LINEAR = "linear"      # 在爬坡时间内从 0 线性增长到目标速率
+
+
+class TokenBucket:
+    """令牌桶限速器（非线程安全，由调度方串行调用）"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数，<= 0 表示不限速
+            burst: 桶容量（允许的突发数量）
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        预留一个令牌
+
+        Returns:
+            float: 需要等待的秒数（0 表示可立即执行）
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class StartupProgress:
+    """启动进度计数器"""
+
+    def __init__(self, total: int):
+        """
+        初始化进度计数器
+
+        Args:
+            total: 设备总数
+        """
+        self.total = total
+        self.dispatched = 0
+        self.in_flight = 0
+        self.registered = 0
+        self.failed = 0
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.latencies: List[float] = []
+        self._lock = threading.Lock()
+
+    def on_dispatch(self):
+        with self._lock:
+            self.dispatched += 1
+            self.in_flight += 1
+
+    def on_done(self, ok: bool, latency: float):
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.registered += 1
+                self.latencies.append(latency)
+            else:
+                self.failed += 1
+            if self.registered + self.failed == self.total:
+                self.end_time = time.monotonic()
+
+    @property
+    def finished(self) -> bool:
+        return self.end_time is not None or self.total == 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取当前进度
+
+        Returns:
+            dict: 进度统计
+        """
+        with self._lock:
+            elapsed = (self.end_time or time.monotonic()) - self.start_time
+            latencies = sorted(self.latencies)
+
+        summary = {
+            "total": self.total,
+            "dispatched": self.dispatched,
+            "in_flight": self.in_flight,
+            "registered": self.registered,
+            "failed": self.failed,
+            "finished": self.finished,
+            "elapsed": round(elapsed, 3),
+            "registrations_per_second": round(self.registered / elapsed, 1) if elapsed > 0 else 0.0,
+            # 全部设备注册成功所用时间，存在失败设备时为 None
+            "time_to_all_registered": (
+                round(elapsed, 3) if self.finished and self.registered == self.total else None
+            ),
+        }
+        if latencies:
+            summary["latency_p50"] = round(latencies[len(latencies) // 2], 4)
+            summary["latency_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4)
+            summary["latency_max"] = round(latencies[-1], 4)
+        return summary
+
+
+class FleetStarter:
+    """设备群启动调度器"""
+
+    def __init__(self, rate: float = 0, max_in_flight: int = 100, burst: Optional[int] = None,
+                 ramp: str = RAMP_CONSTANT, ramp_seconds: float = 0, progress_interval: float = 5):
+        """
+        初始化启动调度器
+
+        Args:
+            rate: 目标注册速率（个/秒），<= 0 表示不限速
+            max_in_flight: 同时进行中的注册数量上限
+            burst: 令牌桶容量，默认与速率相同（至少为 1）
+            ramp: 爬坡曲线 (constant/linear)
+            ramp_seconds: 爬坡时间（秒），仅 linear 曲线有效
+            progress_interval: 进度日志输出间隔（秒）
+        """
+        self.rate = rate
+        self.max_in_flight = max(1, max_in_flight)
+        self.burst = burst if burst else max(1, int(rate))
+        self.ramp = ramp
+        self.ramp_seconds = ramp_seconds
+        self.progress_interval = progress_interval
+        self.progress: Optional[StartupProgress] = None
+
+    def _rate_at(self, elapsed: float) -> float:
+        """计算爬坡曲线在指定时刻的速率"""
+        if self.rate <= 0 or self.ramp != RAMP_LINEAR or self.ramp_seconds <= 0:
+            return self.rate
+        # 线性爬坡，速率下限 1 个/秒避免起步阶段长时间停顿
+        return max(1.0, self.rate * min(1.0, elapsed / self.ramp_seconds))
+
+    def _next_delay(self, bucket: TokenBucket) -> float:
+        """按爬坡曲线更新速率并预留令牌"""
+        bucket.rate = self._rate_at(time.monotonic() - self.progress.start_time)
+        return bucket.reserve()
+
+    def run_threaded(self, clients: List) -> List:
+        """
+        线程模式：在线程池中并发调用 client.start()
+
+        Args:
+            clients: SIPClient 列表
+
+        Returns:
+            list: 启动成功的 SIPClient 列表
+        """
+        self.progress = StartupProgress(len(clients))
+        bucket = TokenBucket(self.rate, self.burst)
+        in_flight = threading.Semaphore(self.max_in_flight)
+        results = [False] * len(clients)
+        reporter = self._start_reporter()
+
+        def run_one(index: int, client):
+            started = time.monotonic()
+            ok = False
+            try:
+                ok = client.start()
+            except Exception as e:
+                logger.error(f"Error starting device {client.device_id}: {e}", exc_info=True)
+            finally:
+                results[index] = ok
+                self.progress.on_done(ok, time.monotonic() - started)
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="startup") as pool:
+            for index, client in enumerate(clients):
+                in_flight.acquire()
+                delay = self._next_delay(bucket)
+                if delay > 0:
+                    time.sleep(delay)
+                self.progress.on_dispatch()
+                pool.submit(run_one, index, client)
+
+        reporter.set()
+        self._log_summary()
+        return [client for client, ok in zip(clients, results) if ok]
+
+    async def run_async(self, clients: List) -> List:
+        """
+        异步模式：在事件循环中并发执行 client.start_async()
+
+        Args:
+            clients: SIPClient 列表
+
+        Returns:
+            list: 启动成功的 SIPClient 列表
+        """
+        self.progress = StartupProgress(len(clients))
+        bucket = TokenBucket(self.rate, self.burst)
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        reporter = self._start_reporter()
+
+        async def run_one(client) -> bool:
+            started = time.monotonic()
+            ok = False
+            try:
+                ok = await client.start_async()
+            except Exception as e:
+                logger.error(f"Error starting device {client.device_id}: {e}", exc_info=True)
+            finally:
+                self.progress.on_done(ok, time.monotonic() - started)
+                in_flight.release()
+            return ok
+
+        tasks = []
+        for client in clients:
+            await in_flight.acquire()
+            delay = self._next_delay(bucket)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.progress.on_dispatch()
+            tasks.append(asyncio.ensure_future(run_one(client)))
+
+        results = await asyncio.gather(*tasks)
+        reporter.set()
+        self._log_summary()
+        return [client for client, ok in zip(clients, results) if ok]
+
+    def _start_reporter(self) -> threading.Event:
+        """启动进度日志线程，返回用于停止的事件"""
+        stop_event = threading.Event()
+        if self.progress_interval <= 0:
+            return stop_event
+
+        def report():
+            while not stop_event.wait(self.progress_interval):
+                p = self.progress.snapshot()
+                logger.info(
+                    f"Startup progress: {p['registered']}/{p['total']} registered, "
+                    f"{p['in_flight']} in flight, {p['failed']} failed, "
+                    f"{p['registrations_per_second']}/s"
+                )
+
+        threading.Thread(target=report, name="startup-progress", daemon=True).start()
+        return stop_event
+
+    def _log_summary(self):
+        """输出启动汇总"""
+        p = self.progress.snapshot()
+        logger.info(
+            f"Startup finished: {p['registered']}/{p['total']} registered, {p['failed']} failed "
+            f"in {p['elapsed']}s ({p['registrations_per_second']}/s), "
+            f"time to all registered: {p['time_to_all_registered']}, "
+            f"latency p50/p95/max: {p.get('latency_p50')}/{p.get('latency_p95')}/{p.get('latency_max')}s"
+        )
@@ -2,6 +2,8 @@
 GB28181 Protocol Constants and Utilities
 支持 GB/T28181-2011、2016、2022 版本
 """
+import math
+from typing import Optional
 
 # SIP 方法
 SIP_METHOD_REGISTER = "REGISTER"
@@ -10,6 +12,12 @@ SIP_METHOD_INVITE = "INVITE"
 SIP_METHOD_ACK = "ACK"
 SIP_METHOD_BYE = "BYE"
 SIP_METHOD_CANCEL = "CANCEL"
+SIP_METHOD_INFO = "INFO"
+
+# 实时流 / 录像回放 / 录像下载会话（INVITE SDP 的 s= 行）
+SESSION_PLAY = "Play"
+SESSION_PLAYBACK = "Playback"
+SESSION_DOWNLOAD = "Download"
 
 # GB28181 命令类型
 CMD_CATALOG = "Catalog"
@@ -18,6 +26,14 @@ CMD_DEVICE_STATUS = "DeviceStatus"
 CMD_DEVICE_CONTROL = "DeviceControl"
 CMD_KEEPALIVE = "Keepalive"
 CMD_RECORD_INFO = "RecordInfo"
+CMD_MEDIA_STATUS = "MediaStatus"
+
+# 媒体通知类型：121 表示录像回放、下载的文件发送完毕
+NOTIFY_TYPE_MEDIA_END = "121"
+
+# 录像回放倍速（MANSRTSP Scale）和下载倍速（SDP a=downloadspeed）的范围
+PLAYBACK_SCALE_MIN = 1 / 16
+PLAYBACK_SCALE_MAX = 256.0
 
 # PTZ 命令字节位
 PTZ_STOP = 0x00
@@ -170,6 +186,57 @@ def parse_ptz_command(ptz_data: str) -> dict:
         return {"error": f"Parse error: {str(e)}"}
 
 
+def parse_mansrtsp(body: str) -> dict:
+    """
+    解析录像回放控制命令（INFO 消息体，Application/MANSRTSP）
+    格式: PLAY RTSP/1.0 / PAUSE RTSP/1.0 / TEARDOWN RTSP/1.0，之后为 CSeq、Scale、Range、PauseTime 等头部
+    
+    Args:
+        body: 消息体
+        
+    Returns:
+        dict: method（大写）、cseq、scale（浮点数）、range（npt 起点秒数，now 或未指定时为 None）
+    """
+    lines = [line.strip() for line in body.replace("\r\n", "\n").split("\n") if line.strip()]
+    if not lines:
+        return {"error": "Empty MANSRTSP body"}
+    
+    result = {"method": lines[0].split()[0].upper(), "cseq": None, "scale": None, "range": None}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        name, value = name.strip().lower(), value.strip()
+        try:
+            if name == "cseq":
+                result["cseq"] = int(value)
+            elif name == "scale":
+                result["scale"] = float(value)
+            elif name == "range" and value.lower().startswith("npt="):
+                # npt=100- 从录像开始后 100 秒处播放；npt=now- 从当前位置继续
+                start = value[4:].partition("-")[0].strip()
+                if start and start.lower() != "now":
+                    result["range"] = float(start)
+            if not all(math.isfinite(result[key]) for key in ("scale", "range") if result[key] is not None):
+                raise ValueError(value)
+        except ValueError:
+            return {"error": f"Invalid MANSRTSP header: {line}"}
+    return result
+
+
+def clamp_scale(scale: Optional[float]) -> Optional[float]:
+    """
+    把回放 / 下载倍速限制在 [PLAYBACK_SCALE_MIN, PLAYBACK_SCALE_MAX] 范围内
+    
+    Args:
+        scale: 请求的倍速
+        
+    Returns:
+        float: 限制后的倍速，为空、非有限值（inf / nan）或不大于 0（倒放）时返回 None
+    """
+    if scale is None or not math.isfinite(scale) or scale <= 0:
+        return None
+    return min(PLAYBACK_SCALE_MAX, max(PLAYBACK_SCALE_MIN, scale))
+
+
 def calculate_checksum(data: str) -> str:
     """
     计算 PTZ 命令校验和
@@ -0,0 +1,217 @@
+"""
+媒体文件关键帧索引
+每个媒体文件只扫描一次，记录每个关键帧（IDR）的字节位置、PTS（90kHz）和大小，
+索引保存在媒体文件旁（路径加 .kfi），媒体文件修改时间或大小变化后重新生成；
+新会话据此从最近的 GOP 开始发送，平台在一个帧间隔内即可解码出画面
+"""
+import json
+import logging
+import os
+import struct
+import subprocess
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Dict, Optional, Tuple
+
+from mp4_reader import MP4VideoTrack
+from rtp_replay import CACHE_MAGIC, RTP_CLOCK, RTPCache
+
+logger = logging.getLogger(__name__)
+
+# 索引文件格式：文件头 + 每个关键帧一条记录
+INDEX_MAGIC = b"GBKFI001"
+_HEADER = struct.Struct("<8sdQI")  # 魔数, 媒体文件修改时间, 媒体文件大小, 关键帧数
+_RECORD = struct.Struct("<QqI")    # 字节位置, PTS（90kHz）, 大小
+# ffprobe 超时（秒）
+PROBE_TIMEOUT = 60
+
+
+def default_index_path(media_file: str) -> str:
+    """媒体文件对应的关键帧索引文件路径"""
+    return media_file + ".kfi"
+
+
+class KeyframeIndex:
+    """媒体文件的关键帧位置表（按 PTS 升序）"""
+
+    def __init__(self, offsets: array, pts: array, sizes: array):
+        """
+        初始化关键帧索引
+
+        Args:
+            offsets: 每个关键帧在文件中的字节位置
+            pts: 每个关键帧的 PTS（90kHz）
+            sizes: 每个关键帧的字节数
+        """
+        self.offsets = offsets
+        self.pts = pts
+        self.sizes = sizes
+
+    def __len__(self) -> int:
+        return len(self.pts)
+
+    def latest(self, pts: int) -> Optional[int]:
+        """
+        PTS 不晚于指定时间的最近一个关键帧
+
+        Args:
+            pts: 时间（90kHz）
+
+        Returns:
+            int: 关键帧序号，索引为空时返回 None；早于第一个关键帧时返回 0
+        """
+        if not self.pts:
+            return None
+        return max(0, bisect_right(self.pts, pts) - 1)
+
+    def save(self, path: str, mtime: float, size: int):
+        """写入索引文件（先写临时文件，完成后替换）"""
+        temp_file = path + ".tmp"
+        with open(temp_file, "wb") as f:
+            f.write(_HEADER.pack(INDEX_MAGIC, mtime, size, len(self)))
+            for record in zip(self.offsets, self.pts, self.sizes):
+                f.write(_RECORD.pack(*record))
+        os.replace(temp_file, path)
+
+    @classmethod
+    def load(cls, path: str, mtime: float, size: int) -> Optional["KeyframeIndex"]:
+        """
+        读取索引文件
+
+        Args:
+            path: 索引文件路径
+            mtime: 媒体文件当前的修改时间
+            size: 媒体文件当前的大小
+
+        Returns:
+            KeyframeIndex: 索引，文件不存在、格式错误或与媒体文件不一致时返回 None
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, indexed_mtime, indexed_size, count = _HEADER.unpack_from(data, 0)
+        except (OSError, struct.error):
+            return None
+        if (magic != INDEX_MAGIC or indexed_mtime != mtime or indexed_size != size
+                or len(data) != _HEADER.size + count * _RECORD.size):
+            return None
+        index = cls(array("Q"), array("q"), array("L"))
+        for offset, pts, frame_size in _RECORD.iter_unpack(memoryview(data)[_HEADER.size:]):
+            index.offsets.append(offset)
+            index.pts.append(pts)
+            index.sizes.append(frame_size)
+        return index
+
+
+_cache: Dict[str, Tuple[float, int, KeyframeIndex]] = {}
+_lock = threading.Lock()
+
+
+def load_keyframe_index(media_file: str) -> Optional[KeyframeIndex]:
+    """
+    获取媒体文件的关键帧索引：内存中已有且文件未变化时直接返回，其次读取索引文件，都没有时扫描媒体文件
+
+    支持 RTP 包缓存文件、H.264 MP4（读取样本表）和 FFmpeg 可以解封装的其他格式（调用 ffprobe）
+
+    Args:
+        media_file: 媒体文件路径
+
+    Returns:
+        KeyframeIndex: 关键帧索引，文件不存在或无法识别时返回 None
+    """
+    try:
+        stat = os.stat(media_file)
+    except OSError:
+        return None
+    key = os.path.abspath(media_file)
+    with _lock:
+        cached = _cache.get(key)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+
+        path = default_index_path(media_file)
+        index = KeyframeIndex.load(path, stat.st_mtime, stat.st_size)
+        if index is None:
+            index = _index_rtp_cache(media_file) or _index_mp4(media_file) or _index_ffprobe(media_file)
+            if index is None:
+                logger.warning(f"Cannot build keyframe index for {media_file}")
+                return None
+            try:
+                index.save(path, stat.st_mtime, stat.st_size)
+            except OSError as e:
+                logger.debug(f"Cannot write keyframe index {path}: {e}")
+            logger.info(f"Built keyframe index for {media_file}: {len(index)} keyframe(s)")
+        _cache[key] = (stat.st_mtime, stat.st_size, index)
+    return index
+
+
+def _index_rtp_cache(path: str) -> Optional[KeyframeIndex]:
+    """RTP 包缓存文件：关键帧起点包的位置和 RTP 时间戳，大小为同一时间戳的所有包"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+        cache = RTPCache(path)
+    except (OSError, ValueError):
+        return None
+    try:
+        index = KeyframeIndex(array("Q"), array("q"), array("L"))
+        keyframes, stamps, lengths = cache.keyframes, cache.stamps, cache.lengths
+        for packet in range(cache.count):
+            if not keyframes[packet]:
+                continue
+            stamp, size, end = stamps[packet], 0, packet
+            while end < cache.count and stamps[end] == stamp and (end == packet or not keyframes[end]):
+                size += lengths[end]
+                end += 1
+            index.offsets.append(cache.positions[packet])
+            index.pts.append(stamp)
+            index.sizes.append(size)
+        return index
+    finally:
+        cache.close()
+
+
+def _index_mp4(path: str) -> Optional[KeyframeIndex]:
+    """H.264 MP4：样本表中的同步样本"""
+    try:
+        track = MP4VideoTrack(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    try:
+        index = KeyframeIndex(array("Q"), array("q"), array("L"))
+        scale = track.timescale or RTP_CLOCK
+        for sample in range(track.count):
+            if track.keyframes[sample]:
+                index.offsets.append(track.offsets[sample])
+                index.pts.append((track.dts[sample] + track.cts[sample]) * RTP_CLOCK // scale)
+                index.sizes.append(track.sizes[sample])
+        return index
+    finally:
+        track.close()
+
+
+def _index_ffprobe(path: str) -> Optional[KeyframeIndex]:
+    """其他格式：用 ffprobe 列出第一个视频流的关键帧包"""
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "packet=pts_time,pos,size,flags", "-of", "json", path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT)
+        packets = json.loads(result.stdout or b"{}").get("packets") or []
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        logger.debug(f"ffprobe failed for {path}: {e}")
+        return None
+    frames = []
+    for packet in packets:
+        if "K" not in packet.get("flags", ""):
+            continue
+        try:
+            frames.append((round(float(packet["pts_time"]) * RTP_CLOCK), int(packet["pos"]), int(packet["size"])))
+        except (KeyError, ValueError):
+            continue
+    if not frames:
+        return None
+    frames.sort()
+    return KeyframeIndex(array("Q", (pos for _, pos, _ in frames)), array("q", (pts for pts, _, _ in frames)),
+                         array("L", (size for _, _, size in frames)))
@@ -4,6 +4,7 @@ GB28181 摄像头模拟器主程序
 """
 import os
 import sys
+import argparse
 import logging
 import signal
 import time
@@ -12,24 +13,29 @@ from typing import List
 from dotenv import load_dotenv
 
 from sip_client import SIPClient
+from sip_engine import SIPEngine
+from fleet_startup import FleetStarter
+from timer_wheel import TimerWheel
+from worker_pool import WorkerSupervisor
+from utils import parse_port_list
 from media_server import MediaServer
 from web_interface import WebInterface
 
 # 配置日志
-def setup_logging(log_level: str, log_dir: str):
+def setup_logging(log_level: str, log_dir: str, log_file: str = 'simulator.log'):
     """配置日志系统"""
     # 创建日志目录
     os.makedirs(log_dir, exist_ok=True)
     
     # 日志格式
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    log_format = '%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
     
     # 配置根日志记录器
     logging.basicConfig(
         level=getattr(logging, log_level.upper(), logging.INFO),
         format=log_format,
         handlers=[
-            logging.FileHandler(os.path.join(log_dir, 'simulator.log')),
+            logging.FileHandler(os.path.join(log_dir, log_file)),
             logging.StreamHandler(sys.stdout)
         ]
     )
@@ -38,10 +44,21 @@ def setup_logging(log_level: str, log_dir: str):
 class GB28181Simulator:
     """GB28181 摄像头模拟器"""
     
-    def __init__(self):
-        """初始化模拟器"""
+    def __init__(self, devices: list = None, worker_index: int = None):
+        """
+        初始化模拟器
+        
+        Args:
+            devices: 设备配置列表，为 None 时从配置文件加载（工作进程由父进程分配）
+            worker_index: 工作进程序号，为 None 表示单进程或父进程
+        """
+        self.worker_index = worker_index
+        self.supervisor: WorkerSupervisor = None
         self.clients: List[SIPClient] = []
         self.media_server: MediaServer = None
+        self.sip_engine: SIPEngine = None
+        self.fleet_starter: FleetStarter = None
+        self.timer_wheel: TimerWheel = None
         self.web_interface: WebInterface = None
         self.running = False
         
@@ -51,7 +68,8 @@ class GB28181Simulator:
         # 日志配置
         log_level = os.getenv('LOG_LEVEL', 'INFO')
         log_dir = os.getenv('LOG_DIR', 'logs')
-        setup_logging(log_level, log_dir)
+        log_file = 'simulator.log' if worker_index is None else f'simulator-worker{worker_index}.log'
+        setup_logging(log_level, log_dir, log_file)
         
         self.logger = logging.getLogger(__name__)
         self.logger.info("GB28181 Camera Simulator Starting...")
@@ -66,11 +84,63 @@ class GB28181Simulator:
             'server_ip': os.getenv('SIP_SERVER_IP'),
             'server_port': int(os.getenv('SIP_SERVER_PORT', 5060)),
             'server_id': os.getenv('SIP_SERVER_ID'),
-            'domain': os.getenv('SIP_DOMAIN')
+            'domain': os.getenv('SIP_DOMAIN'),
+            'register_timeout': float(os.getenv('SIP_REGISTER_TIMEOUT', 5)),
+            'register_expires': int(os.getenv('SIP_REGISTER_EXPIRES', 3600)),
+            'keepalive_interval': float(os.getenv('KEEPALIVE_INTERVAL', 60)),
+            'timer_jitter': float(os.getenv('TIMER_JITTER', 0.1)),
+            'sip_mtu': int(os.getenv('SIP_MTU', 1500)),
+            'message_send_rate': float(os.getenv('CATALOG_SEND_RATE', 50)),
+            # 模拟录像（RecordInfo 查询）参数
+            'record_options': {
+                'segment_seconds': int(os.getenv('RECORD_SEGMENT_SECONDS', 60)),
+                'alarms_per_hour': int(os.getenv('RECORD_ALARMS_PER_HOUR', 6)),
+                'max_results': int(os.getenv('RECORD_MAX_RESULTS', 0)),
+            }
+        }
+        
+        # 共享时间轮精度（秒）
+        self.timer_tick = float(os.getenv('TIMER_TICK', 0.02))
+        
+        # SIP 引擎模式: thread（每设备独立线程）/ asyncio（单事件循环驱动所有设备）
+        self.sip_engine_mode = os.getenv('SIP_ENGINE', 'thread').lower()
+        # 共享 SIP 端口（仅 asyncio 模式）：所有设备复用同一端口或端口池，如 5060 或 5060-5063
+        self.sip_shared_ports = parse_port_list(os.getenv('SIP_SHARED_PORTS', ''))
+        if worker_index:
+            # 每个工作进程使用独立的端口池：第 N 个进程的端口整体偏移 N 个池大小
+            self.sip_shared_ports = [port + worker_index * len(self.sip_shared_ports)
+                                     for port in self.sip_shared_ports]
+        self.sip_bind_ip = os.getenv('SIP_BIND_IP', '0.0.0.0')
+        
+        # 设备启动调度：注册速率（个/秒，0 为不限速）、并发上限、爬坡曲线
+        self.startup_config = {
+            'rate': float(os.getenv('STARTUP_RATE', 0)),
+            'max_in_flight': int(os.getenv('STARTUP_MAX_IN_FLIGHT', 100)),
+            'burst': int(os.getenv('STARTUP_BURST', 0)) or None,
+            'ramp': os.getenv('STARTUP_RAMP', 'constant').lower(),
+            'ramp_seconds': float(os.getenv('STARTUP_RAMP_SECONDS', 0)),
+            'progress_interval': float(os.getenv('STARTUP_PROGRESS_INTERVAL', 5)),
         }
         
         # 媒体配置
         self.video_file = os.getenv('VIDEO_FILE', 'media/sample.mp4')
+        # 媒体模式: ffmpeg（每个会话独立编码）/ fanout（同一源文件共享编码进程，RTP 包分发给所有会话）
+        # / replay（回放离线生成的 RTP 包缓存文件）
+        self.media_mode = os.getenv('MEDIA_MODE', 'ffmpeg').lower()
+        self.media_fanout_linger = float(os.getenv('MEDIA_FANOUT_LINGER', 10))
+        self.media_replay_cache = os.getenv('MEDIA_REPLAY_CACHE') or None
+        # replay 模式发送调度精度（秒）
+        self.media_pacing_tick = float(os.getenv('MEDIA_PACING_TICK', 0.005))
+        # 源文件编码满足 SDP 协商结果时直接复制视频流（ffmpeg / fanout 模式），否则重新编码
+        self.media_passthrough = os.getenv('MEDIA_PASSTHROUGH', 'true').lower() in ['true', '1', 'yes']
+        # 每个 FFmpeg 进程保留的 stderr 行数（/api/streams/<call_id>/log）
+        self.media_log_lines = int(os.getenv('MEDIA_LOG_LINES', 20))
+        # ffmpeg 模式预启动的空闲编码进程数（0 表示 ACK 时才启动 FFmpeg）
+        self.media_warm_pool = int(os.getenv('MEDIA_WARM_POOL', 0))
+        # FFmpeg 进程最近的速度（输出时长 / 实际时长）持续低于该值时告警
+        self.media_behind_speed = float(os.getenv('MEDIA_BEHIND_SPEED', 0.95))
+        # 新会话从最近的 GOP 开始（fanout 模式补发缓存的 GOP，replay 模式从共享时间线上最近的关键帧开始）
+        self.media_gop_start = os.getenv('MEDIA_GOP_START', 'true').lower() in ['true', '1', 'yes']
         
         # 设备配置
         self.devices_config_path = os.getenv('DEVICES_CONFIG', 'config/devices.yaml')
@@ -79,9 +149,12 @@ class GB28181Simulator:
         self._validate_config()
         
         # 加载设备配置
-        self.devices = self._load_devices_config()
-        
-        self.logger.info(f"Loaded {len(self.devices)} device(s) from config")
+        if devices is None:
+            self.devices = self._load_devices_config()
+            self.logger.info(f"Loaded {len(self.devices)} device(s) from config")
+        else:
+            self.devices = devices
+            self.logger.info(f"Worker {worker_index} assigned {len(self.devices)} device(s)")
     
     def _validate_config(self):
         """验证必要的配置"""
@@ -111,30 +184,10 @@ class GB28181Simulator:
     def start(self):
         """启动模拟器"""
         try:
-            self.running = True
+            # 启动 Web 界面（先于设备启动，以便查看实时启动进度）
+            self._start_web_interface()
             
-            # 创建媒体服务器（共享）
-            self.media_server = MediaServer(self.video_file)
-            
-            # 为每个设备创建 SIP 客户端
-            for device in self.devices:
-                try:
-                    self.logger.info(f"Starting device: {device.get('device_id')}")
-                    
-                    client = SIPClient(
-                        device_config=device,
-                        server_config=self.server_config,
-                        media_server=self.media_server
-                    )
-                    
-                    if client.start():
-                        self.clients.append(client)
-                        self.logger.info(f"Device {device.get('device_id')} started successfully")
-                    else:
-                        self.logger.error(f"Failed to start device {device.get('device_id')}")
-                        
-                except Exception as e:
-                    self.logger.error(f"Error starting device {device.get('device_id')}: {e}", exc_info=True)
+            self.start_runtime()
             
             if not self.clients:
                 self.logger.error("No devices started successfully")
@@ -142,16 +195,6 @@ class GB28181Simulator:
             
             self.logger.info(f"Simulator started with {len(self.clients)} active device(s)")
             
-            # 启动 Web 界面
-            if self.enable_web:
-                try:
-                    self.web_interface = WebInterface(self, port=self.web_port, host=self.web_host)
-                    self.web_interface.start()
-                    self.logger.info(f"Web interface available at http://{self.web_host}:{self.web_port}")
-                except Exception as e:
-                    self.logger.error(f"Error starting web interface: {e}", exc_info=True)
-                    self.logger.warning("Continuing without web interface")
-            
             # 保持运行
             self._run()
             
@@ -162,6 +205,164 @@ class GB28181Simulator:
             self.logger.error(f"Error in simulator: {e}", exc_info=True)
             self.stop()
     
+    def start_workers(self, num_workers: int):
+        """
+        多进程模式：将设备分配到多个工作进程，本进程负责监控和 Web 界面
+        
+        Args:
+            num_workers: 工作进程数量
+        """
+        try:
+            self.running = True
+            self.supervisor = WorkerSupervisor(self.devices, num_workers)
+            self.supervisor.start()
+            
+            self._start_web_interface()
+            
+            self.logger.info(f"Simulator started with {num_workers} worker process(es)")
+            self._run()
+            
+        except KeyboardInterrupt:
+            self.logger.info("Received keyboard interrupt")
+        except Exception as e:
+            self.logger.error(f"Error in simulator: {e}", exc_info=True)
+        finally:
+            self.running = False
+            if self.supervisor:
+                self.supervisor.stop()
+    
+    def start_runtime(self):
+        """创建媒体服务器、时间轮并启动本进程负责的所有设备"""
+        self.running = True
+        
+        # 创建媒体服务器（共享）
+        self.media_server = MediaServer(self.video_file, mode=self.media_mode,
+                                        fanout_linger=self.media_fanout_linger,
+                                        replay_cache=self.media_replay_cache,
+                                        pacing_tick=self.media_pacing_tick,
+                                        passthrough=self.media_passthrough,
+                                        log_lines=self.media_log_lines,
+                                        warm_pool=self.media_warm_pool,
+                                        behind_speed=self.media_behind_speed,
+                                        gop_start=self.media_gop_start)
+        
+        # 创建共享时间轮（所有设备的心跳、注册刷新、会话超时）
+        self.timer_wheel = TimerWheel(tick=self.timer_tick)
+        self.timer_wheel.start()
+        
+        # 为每个设备创建 SIP 客户端
+        self.fleet_starter = FleetStarter(**self.startup_config)
+        if self.sip_engine_mode == 'asyncio':
+            self._start_clients_async()
+        else:
+            self._start_clients_threaded()
+    
+    def get_runtime_stats(self) -> dict:
+        """获取本进程的启动进度、时间轮统计和媒体会话"""
+        stats = {}
+        if self.fleet_starter and self.fleet_starter.progress:
+            stats['startup'] = self.fleet_starter.progress.snapshot()
+        if self.timer_wheel:
+            stats['timers'] = self.timer_wheel.stats()
+        stats['response_cache'] = self.get_response_cache_stats()
+        if self.media_server:
+            stats['media'] = self.media_server.get_stats()
+            stats['streams'] = self.media_server.get_active_streams()
+        return stats
+    
+    def get_response_cache_stats(self) -> dict:
+        """汇总本进程所有设备的查询响应缓存统计"""
+        totals = {'hits': 0, 'misses': 0, 'entries': 0}
+        for client in self.clients:
+            for key, value in client.catalog_handler.cache_stats().items():
+                totals[key] += value
+        return totals
+    
+    def execute_command(self, device_id: str, action: str, config: dict = None):
+        """
+        执行设备控制命令（工作进程收到父进程转发的 Web 操作）
+        
+        Args:
+            device_id: 设备ID
+            action: 命令 (register/unregister/keepalive/update_config)
+            config: update_config 命令携带的新设备配置
+        """
+        client = next((c for c in self.clients if c.device_id == device_id), None)
+        if client is None:
+            self.logger.warning(f"Command {action} for unknown device {device_id}")
+            return
+        
+        try:
+            if action == 'register':
+                client.register()
+            elif action == 'unregister':
+                client.unregister()
+            elif action == 'keepalive':
+                client.send_keepalive()
+            elif action == 'update_config':
+                client.update_device_config(config)
+            else:
+                self.logger.warning(f"Unsupported command: {action}")
+        except Exception as e:
+            self.logger.error(f"Error executing {action} for device {device_id}: {e}", exc_info=True)
+    
+    def _start_web_interface(self):
+        """启动 Web 界面（工作进程不启动）"""
+        if not self.enable_web or self.worker_index is not None:
+            return
+        try:
+            self.web_interface = WebInterface(self, port=self.web_port, host=self.web_host)
+            self.web_interface.start()
+            self.logger.info(f"Web interface available at http://{self.web_host}:{self.web_port}")
+        except Exception as e:
+            self.logger.error(f"Error starting web interface: {e}", exc_info=True)
+            self.logger.warning("Continuing without web interface")
+    
+    def _create_clients(self, engine: SIPEngine = None) -> List[SIPClient]:
+        """为每个设备创建 SIP 客户端"""
+        clients = []
+        for device in self.devices:
+            try:
+                clients.append(SIPClient(
+                    device_config=device,
+                    server_config=self.server_config,
+                    media_server=self.media_server,
+                    engine=engine,
+                    timers=self.timer_wheel
+                ))
+            except Exception as e:
+                self.logger.error(f"Error creating device {device.get('device_id')}: {e}", exc_info=True)
+        return clients
+    
+    def _start_clients_threaded(self):
+        """线程模式：在线程池中按启动速率并发启动设备，每个设备拥有独立 socket 和线程"""
+        clients = self._create_clients()
+        
+        self.logger.info(f"Starting {len(clients)} device(s) in thread mode")
+        started = self.fleet_starter.run_threaded(clients)
+        self._collect_started(clients, started)
+    
+    def _start_clients_async(self):
+        """异步模式：由单个事件循环按启动速率并发启动设备"""
+        self.sip_engine = SIPEngine(shared_ports=self.sip_shared_ports, bind_ip=self.sip_bind_ip)
+        self.sip_engine.start()
+        
+        clients = self._create_clients(self.sip_engine)
+        
+        self.logger.info(f"Starting {len(clients)} device(s) on asyncio SIP engine")
+        started = self.sip_engine.run_coroutine(self.fleet_starter.run_async(clients))
+        self._collect_started(clients, started)
+    
+    def _collect_started(self, clients: List[SIPClient], started: List[SIPClient]):
+        """保留启动成功的设备，释放启动失败设备的资源"""
+        started_ids = {id(client) for client in started}
+        for client in clients:
+            if id(client) in started_ids:
+                self.clients.append(client)
+            else:
+                self.logger.error(f"Failed to start device {client.device_id}")
+                client.close()
+    
     def stop(self):
         """停止模拟器"""
         self.logger.info("Stopping simulator...")
@@ -178,6 +379,14 @@ class GB28181Simulator:
         if self.media_server:
             self.media_server.stop_all_streams()
         
+        # 停止异步 SIP 引擎
+        if self.sip_engine:
+            self.sip_engine.stop()
+        
+        # 停止时间轮
+        if self.timer_wheel:
+            self.timer_wheel.stop()
+        
         self.logger.info("Simulator stopped")
     
     def _run(self):
@@ -188,7 +397,9 @@ class GB28181Simulator:
             while self.running:
                 time.sleep(1)
                 
-                # 检查客户端状态
+                # 检查客户端状态（多进程模式由各工作进程上报）
+                if self.supervisor:
+                    continue
                 active_clients = sum(1 for client in self.clients if client.registered)
                 if active_clients == 0 and len(self.clients) > 0:
                     self.logger.warning("No active registered clients")
@@ -205,13 +416,26 @@ def signal_handler(signum, frame):
 
 def main():
     """主函数"""
+    # 先加载 .env，命令行参数默认值可来自环境变量
+    load_dotenv()
+    
+    parser = argparse.ArgumentParser(description="GB28181 摄像头模拟器")
+    parser.add_argument(
+        '--workers', type=int, default=int(os.getenv('WORKERS', 1)),
+        help="工作进程数量，大于 1 时将设备分配到多个进程运行（默认 1）"
+    )
+    args = parser.parse_args()
+    
     # 注册信号处理器
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
     # 创建并启动模拟器
     simulator = GB28181Simulator()
-    simulator.start()
+    if args.workers > 1:
+        simulator.start_workers(args.workers)
+    else:
+        simulator.start()
 
 
 if __name__ == "__main__":
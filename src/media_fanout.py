@@ -0,0 +1,588 @@
+"""
+编码一次、多路分发的媒体流
+同一 (源文件, 编码配置) 只运行一个 FFmpeg 编码进程，RTP 输出到本机回环端口，
+由分发线程转发给所有订阅的目标地址；订阅者随 ACK / BYE 加入和离开，编码进程不重启。
+每个编码器缓存最近一个 GOP 的 RTP 包，新订阅者先收到这些包，不必等待下一个关键帧。
+同一机制也用于预启动的编码进程池：每个编码进程只有一个订阅者，ACK 时取一个已在运行的进程
+"""
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+import itertools
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from process_supervisor import ProcessSupervisor, SupervisedProcess
+from rtp_tcp import TCPMediaConnection, is_keyframe
+from utils import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# 单个数据报最大长度
+MAX_DATAGRAM = 65535
+# 每个就绪事件最多连续转发的数据报数（避免单个编码器占满分发线程）
+MAX_BATCH = 64
+# 回环接收缓冲区大小：分发线程短暂停顿时不丢包
+RECV_BUFFER = 4 * 1024 * 1024
+# 分发线程的维护周期（秒）：回收空闲编码器
+HOUSEKEEPING_INTERVAL = 1.0
+# 进程池中空闲进程意外退出后暂停补足的时间（秒）
+RESTART_BACKOFF = 10.0
+# 单个编码器缓存的 GOP 最大字节数：超过时（关键帧间隔过长）放弃缓存直到下一个关键帧
+GOP_CACHE_BYTES = 8 * 1024 * 1024
+# 共享编码进程的附加参数：不读标准输入，只输出错误日志（避免长时间运行时写满 stderr 管道）
+QUIET_ARGS = ["-nostdin", "-nostats", "-loglevel", "error"]
+
+# RTP 头部 SSRC 偏移；RTCP 发送者 SSRC 偏移
+RTP_SSRC_OFFSET = 8
+RTCP_SSRC_OFFSET = 4
+
+
+class _Encoder:
+    """一个共享的编码进程及其订阅者"""
+
+    def __init__(self, key: tuple, rtp_sock: socket.socket, rtcp_sock: socket.socket):
+        self.key = key
+        self.rtp_sock = rtp_sock
+        self.rtcp_sock = rtcp_sock
+        self.process: Optional[SupervisedProcess] = None
+        # call_id -> (RTP 目标地址, RTCP 目标地址, SSRC 字节串或 None, RTP over TCP 连接或 None)
+        self.subscribers: Dict[str, Tuple[tuple, tuple, Optional[bytes], Optional[TCPMediaConnection]]] = {}
+        # 分发线程遍历的订阅者快照：增删订阅时整体替换，转发时无需加锁
+        self.targets: Tuple[Tuple[tuple, tuple, Optional[bytes], Optional[TCPMediaConnection]], ...] = ()
+        # 等待第一个包的订阅：call_id -> (订阅时间, 编码器来源)，在 refresh_targets 之后加入
+        self.awaiting: Dict[str, Tuple[float, str]] = {}
+        # 等待补发 GOP 的订阅：不在快照中，分发线程收到下一个 RTP 包时先补发缓存的 GOP 再加入快照
+        self.joining: Set[str] = set()
+        # 从最近一个关键帧开始的 RTP 包，None 表示还没有收到关键帧或 GOP 超出 GOP_CACHE_BYTES
+        self.gop: Optional[List[bytes]] = None
+        self.gop_bytes = 0
+        self.idle_since: Optional[float] = None
+        self.start_time = time.time()
+        self.packets_in = 0
+        self.packets_out = 0
+
+    def refresh_targets(self):
+        """订阅者变化后更新快照，没有订阅者时开始计算空闲时间"""
+        self.targets = tuple(target for call_id, target in self.subscribers.items() if call_id not in self.joining)
+        self.idle_since = None if self.targets else time.monotonic()
+
+
+class FanoutHub:
+    """
+    共享编码进程的管理与 RTP 分发
+
+    每个编码进程把 RTP / RTCP 发送到本机回环端口，单个分发线程用 selector 监听所有编码器，
+    收到的数据报改写 SSRC 后转发给该编码器的每个订阅者。最后一个订阅者离开后编码进程
+    保留 linger 秒，期间新的订阅直接复用
+    """
+
+    # 日志中的编码进程类型
+    KIND = "shared"
+
+    def __init__(self, build_command: Callable[[str, str, str], List[str]], linger: float = 10.0,
+                 supervisor: Optional[ProcessSupervisor] = None, gop_cache: bool = True):
+        """
+        初始化分发器
+
+        Args:
+            build_command: 生成编码命令的函数 (源文件, 编码配置, 输出 URL) -> 命令行参数列表
+            linger: 最后一个订阅者离开后编码进程保留的时间（秒）
+            supervisor: 编码进程的监管器（读取 stderr、发现退出），None 时创建一个
+            gop_cache: 缓存每个编码器最近一个 GOP，新订阅者先收到该 GOP
+        """
+        self.build_command = build_command
+        self.linger = max(0.0, linger)
+        self.gop_cache = gop_cache
+        self.supervisor = supervisor or ProcessSupervisor()
+        self._own_supervisor = supervisor is None
+        self._encoders: Dict[tuple, _Encoder] = {}
+        self._sessions: Dict[str, Dict[str, Any]] = {}  # call_id -> 订阅信息
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event: Optional[threading.Event] = None
+        # 已停止的编码器的累计计数
+        self._retired_in = 0
+        self._retired_out = 0
+        # 订阅到第一个 RTP 包转发的延迟，按编码器来源（shared 复用运行中的进程 / cold 新启动 / warm 预启动）
+        self.first_packet: Dict[str, LatencyHistogram] = {}
+        # 订阅时补发缓存 GOP 的次数和补发的 RTP 包数
+        self.gop_bursts = 0
+        self.gop_packets = 0
+
+    def attach(self, call_id: str, video_file: str, profile: str, target_ip: str,
+               target_port: int, ssrc: Optional[int] = None, tcp: Optional[TCPMediaConnection] = None) -> bool:
+        """
+        订阅共享编码流，没有对应的编码进程时启动一个
+
+        Args:
+            call_id: 会话标识
+            video_file: 源文件路径
+            profile: 编码配置名称
+            target_ip: 目标IP地址
+            target_port: 目标 RTP 端口（RTCP 为下一个端口）
+            ssrc: 该会话的 SSRC，None 表示沿用编码进程的 SSRC
+            tcp: RTP over TCP 连接，None 时通过 UDP 发送（TCP 会话不转发 RTCP）
+
+        Returns:
+            bool: 是否订阅成功
+        """
+        key = (os.path.abspath(video_file), profile)
+        with self._lock:
+            if call_id in self._sessions:
+                logger.warning(f"Stream already exists for call_id: {call_id}")
+                return False
+
+            encoder, source = self._select_encoder(key)
+            if encoder is None:
+                return False
+
+            ssrc_bytes = struct.pack("!I", ssrc & 0xFFFFFFFF) if ssrc is not None else None
+            encoder.subscribers[call_id] = ((target_ip, target_port), (target_ip, target_port + 1), ssrc_bytes, tcp)
+            if self.gop_cache:
+                encoder.joining.add(call_id)
+            encoder.refresh_targets()
+            encoder.awaiting[call_id] = (time.monotonic(), source)
+            self._sessions[call_id] = {
+                "key": encoder.key,
+                "target_ip": target_ip,
+                "target_port": target_port,
+                "start_time": time.time(),
+            }
+            subscribers = len(encoder.subscribers)
+            self._ensure_thread()
+
+        logger.info(f"Stream {call_id} attached to {source} encoder [{profile}] {key[0]} "
+                    f"-> {target_ip}:{target_port} ({subscribers} subscriber(s))")
+        return True
+
+    def detach(self, call_id: str) -> bool:
+        """
+        取消订阅（编码进程继续运行，空闲超过 linger 秒后停止）
+
+        Args:
+            call_id: 会话标识
+
+        Returns:
+            bool: 该会话是否存在
+        """
+        with self._lock:
+            session = self._sessions.pop(call_id, None)
+            if session is None:
+                return False
+            encoder = self._encoders.get(session["key"])
+            remaining = 0
+            if encoder:
+                encoder.subscribers.pop(call_id, None)
+                encoder.awaiting.pop(call_id, None)
+                encoder.joining.discard(call_id)
+                encoder.refresh_targets()
+                remaining = len(encoder.subscribers)
+
+        logger.info(f"Stream {call_id} detached from {self.KIND} encoder ({remaining} subscriber(s) left)")
+        return True
+
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取当前订阅的会话
+
+        Returns:
+            dict: call_id -> 目标地址、开始时间、编码配置，编码进程的进度和最后几行 stderr
+        """
+        with self._lock:
+            return {
+                call_id: {
+                    "target_ip": session["target_ip"],
+                    "target_port": session["target_port"],
+                    "start_time": session["start_time"],
+                    "encoder": session["key"][1],
+                    "progress": self._encoders[session["key"]].process.progress_info(),
+                    "log": self._encoders[session["key"]].process.tail(),
+                }
+                for call_id, session in self._sessions.items()
+            }
+
+    def encoder_process(self, call_id: str) -> Optional[SupervisedProcess]:
+        """
+        获取会话订阅的编码进程
+
+        Args:
+            call_id: 会话标识
+
+        Returns:
+            SupervisedProcess: 编码进程，会话不存在时返回 None
+        """
+        with self._lock:
+            session = self._sessions.get(call_id)
+            encoder = session and self._encoders.get(session["key"])
+            return encoder.process if encoder else None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取分发统计
+
+        Returns:
+            dict: 编码进程数、订阅数、收到与转发的 RTP 包数、按编码器来源的首包延迟直方图，
+                  补发缓存 GOP 的次数和包数
+        """
+        with self._lock:
+            encoders = list(self._encoders.values())
+            return {
+                "encoders": len(encoders),
+                "subscribers": len(self._sessions),
+                "packets_in": self._retired_in + sum(encoder.packets_in for encoder in encoders),
+                "packets_out": self._retired_out + sum(encoder.packets_out for encoder in encoders),
+                "first_packet_ms": {source: histogram.snapshot() for source, histogram in self.first_packet.items()},
+                "gop_bursts": self.gop_bursts,
+                "gop_packets": self.gop_packets,
+            }
+
+    def stop(self):
+        """取消所有订阅，停止所有编码进程和分发线程"""
+        with self._lock:
+            encoders = list(self._encoders.values())
+            thread = self._thread
+            if self._stop_event:
+                self._stop_event.set()
+            self._thread = self._stop_event = None
+
+        for encoder in encoders:
+            self._stop_encoder(encoder)
+        if self._own_supervisor:
+            self.supervisor.stop()
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=HOUSEKEEPING_INTERVAL * 2)
+
+    def _select_encoder(self, key: Tuple[str, str]) -> Tuple[Optional[_Encoder], str]:
+        """
+        选择订阅的编码器：复用运行中的编码进程，没有时启动一个（调用方持有锁）
+
+        Returns:
+            tuple: (编码器，启动失败时为 None, 编码器来源)
+        """
+        encoder = self._encoders.get(key)
+        if encoder:
+            return encoder, "shared"
+        return self._start_encoder(key), "cold"
+
+    def _start_encoder(self, key: tuple) -> Optional[_Encoder]:
+        """启动编码进程并注册其回环端口（调用方持有锁），key 的前两项为 (源文件, 编码配置)"""
+        video_file, profile = key[:2]
+        rtp_sock = rtcp_sock = None
+        try:
+            rtp_sock = self._bind_loopback()
+            rtcp_sock = self._bind_loopback()
+            url = f"rtp://127.0.0.1:{rtp_sock.getsockname()[1]}?rtcpport={rtcp_sock.getsockname()[1]}"
+            cmd = self.build_command(video_file, profile, url)
+            cmd[1:1] = QUIET_ARGS
+
+            logger.info(f"Starting {self.KIND} encoder [{profile}] for {video_file}")
+            logger.debug(f"FFmpeg command: {' '.join(cmd)}")
+
+            encoder = _Encoder(key, rtp_sock, rtcp_sock)
+            # 进程名称：encoder:编码配置[:序号]:源文件
+            name = ":".join(["encoder", profile] + [str(part) for part in key[2:]] + [video_file])
+            encoder.process = self.supervisor.spawn(name, cmd, on_exit=lambda proc: self._on_encoder_exit(encoder),
+                                                    progress=True)
+        except Exception as e:
+            logger.error(f"Error starting {self.KIND} encoder: {e}", exc_info=True)
+            for sock in (rtp_sock, rtcp_sock):
+                if sock:
+                    sock.close()
+            return None
+
+        self._selector.register(rtp_sock, selectors.EVENT_READ, (encoder, False))
+        self._selector.register(rtcp_sock, selectors.EVENT_READ, (encoder, True))
+        self._encoders[key] = encoder
+        return encoder
+
+    def _stop_encoder(self, encoder: _Encoder, reason: str = "stopped", idle_only: bool = False,
+                      wait: bool = True):
+        """
+        停止编码进程并移除其所有订阅
+
+        Args:
+            encoder: 编码器
+            reason: 日志中的停止原因
+            idle_only: 为 True 时只在没有订阅者时停止
+            wait: 是否等待进程退出；分发线程中为 False，只发送 SIGTERM，由监管线程回收
+        """
+        with self._lock:
+            if self._encoders.get(encoder.key) is not encoder:
+                return
+            if idle_only and encoder.subscribers:
+                return
+            del self._encoders[encoder.key]
+            for call_id in encoder.subscribers:
+                self._sessions.pop(call_id, None)
+            self._retired_in += encoder.packets_in
+            self._retired_out += encoder.packets_out
+            for sock in (encoder.rtp_sock, encoder.rtcp_sock):
+                try:
+                    self._selector.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+                sock.close()
+
+        self.supervisor.terminate(encoder.process, wait=wait)
+        logger.info(f"{self.KIND.capitalize()} encoder [{encoder.key[1]}] for {encoder.key[0]} {reason} "
+                    f"after {time.time() - encoder.start_time:.0f}s, "
+                    f"{encoder.packets_in} packets in / {encoder.packets_out} out")
+
+    def _ensure_thread(self):
+        """启动分发线程（调用方持有锁）"""
+        if self._thread is None:
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop_event,),
+                                            name="media-fanout", daemon=True)
+            self._thread.start()
+
+    def _run(self, stop_event: threading.Event):
+        """分发线程：转发就绪的数据报，定期维护编码进程"""
+        next_housekeeping = time.monotonic() + HOUSEKEEPING_INTERVAL
+        while not stop_event.is_set():
+            try:
+                events = self._selector.select(timeout=HOUSEKEEPING_INTERVAL)
+            except OSError:
+                # 套接字在 select 期间被关闭
+                events = []
+            for key, _ in events:
+                encoder, rtcp = key.data
+                self._relay(key.fileobj, encoder, rtcp)
+
+            now = time.monotonic()
+            if now >= next_housekeeping:
+                next_housekeeping = now + HOUSEKEEPING_INTERVAL
+                self._housekeeping(now)
+
+    def _relay(self, sock: socket.socket, encoder: _Encoder, rtcp: bool):
+        """读取编码器输出的数据报，改写 SSRC 后发送给每个订阅者"""
+        for _ in range(MAX_BATCH):
+            try:
+                data = sock.recv(MAX_DATAGRAM)
+            except (BlockingIOError, OSError):
+                return
+            keyframe = None
+            if not rtcp:
+                encoder.packets_in += 1
+                if encoder.awaiting:
+                    # 先取等待首包的订阅再取快照：这些订阅一定在本次转发的目标中
+                    self._record_first_packet(encoder)
+                if self.gop_cache:
+                    keyframe = is_keyframe(data)
+                    if keyframe:
+                        encoder.gop, encoder.gop_bytes = [], 0
+                    if encoder.joining:
+                        # 新订阅者先收到当前 GOP 中已转发过的包，再与其他订阅者一起收到本包
+                        self._send_gop(encoder)
+
+            targets = encoder.targets
+            if targets and len(data) >= (RTCP_SSRC_OFFSET if rtcp else RTP_SSRC_OFFSET) + 4:
+                self._send(data, targets, rtcp, keyframe)
+                if not rtcp:
+                    encoder.packets_out += len(targets)
+            if encoder.gop is not None and not rtcp:
+                encoder.gop_bytes += len(data)
+                if encoder.gop_bytes > GOP_CACHE_BYTES:
+                    encoder.gop, encoder.gop_bytes = None, 0
+                else:
+                    encoder.gop.append(data)
+
+    def _send(self, data: bytes, targets: tuple, rtcp: bool, keyframe: Optional[bool] = None):
+        """
+        改写 SSRC 后把一个数据报发送给每个目标
+
+        Args:
+            data: 编码器输出的 RTP / RTCP 数据报
+            targets: 订阅者快照
+            rtcp: 是否为 RTCP（TCP 订阅者不转发 RTCP）
+            keyframe: 是否为关键帧起点，None 时在有 TCP 订阅者时计算
+        """
+        offset = RTCP_SSRC_OFFSET if rtcp else RTP_SSRC_OFFSET
+        sendto = self._send_sock.sendto
+        # 在同一个缓冲区上逐个订阅者改写 SSRC，不为每个订阅者复制数据
+        packet = bytearray(data)
+        for rtp_addr, rtcp_addr, ssrc, tcp in targets:
+            if tcp and rtcp:
+                continue
+            if ssrc is not None:
+                packet[offset:offset + 4] = ssrc
+            if tcp:
+                if keyframe is None:
+                    keyframe = is_keyframe(data)
+                tcp.send_packet((packet,), keyframe)
+                continue
+            try:
+                sendto(packet, rtcp_addr if rtcp else rtp_addr)
+            except OSError as e:
+                logger.debug(f"Error relaying packet to {rtcp_addr if rtcp else rtp_addr}: {e}")
+
+    def _send_gop(self, encoder: _Encoder):
+        """把缓存的 GOP 补发给等待的新订阅者，然后将其加入快照（分发线程调用）"""
+        with self._lock:
+            joining = [encoder.subscribers[call_id] for call_id in encoder.joining if call_id in encoder.subscribers]
+            encoder.joining.clear()
+            encoder.refresh_targets()
+            gop = encoder.gop or []
+            if joining and gop:
+                self.gop_bursts += len(joining)
+                self.gop_packets += len(gop) * len(joining)
+        targets = tuple(joining)
+        for index, data in enumerate(gop):
+            self._send(data, targets, False, index == 0)
+        encoder.packets_out += len(gop) * len(targets)
+
+    def _record_first_packet(self, encoder: _Encoder):
+        """记录订阅到第一个 RTP 包转发的延迟"""
+        now = time.monotonic()
+        with self._lock:
+            awaiting = list(encoder.awaiting.values())
+            encoder.awaiting.clear()
+            for subscribed, source in awaiting:
+                histogram = self.first_packet.get(source)
+                if histogram is None:
+                    histogram = self.first_packet[source] = LatencyHistogram()
+                histogram.record(now - subscribed)
+
+    def _housekeeping(self, now: float):
+        """停止空闲超时的编码器"""
+        with self._lock:
+            encoders = list(self._encoders.values())
+
+        for encoder in encoders:
+            if encoder.idle_since is not None and now - encoder.idle_since >= self.linger:
+                self._stop_encoder(encoder, "idle", idle_only=True, wait=False)
+
+    def _on_encoder_exit(self, encoder: _Encoder):
+        """编码进程自行退出（监管线程回调）：移除编码器及其所有订阅"""
+        process = encoder.process
+        logger.warning(f"{self.KIND.capitalize()} encoder [{encoder.key[1]}] exited with code {process.returncode}, "
+                       f"dropping {len(encoder.subscribers)} subscriber(s)")
+        if process.lines:
+            logger.error("FFmpeg error output:\n" + "\n".join(process.tail()))
+        self._stop_encoder(encoder, "exited")
+
+    @staticmethod
+    def _bind_loopback() -> socket.socket:
+        """绑定本机回环的临时端口，接收编码进程的输出"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        except OSError:
+            pass
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        return sock
+
+
+class WarmEncoderPool(FanoutHub):
+    """
+    预启动的编码进程池
+
+    每个编码进程同一时间只有一个订阅者（与 ffmpeg 模式一样每个会话独立编码），
+    为 prime 登记的 (源文件, 编码配置) 保持 size 个已打开源文件、正在编码的空闲进程，
+    其输出在没有订阅者时直接丢弃；ACK 时取一个空闲进程，只需设置转发目标即可出流，
+    不用等待 FFmpeg 启动。会话结束后进程回到池中，超出 size 的空闲进程停止
+    """
+
+    KIND = "pooled"
+
+    def __init__(self, build_command: Callable[[str, str, str], List[str]], size: int,
+                 supervisor: Optional[ProcessSupervisor] = None, gop_cache: bool = True):
+        """
+        初始化进程池
+
+        Args:
+            build_command: 生成编码命令的函数 (源文件, 编码配置, 输出 URL) -> 命令行参数列表
+            size: 每个登记的 (源文件, 编码配置) 保持的空闲进程数
+            supervisor: 编码进程的监管器，None 时创建一个
+            gop_cache: 缓存每个进程最近一个 GOP（空闲期间也缓存），取用时先补发该 GOP
+        """
+        super().__init__(build_command, linger=0.0, supervisor=supervisor, gop_cache=gop_cache)
+        self.size = max(0, size)
+        self._primed: List[Tuple[str, str]] = []
+        # 空闲进程意外退出的时间：RESTART_BACKOFF 秒内不补足，避免源文件损坏时反复启动
+        self._failed_at: Dict[Tuple[str, str], float] = {}
+        self._serial = itertools.count(1)
+        self.hits = 0
+        self.misses = 0
+
+    def prime(self, video_file: str, profile: str):
+        """
+        登记需要预启动的 (源文件, 编码配置) 并立即启动空闲进程
+
+        Args:
+            video_file: 源文件路径
+            profile: 编码配置名称
+        """
+        key = (os.path.abspath(video_file), profile)
+        with self._lock:
+            if key not in self._primed:
+                self._primed.append(key)
+            self._ensure_thread()
+            self._refill(key)
+        logger.info(f"Warm encoder pool primed [{profile}] {key[0]} ({self.size} process(es))")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取进程池统计
+
+        Returns:
+            dict: FanoutHub.stats() 的内容，以及空闲进程数、命中（取到预启动进程）和未命中次数
+        """
+        stats = super().stats()
+        with self._lock:
+            stats["idle"] = sum(1 for encoder in self._encoders.values() if not encoder.subscribers)
+        stats["hits"] = self.hits
+        stats["misses"] = self.misses
+        return stats
+
+    def _idle(self, key: Tuple[str, str]) -> List[_Encoder]:
+        """该 (源文件, 编码配置) 的空闲进程，已输出过 RTP 包的在前，其次按启动时间由早到晚（调用方持有锁）"""
+        idle = [encoder for encoder in self._encoders.values() if encoder.key[:2] == key and not encoder.subscribers]
+        idle.sort(key=lambda encoder: (encoder.packets_in == 0, encoder.start_time))
+        return idle
+
+    def _select_encoder(self, key: Tuple[str, str]) -> Tuple[Optional[_Encoder], str]:
+        """取一个空闲进程，没有时启动新进程（调用方持有锁）"""
+        idle = self._idle(key)
+        if idle:
+            self.hits += 1
+            return idle[0], "warm"
+        self.misses += 1
+        return self._start_encoder(key + (next(self._serial),)), "cold"
+
+    def _refill(self, key: Tuple[str, str]):
+        """补足空闲进程（调用方持有锁），分发线程已停止时不再启动"""
+        if self._thread is None:
+            return
+        if time.monotonic() - self._failed_at.get(key, -RESTART_BACKOFF) < RESTART_BACKOFF:
+            return
+        for _ in range(self.size - len(self._idle(key))):
+            if self._start_encoder(key + (next(self._serial),)) is None:
+                break
+
+    def _housekeeping(self, now: float):
+        """停止多余的空闲进程，补足登记的 (源文件, 编码配置) 的空闲进程"""
+        with self._lock:
+            surplus = []
+            for key in {encoder.key[:2] for encoder in self._encoders.values()}:
+                keep = self.size if key in self._primed else 0
+                surplus.extend(self._idle(key)[keep:])
+        for encoder in surplus:
+            self._stop_encoder(encoder, "released", idle_only=True, wait=False)
+        with self._lock:
+            for key in self._primed:
+                self._refill(key)
+
+    def _on_encoder_exit(self, encoder: _Encoder):
+        """空闲进程意外退出时暂停补足，然后按 FanoutHub 的方式移除"""
+        if not encoder.subscribers:
+            self._failed_at[encoder.key[:2]] = time.monotonic()
+        super()._on_encoder_exit(encoder)
+
@@ -0,0 +1,134 @@
+"""
+媒体源探测
+每个源文件只探测一次（按路径和修改时间缓存）视频编码和 H.264 profile，
+推流时据此决定直接复制视频流还是按 SDP 协商的编码重新编码
+"""
+import json
+import logging
+import os
+import struct
+import subprocess
+import threading
+from typing import Dict, Optional, Tuple
+
+from mp4_reader import MP4VideoTrack
+
+logger = logging.getLogger(__name__)
+
+# SDP rtpmap 编码名称 -> 视频编码（GB28181 的 PS 封装承载 H.264）
+SDP_CODECS = {"PS": "h264", "H264": "h264", "MPEG4": "mpeg4"}
+# H.264 profile_idc -> 名称（与 FFmpeg -profile:v 的写法相同）
+H264_PROFILES = {66: "baseline", 77: "main", 100: "high"}
+# ffprobe 输出的 profile 名称 -> profile_idc
+_PROFILE_IDC = {"constrained baseline": 66, "baseline": 66, "main": 77, "extended": 88, "high": 100}
+# 解码能力由低到高：支持某个 profile 的解码器也能解码排位不高于它的码流
+_PROFILE_RANK = {66: 0, 77: 1, 88: 1, 100: 2}
+# ffprobe 超时（秒）
+PROBE_TIMEOUT = 10
+
+
+class SourceInfo:
+    """源文件的视频流信息"""
+
+    __slots__ = ("codec", "profile_idc", "width", "height")
+
+    def __init__(self, codec: str, profile_idc: Optional[int] = None, width: int = 0, height: int = 0):
+        """
+        初始化视频流信息
+
+        Args:
+            codec: 视频编码（h264 / mpeg4 等，与 FFmpeg 的编码名称相同）
+            profile_idc: H.264 profile_idc，未知时为 None
+            width: 宽度
+            height: 高度
+        """
+        self.codec = codec
+        self.profile_idc = profile_idc
+        self.width = width
+        self.height = height
+
+    def matches(self, codec: str, profile_idc: Optional[int] = None) -> bool:
+        """
+        源视频流能否不经重新编码直接发送
+
+        Args:
+            codec: 协商的视频编码
+            profile_idc: SDP fmtp profile-level-id 要求的 H.264 profile，None 表示不限
+
+        Returns:
+            bool: 编码相同且 profile 不高于协商的 profile
+        """
+        if codec != self.codec:
+            return False
+        if profile_idc is None or codec != "h264":
+            return True
+        if self.profile_idc is None:
+            return False
+        return _PROFILE_RANK.get(self.profile_idc, 3) <= _PROFILE_RANK.get(profile_idc, -1)
+
+    def __repr__(self) -> str:
+        profile = H264_PROFILES.get(self.profile_idc, self.profile_idc)
+        return f"{self.codec}" + (f" ({profile})" if profile else "") + f" {self.width}x{self.height}"
+
+
+_cache: Dict[str, Tuple[float, Optional[SourceInfo]]] = {}
+_lock = threading.Lock()
+
+
+def probe_video(path: str) -> Optional[SourceInfo]:
+    """
+    探测源文件的视频流（结果按文件修改时间缓存）
+
+    MP4 直接读取样本描述，其他格式调用 ffprobe
+
+    Args:
+        path: 源文件路径
+
+    Returns:
+        SourceInfo: 视频流信息，文件不存在或无法识别时返回 None
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    key = os.path.abspath(path)
+    with _lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        info = _probe_mp4(path) or _probe_ffprobe(path)
+        _cache[key] = (mtime, info)
+    if info:
+        logger.info(f"Probed video source {path}: {info}")
+    else:
+        logger.warning(f"Cannot probe video source {path}, streams will be re-encoded")
+    return info
+
+
+def _probe_mp4(path: str) -> Optional[SourceInfo]:
+    """读取 MP4 的 avc1 样本描述"""
+    try:
+        track = MP4VideoTrack(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    try:
+        return SourceInfo("h264", track.profile_idc, track.width, track.height)
+    finally:
+        track.close()
+
+
+def _probe_ffprobe(path: str) -> Optional[SourceInfo]:
+    """用 ffprobe 读取第一个视频流的编码和 profile"""
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "stream=codec_name,profile,width,height", "-of", "json", path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT)
+        streams = json.loads(result.stdout or b"{}").get("streams") or []
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        logger.debug(f"ffprobe failed for {path}: {e}")
+        return None
+    if not streams:
+        return None
+    stream = streams[0]
+    return SourceInfo(stream.get("codec_name", ""), _PROFILE_IDC.get(str(stream.get("profile", "")).lower()),
+                      int(stream.get("width") or 0), int(stream.get("height") or 0))
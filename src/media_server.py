@@ -3,33 +3,213 @@
 使用 FFmpeg 推送 PS 封装的 RTP 视频流
 """
 import logging
-import subprocess
 import threading
 import time
 import os
-from typing import Optional, Dict, Any
+from bisect import bisect_left
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+from gb28181_protocol import clamp_scale
+from keyframe_index import KeyframeIndex, load_keyframe_index
+from media_fanout import FanoutHub, WarmEncoderPool
+from media_probe import H264_PROFILES, probe_video
+from process_supervisor import BEHIND_SPEED, LOG_LINES, ProcessSupervisor, SupervisedProcess
+from rtp_replay import RTP_CLOCK, RTPCache, ReplayStream, build_ps_cache, default_cache_path
+from rtp_scheduler import DEFAULT_TICK, RTPScheduler
+from rtp_tcp import TCPMediaConnection, TCPMediaTransport
 
 logger = logging.getLogger(__name__)
 
+# 媒体模式
+MEDIA_MODE_FFMPEG = "ffmpeg"  # 每个会话独立的 FFmpeg 编码进程
+MEDIA_MODE_FANOUT = "fanout"  # 同一源文件和编码配置共享一个编码进程，RTP 包在进程内分发给所有会话
+MEDIA_MODE_REPLAY = "replay"  # 回放离线生成的 RTP 包缓存文件，不运行 FFmpeg
+MEDIA_MODES = (MEDIA_MODE_FFMPEG, MEDIA_MODE_FANOUT, MEDIA_MODE_REPLAY)
+
+# 编码配置：名称 -> FFmpeg 视频编码参数
+_X264_ARGS = ["-vcodec", "libx264", "-preset", "ultrafast", "-tune", "zerolatency"]
+ENCODER_PROFILES = {
+    "h264": _X264_ARGS,
+    # 源文件的编码已满足协商结果时直接复制视频流，只做 RTP 封装
+    "copy": ["-c:v", "copy"],
+    "mpeg4": ["-vcodec", "mpeg4", "-q:v", "5"],
+}
+# SDP 指定 H.264 profile 且源文件不满足时按该 profile 重新编码（h264-baseline / h264-main / h264-high）
+ENCODER_PROFILES.update({f"h264-{name}": _X264_ARGS + ["-profile:v", name] for name in H264_PROFILES.values()})
+DEFAULT_PROFILE = "h264"
+COPY_PROFILE = "copy"
+
+
+def build_ffmpeg_command(video_file: str, profile: str, output_url: str,
+                         ssrc: Optional[int] = None) -> List[str]:
+    """
+    构建推流的 FFmpeg 命令
+    
+    Args:
+        video_file: 源文件路径
+        profile: 编码配置名称
+        output_url: RTP 输出地址
+        ssrc: RTP SSRC，None 时由 FFmpeg 随机生成
+        
+    Returns:
+        list: 命令行参数
+    """
+    # 使用 PS 封装格式通过 RTP 推送
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",  # stderr 只保留有用的日志
+        "-re",  # 实时推流
+        "-stream_loop", "-1",  # 循环播放
+        "-i", video_file,  # 输入文件
+    ]
+    cmd.extend(ENCODER_PROFILES[profile])
+    cmd.extend([
+        "-progress", "pipe:1",  # 进度（key=value 块）输出到标准输出，由监管线程解析
+        "-an",  # 禁用音频
+        "-f", "rtp_mpegts",  # PS 封装通过 RTP
+    ])
+    
+    # 添加 SSRC 如果提供
+    if ssrc is not None:
+        cmd.extend(["-ssrc", str(ssrc)])
+    
+    cmd.append(output_url)
+    return cmd
+
+
+def parse_ssrc(ssrc: Optional[str]) -> Optional[int]:
+    """
+    解析 SDP y= 行中的 SSRC（十进制字符串）
+    
+    Args:
+        ssrc: SSRC 字符串
+        
+    Returns:
+        int: SSRC 数值，为空或格式错误时返回 None
+    """
+    if ssrc is None:
+        return None
+    try:
+        return int(str(ssrc).strip()) & 0xFFFFFFFF
+    except ValueError:
+        logger.warning(f"Invalid SSRC: {ssrc}")
+        return None
+
 
 class MediaServer:
     """媒体流推送服务器"""
     
-    def __init__(self, video_file: str):
+    def __init__(self, video_file: str, mode: str = MEDIA_MODE_FFMPEG, fanout_linger: float = 10.0,
+                 replay_cache: Optional[str] = None, pacing_tick: float = DEFAULT_TICK,
+                 passthrough: bool = True, log_lines: int = LOG_LINES, warm_pool: int = 0,
+                 behind_speed: float = BEHIND_SPEED, gop_start: bool = True):
         """
         初始化媒体服务器
         
         Args:
             video_file: 视频文件路径
+            mode: 媒体模式 (ffmpeg/fanout/replay)
+            fanout_linger: fanout 模式下最后一个会话结束后编码进程保留的时间（秒）
+            replay_cache: replay 模式的 RTP 包缓存文件，默认为视频文件路径加 .rtp
+            pacing_tick: replay 模式发送调度精度（秒）
+            passthrough: 源文件编码满足 SDP 协商结果时直接复制视频流，不重新编码
+            log_lines: 每个 FFmpeg 进程保留的 stderr 行数
+            warm_pool: ffmpeg 模式预启动的空闲编码进程数，0 表示 ACK 时才启动 FFmpeg
+            behind_speed: FFmpeg 进程最近的速度（输出时长 / 实际时长）持续低于该值时告警
+            gop_start: 新会话从最近的 GOP 开始：fanout 模式先补发编码器缓存的当前 GOP，
+                       replay 模式所有会话共用一条循环时间线，从时间线当前位置之前的关键帧开始
         """
         self.video_file = video_file
-        self.active_streams = {}  # call_id -> process
+        self.active_streams = {}  # call_id -> 进程信息
         self.stream_lock = threading.Lock()
         
-        logger.info(f"MediaServer initialized with video file: {video_file}")
+        if mode not in MEDIA_MODES:
+            logger.warning(f"Unknown media mode '{mode}', using {MEDIA_MODE_FFMPEG}")
+            mode = MEDIA_MODE_FFMPEG
+        self.mode = mode
+        self.passthrough = passthrough
+        self.gop_start = gop_start
+        # 所有 FFmpeg 进程由同一个监管线程读取 stderr、发现退出
+        self.supervisor = ProcessSupervisor(log_lines=log_lines, behind_speed=behind_speed)
+        self.fanout = (FanoutHub(build_ffmpeg_command, linger=fanout_linger, supervisor=self.supervisor,
+                                 gop_cache=gop_start)
+                       if mode == MEDIA_MODE_FANOUT else None)
+        if mode == MEDIA_MODE_FFMPEG and warm_pool > 0:
+            # ffmpeg 模式的预启动进程池：每个会话仍独占一个编码进程，RTP 经本机回环端口转发
+            self.fanout = WarmEncoderPool(build_ffmpeg_command, size=warm_pool, supervisor=self.supervisor,
+                                          gop_cache=gop_start)
+        # replay 模式所有会话由同一个调度器按包的到期时间发送；其他模式的录像回放、下载会话首次使用时创建
+        self.pacing_tick = pacing_tick
+        self.scheduler = (RTPScheduler(tick=pacing_tick, on_finish=self._on_playback_finish)
+                          if mode == MEDIA_MODE_REPLAY else None)
+        # 录像回放、下载会话：call_id -> 起点的媒体位置、结束回调
+        self.playbacks: Dict[str, Dict[str, Any]] = {}
+        self.replay_cache_path = replay_cache or default_cache_path(video_file)
+        self._replay_cache: Optional[RTPCache] = None
+        # replay 模式的循环时间线起点（缓存加载时间）
+        self._replay_epoch = 0.0
+        # RTP over TCP 连接（所有模式共用，首次使用时启动 selector 线程）
+        self.tcp = TCPMediaTransport()
+        
+        logger.info(f"MediaServer initialized with video file: {video_file} (mode: {mode})")
+        
+        if isinstance(self.fanout, WarmEncoderPool):
+            if os.path.exists(video_file):
+                # 按不带约束的协商结果预启动（源文件为 H.264 时直接复制视频流）
+                self.fanout.prime(video_file, self.negotiate_profile())
+            else:
+                logger.warning(f"Video file not found, warm encoder pool not started: {video_file}")
+    
+    def negotiate_profile(self, codec: Optional[str] = None, profile_idc: Optional[int] = None) -> str:
+        """
+        按 SDP 协商的编码选择编码配置：源文件已满足时直接复制视频流，否则重新编码
+        
+        Args:
+            codec: 协商的视频编码（h264 / mpeg4），None 时为 h264
+            profile_idc: SDP 要求的 H.264 profile_idc，None 表示不限
+            
+        Returns:
+            str: 编码配置名称
+        """
+        codec = codec or "h264"
+        if self.passthrough and self.mode != MEDIA_MODE_REPLAY:
+            source = probe_video(self.video_file)
+            if source and source.matches(codec, profile_idc):
+                return COPY_PROFILE
+        if codec == "h264" and profile_idc in H264_PROFILES:
+            return f"h264-{H264_PROFILES[profile_idc]}"
+        return codec if codec in ENCODER_PROFILES else DEFAULT_PROFILE
+    
+    def prepare_tcp_listener(self, call_id: str, bind_ip: str) -> Optional[int]:
+        """
+        RTP over TCP 本端为 passive（平台 a=setup:active）时，在应答 INVITE 前开始监听
+        
+        Args:
+            call_id: 会话标识
+            bind_ip: 监听地址
+            
+        Returns:
+            int: 监听端口（填入 SDP 应答的 m= 行），失败时返回 None
+        """
+        # INVITE 重传时沿用已打开的监听端口
+        conn = self.tcp.get(call_id) or self.tcp.listen(call_id, bind_ip)
+        return conn.local_port if conn else None
+    
+    def release_tcp(self, call_id: str) -> bool:
+        """
+        关闭会话的 RTP over TCP 连接或监听端口（会话结束、ACK 超时）
+        
+        Args:
+            call_id: 会话标识
+            
+        Returns:
+            bool: 连接是否存在
+        """
+        return self.tcp.close(call_id)
     
     def start_stream(self, call_id: str, target_ip: str, target_port: int, 
-                     transport: str = "UDP", ssrc: Optional[str] = None) -> bool:
+                     transport: str = "UDP", ssrc: Optional[str] = None,
+                     profile: str = DEFAULT_PROFILE, setup: str = "active") -> bool:
         """
         启动视频流推送
         
@@ -38,59 +218,228 @@ class MediaServer:
             target_ip: 目标IP地址
             target_port: 目标端口
             transport: 传输协议 (UDP/TCP)
-            ssrc: SSRC 标识
+            ssrc: SSRC 标识（SDP y= 行）
+            profile: 编码配置名称
+            setup: TCP 传输时本端的角色：active 主动连接目标地址，passive 使用 prepare_tcp_listener 的监听端口
             
         Returns:
             bool: 是否启动成功
         """
+        tcp = None
+        if transport.upper() == "TCP":
+            tcp = self._open_tcp(call_id, target_ip, target_port, setup)
+            if tcp is None:
+                return False
+        
+        started = self._start_stream(call_id, target_ip, target_port, ssrc, profile, tcp)
+        if not started and tcp:
+            self.release_tcp(call_id)
+        return started
+    
+    def start_playback(self, call_id: str, target_ip: str, target_port: int,
+                       transport: str = "UDP", ssrc: Optional[str] = None, setup: str = "active",
+                       start_time: int = 0, end_time: int = 0, scale: float = 1.0,
+                       on_finish: Optional[Callable[[str], None]] = None) -> bool:
+        """
+        启动录像回放或下载：从 RTP 包缓存中录像开始时间对应的位置发送（不重新编码），
+        所有媒体模式都由发送调度器按倍速发送
+        
+        模拟录像的内容为循环播放的视频文件：录像时间 t（Unix 秒）对应缓存中 t × 90000 对循环周期取模的位置，
+        同一时刻的录像总是相同的画面；发送从该位置之前最近的关键帧开始（关键帧索引）
+        
+        Args:
+            call_id: 会话标识
+            target_ip: 目标IP地址
+            target_port: 目标端口
+            transport: 传输协议 (UDP/TCP)
+            ssrc: SSRC 标识（SDP y= 行）
+            setup: TCP 传输时本端的角色
+            start_time: 录像开始时间（SDP t= 行，Unix 秒）
+            end_time: 录像结束时间，不晚于开始时间时一直发送到会话结束
+            scale: 发送倍速（下载为 downloadspeed）
+            on_finish: 录像发送完毕后的回调（参数为会话标识，在发送线程中调用）
+            
+        Returns:
+            bool: 是否启动成功
+        """
+        tcp = None
+        if transport.upper() == "TCP":
+            tcp = self._open_tcp(call_id, target_ip, target_port, setup)
+            if tcp is None:
+                return False
+        
+        try:
+            cache = self._load_replay_cache()
+            index = load_keyframe_index(cache.path) if cache else None
+            with self.stream_lock:
+                if self.scheduler is None:
+                    self.scheduler = RTPScheduler(tick=self.pacing_tick, on_finish=self._on_playback_finish)
+                scheduler = self.scheduler
+            if cache is None:
+                started = False
+            else:
+                origin = start_time * RTP_CLOCK % cache.duration
+                first = self._packet_at(cache, index, origin)[1]
+                end = origin + (end_time - start_time) * RTP_CLOCK if end_time > start_time else None
+                stream = ReplayStream(call_id, cache, (target_ip, target_port), parse_ssrc(ssrc), tcp=tcp,
+                                      start=first, scale=scale, end=end)
+                with self.stream_lock:
+                    self.playbacks[call_id] = {"origin": origin, "on_finish": on_finish}
+                started = scheduler.add(stream)
+                if not started:
+                    with self.stream_lock:
+                        self.playbacks.pop(call_id, None)
+        except Exception as e:
+            logger.error(f"Error starting playback: {e}", exc_info=True)
+            started = False
+        
+        if not started:
+            if tcp:
+                self.release_tcp(call_id)
+            return False
+        logger.info(f"Playback started for call_id: {call_id} -> {target_ip}:{target_port} "
+                    f"({transport.upper()}, record {start_time}-{end_time}, x{scale:g}, "
+                    f"from {cache.offsets[first] / RTP_CLOCK:.2f}s of {cache.seconds:.1f}s loop)")
+        return True
+    
+    def control_playback(self, call_id: str, scale: Optional[float] = None, pause: Optional[bool] = None,
+                         seek: Optional[float] = None) -> bool:
+        """
+        控制录像回放（MANSRTSP PLAY / PAUSE）
+        
+        Args:
+            call_id: 会话标识
+            scale: 新的倍速
+            pause: True 暂停，False 继续
+            seek: 跳转到录像开始后的秒数（从该位置之前最近的关键帧开始）
+            
+        Returns:
+            bool: 会话是否存在
+        """
+        with self.stream_lock:
+            playback = self.playbacks.get(call_id)
+        stream = self.scheduler.get(call_id) if playback and self.scheduler else None
+        if stream is None:
+            logger.warning(f"No playback found for call_id: {call_id}")
+            return False
+        
+        if pause:
+            stream.control("pause")
+        if seek is not None:
+            cache = stream.cache
+            stream.control("seek", self._packet_at(cache, load_keyframe_index(cache.path),
+                                                   playback["origin"] + max(0, round(seek * RTP_CLOCK))))
+        scale = clamp_scale(scale)
+        if scale is not None:
+            stream.control("scale", scale)
+        if pause is False:
+            stream.control("resume")
+        logger.info(f"Playback control for call_id: {call_id} (scale: {scale}, pause: {pause}, seek: {seek})")
+        return True
+    
+    @staticmethod
+    def _packet_at(cache: RTPCache, index: Optional[KeyframeIndex], position: int) -> Tuple[int, int]:
+        """
+        媒体位置之前最近的关键帧起点
+        
+        Args:
+            cache: RTP 包缓存
+            index: 缓存文件的关键帧索引，None 时取循环周期的开头
+            position: 媒体位置（90kHz，可以超过循环周期）
+            
+        Returns:
+            tuple: (循环次数, 包序号)
+        """
+        loop, position = divmod(position, max(1, cache.duration))
+        # 关键帧索引按 PTS 查找；RTP 包缓存中的时间戳与发送偏移同一时间基准
+        keyframe = index.latest(position) if index else None
+        if keyframe is None:
+            return loop, 0
+        return loop, min(bisect_left(cache.positions, index.offsets[keyframe]), cache.count - 1)
+    
+    def _on_playback_finish(self, stream: ReplayStream):
+        """
+        录像回放、下载发送完毕（调度器发送线程回调）：关闭 TCP 连接并通知信令层
+        
+        Args:
+            stream: 发送完毕的会话
+        """
+        call_id = stream.call_id
+        with self.stream_lock:
+            playback = self.playbacks.pop(call_id, None)
+        self.release_tcp(call_id)
+        logger.info(f"Playback finished for call_id: {call_id} ({stream.packets} packets sent)")
+        if playback and playback["on_finish"]:
+            playback["on_finish"](call_id)
+    
+    def _open_tcp(self, call_id: str, target_ip: str, target_port: int,
+                  setup: str) -> Optional[TCPMediaConnection]:
+        """取得会话的 RTP over TCP 连接：passive 使用 prepare_tcp_listener 的监听端口，active 主动连接目标地址"""
+        if setup == "passive":
+            tcp = self.tcp.get(call_id)
+            if tcp is None:
+                logger.error(f"No TCP media listener prepared for call_id: {call_id}")
+            return tcp
+        return self.tcp.connect(call_id, target_ip, target_port)
+    
+    def _start_stream(self, call_id: str, target_ip: str, target_port: int, ssrc: Optional[str],
+                      profile: str, tcp: Optional[TCPMediaConnection]) -> bool:
+        """按媒体模式启动推流，tcp 不为 None 时通过该连接发送"""
+        transport = "TCP" if tcp else "UDP"
         try:
+            if self.mode == MEDIA_MODE_REPLAY:
+                # 回放预打包的 RTP 包，不需要源文件和编码进程
+                cache = self._load_replay_cache()
+                if cache is None:
+                    return False
+                start = self._replay_start(cache)
+                stream = ReplayStream(call_id, cache, (target_ip, target_port), parse_ssrc(ssrc), tcp=tcp,
+                                      start=start)
+                if not self.scheduler.add(stream):
+                    return False
+                logger.info(f"Replay stream started for call_id: {call_id} -> {target_ip}:{target_port} "
+                            f"({transport}, {cache.count} packets, {cache.seconds:.1f}s loop, "
+                            f"from {cache.offsets[start] / RTP_CLOCK:.2f}s)")
+                return True
+            
             # 检查视频文件是否存在
             if not os.path.exists(self.video_file):
                 logger.error(f"Video file not found: {self.video_file}")
                 return False
             
+            if profile not in ENCODER_PROFILES:
+                logger.error(f"Unknown encoder profile: {profile}")
+                return False
+            
+            if self.fanout:
+                # 订阅共享编码进程的输出，会话 SSRC 在转发时改写
+                return self.fanout.attach(call_id, self.video_file, profile, target_ip, target_port,
+                                          parse_ssrc(ssrc), tcp=tcp)
+            
             with self.stream_lock:
                 # 检查是否已有流在推送
                 if call_id in self.active_streams:
                     logger.warning(f"Stream already exists for call_id: {call_id}")
                     return False
                 
-                # 构建 FFmpeg 命令
-                # 使用 PS 封装格式通过 RTP 推送
-                cmd = [
-                    "ffmpeg",
-                    "-re",  # 实时推流
-                    "-stream_loop", "-1",  # 循环播放
-                    "-i", self.video_file,  # 输入文件
-                    "-vcodec", "libx264",  # H.264 编码
-                    "-preset", "ultrafast",  # 编码速度
-                    "-tune", "zerolatency",  # 零延迟调优
-                    "-an",  # 禁用音频
-                    "-f", "rtp_mpegts",  # PS 封装通过 RTP
-                ]
-                
-                # 添加 SSRC 如果提供
-                if ssrc:
-                    cmd.extend(["-ssrc", ssrc])
-                
                 # 目标地址
-                if transport.upper() == "TCP":
-                    # TCP模式：RTCP使用下一个端口
-                    rtcp_port = target_port + 1
-                    cmd.append(f"rtp://{target_ip}:{target_port}?rtcpport={rtcp_port}")
+                if tcp:
+                    # TCP 模式：FFmpeg 输出到本机中转端口，RTP 包加长度前缀后写入 TCP 连接（RTCP 丢弃）
+                    relay_port = self.tcp.relay_port(tcp)
+                    if relay_port is None:
+                        return False
+                    url = f"rtp://127.0.0.1:{relay_port}?rtcpport={relay_port}"
                 else:
-                    cmd.append(f"rtp://{target_ip}:{target_port}")
+                    url = f"rtp://{target_ip}:{target_port}"
+                
+                # 构建 FFmpeg 命令
+                cmd = build_ffmpeg_command(self.video_file, profile, url, parse_ssrc(ssrc))
                 
-                logger.info(f"Starting stream to {target_ip}:{target_port} (transport: {transport})")
+                logger.info(f"Starting stream to {target_ip}:{target_port} (transport: {transport}, profile: {profile})")
                 logger.debug(f"FFmpeg command: {' '.join(cmd)}")
                 
-                # 启动 FFmpeg 进程
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    stdin=subprocess.PIPE
-                )
+                # 启动 FFmpeg 进程（stderr 由监管线程持续读取，进程退出时回调）
+                process = self.supervisor.spawn(call_id, cmd, on_exit=self._on_stream_exit, progress=True)
                 
                 # 保存进程引用
                 self.active_streams[call_id] = {
@@ -100,14 +449,6 @@ class MediaServer:
                     "start_time": time.time()
                 }
                 
-                # 启动监控线程
-                monitor_thread = threading.Thread(
-                    target=self._monitor_stream,
-                    args=(call_id,),
-                    daemon=True
-                )
-                monitor_thread.start()
-                
                 logger.info(f"Stream started successfully for call_id: {call_id}")
                 return True
                 
@@ -126,61 +467,69 @@ class MediaServer:
             bool: 是否停止成功
         """
         try:
-            with self.stream_lock:
-                if call_id not in self.active_streams:
-                    logger.warning(f"No active stream found for call_id: {call_id}")
-                    return False
-                
-                stream_info = self.active_streams[call_id]
-                process = stream_info["process"]
-                
-                # 终止 FFmpeg 进程
-                logger.info(f"Stopping stream for call_id: {call_id}")
-                
-                try:
-                    process.terminate()
-                    process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    logger.warning(f"FFmpeg process did not terminate, killing it")
-                    process.kill()
-                    process.wait()
-                
-                # 移除流信息
-                del self.active_streams[call_id]
-                
-                logger.info(f"Stream stopped successfully for call_id: {call_id}")
+            # 先关闭 TCP 连接，之后发送的包直接丢弃
+            self.release_tcp(call_id)
+            if self.fanout and self.fanout.detach(call_id):
                 return True
+            if self.scheduler:
+                stream = self.scheduler.remove(call_id)
+                with self.stream_lock:
+                    self.playbacks.pop(call_id, None)
+                if stream:
+                    logger.info(f"Replay stream stopped for call_id: {call_id} ({stream.packets} packets sent, "
+                                f"{stream.late_packets} late, jitter {stream.jitter * 1000:.2f}ms)")
+                    return True
+            
+            with self.stream_lock:
+                stream_info = self.active_streams.pop(call_id, None)
+            if stream_info is None:
+                logger.warning(f"No active stream found for call_id: {call_id}")
+                return False
+            
+            # 终止 FFmpeg 进程（不持有锁，等待退出期间不阻塞其他会话）
+            logger.info(f"Stopping stream for call_id: {call_id}")
+            self.supervisor.terminate(stream_info["process"])
+            
+            logger.info(f"Stream stopped successfully for call_id: {call_id}")
+            return True
                 
         except Exception as e:
             logger.error(f"Error stopping stream: {e}", exc_info=True)
             return False
     
-    def _monitor_stream(self, call_id: str):
+    def _on_stream_exit(self, process: SupervisedProcess):
         """
-        监控流状态
+        FFmpeg 进程自行退出（监管线程回调）：移除会话并关闭其 TCP 连接
         
         Args:
-            call_id: 会话标识
+            process: 退出的进程，名称为会话标识
+        """
+        call_id = process.name
+        with self.stream_lock:
+            info = self.active_streams.get(call_id)
+            if info is None or info["process"] is not process:
+                return
+            del self.active_streams[call_id]
+        self.release_tcp(call_id)
+        
+        logger.warning(f"Stream process exited with code {process.returncode} for call_id: {call_id}")
+        if process.lines:
+            logger.error("FFmpeg error output:\n" + "\n".join(process.tail()))
+    
+    def get_stream_log(self, call_id: str) -> Optional[Dict[str, Any]]:
         """
-        while True:
-            time.sleep(5)
+        获取会话的 FFmpeg 进程状态和最后几行 stderr（ffmpeg 模式包括最近退出的会话）
+        
+        Args:
+            call_id: 会话标识
             
-            with self.stream_lock:
-                if call_id not in self.active_streams:
-                    break
-                
-                stream_info = self.active_streams[call_id]
-                process = stream_info["process"]
-                
-                # 检查进程状态
-                if process.poll() is not None:
-                    logger.warning(f"Stream process exited for call_id: {call_id}")
-                    # 读取错误输出
-                    stderr = process.stderr.read().decode('utf-8', errors='ignore')
-                    if stderr:
-                        logger.error(f"FFmpeg error output: {stderr}")
-                    del self.active_streams[call_id]
-                    break
+        Returns:
+            dict: 进程状态和日志，会话没有对应的 FFmpeg 进程时返回 None
+        """
+        process = self.supervisor.get(call_id)
+        if process is None and self.fanout:
+            process = self.fanout.encoder_process(call_id)
+        return process.info() if process else None
     
     def get_active_streams(self) -> Dict[str, Any]:
         """
@@ -190,15 +539,68 @@ class MediaServer:
             dict: 活动流信息
         """
         with self.stream_lock:
-            return {
+            streams = {
                 call_id: {
                     "target_ip": info["target_ip"],
                     "target_port": info["target_port"],
                     "start_time": info["start_time"],
-                    "duration": time.time() - info["start_time"]
+                    "duration": time.time() - info["start_time"],
+                    "pid": info["process"].pid,
+                    "status": info["process"].status,
+                    "progress": info["process"].progress_info(),
+                    "log": info["process"].tail()
                 }
                 for call_id, info in self.active_streams.items()
             }
+        
+        for hub in (self.fanout, self.scheduler):
+            if hub:
+                for call_id, info in hub.sessions().items():
+                    info["duration"] = time.time() - info["start_time"]
+                    streams[call_id] = info
+        for call_id, info in self.tcp.sessions().items():
+            if call_id in streams:
+                streams[call_id]["tcp"] = info
+        return streams
+    
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取媒体统计
+        
+        Returns:
+            dict: 活动会话数、编码进程数、FFmpeg 进程意外退出次数、fanout 模式转发的和 replay 模式发送的 RTP 包数、
+                  replay 模式的迟发包数和最大会话抖动（毫秒）、TCP 连接数和 TCP 发送缓冲区满时丢弃的包数；
+                  RTP 经本进程转发时（fanout 模式、ffmpeg 模式的进程池）还有按编码器来源的 ACK 到首包延迟直方图，
+                  进程池的空闲进程数和命中、未命中次数，新订阅者补发缓存 GOP 的次数；
+                  当前慢于实时的 FFmpeg 进程数和累计告警次数
+        """
+        with self.stream_lock:
+            streams = len(self.active_streams)
+        tcp = self.tcp.stats()
+        processes = self.supervisor.stats()
+        stats = {"streams": streams, "encoders": streams, "process_exits": processes["exits"],
+                 "encoders_behind": processes["behind"], "behind_alerts": processes["behind_alerts"],
+                 "packets_relayed": 0, "packets_sent": 0, "gop_bursts": 0,
+                 "late_packets": 0, "jitter_max_ms": 0.0,
+                 "tcp_connections": tcp["connections"], "tcp_dropped": tcp["packets_dropped"]}
+        if self.fanout:
+            fanout = self.fanout.stats()
+            stats["streams"] += fanout["subscribers"]
+            stats["encoders"] += fanout["encoders"]
+            stats["packets_relayed"] = fanout["packets_out"]
+            stats["first_packet_ms"] = fanout["first_packet_ms"]
+            stats["gop_bursts"] = fanout["gop_bursts"]
+            if "idle" in fanout:
+                stats["warm_idle"] = fanout["idle"]
+                stats["warm_hits"] = fanout["hits"]
+                stats["warm_misses"] = fanout["misses"]
+        if self.scheduler:
+            replay = self.scheduler.stats()
+            stats["streams"] += replay["streams"]
+            stats["packets_sent"] = replay["packets_sent"]
+            stats["late_packets"] = replay["late_packets"]
+            stats["jitter_max_ms"] = replay["max_jitter_ms"]
+        return stats
     
     def stop_all_streams(self):
         """停止所有流"""
@@ -208,3 +610,64 @@ class MediaServer:
         
         for call_id in call_ids:
             self.stop_stream(call_id)
+        
+        if self.fanout:
+            self.fanout.stop()
+        if self.scheduler:
+            self.scheduler.stop()
+        with self.stream_lock:
+            self.playbacks.clear()
+        self.supervisor.stop()
+        self.tcp.stop()
+    
+    def _load_replay_cache(self) -> Optional[RTPCache]:
+        """
+        加载（一次）replay 模式的 RTP 包缓存文件
+        
+        Returns:
+            RTPCache: 缓存，文件不存在或格式错误时返回 None
+        """
+        with self.stream_lock:
+            if self._replay_cache is not None:
+                return self._replay_cache
+            
+            path = self.replay_cache_path
+            if not os.path.exists(path) and os.path.exists(self.video_file):
+                # H.264 MP4 可以直接在进程内封装为 PS，不需要 FFmpeg
+                try:
+                    build_ps_cache(self.video_file, path)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Cannot build PS cache from {self.video_file}: {e}")
+            if not os.path.exists(path):
+                logger.error(f"RTP cache not found: {path} "
+                             f"(run: python3 scripts/build_rtp_cache.py {self.video_file} -o {path})")
+                return None
+            
+            try:
+                cache = RTPCache(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading RTP cache {path}: {e}")
+                return None
+            
+            if os.path.exists(self.video_file) and os.path.getmtime(self.video_file) > os.path.getmtime(path):
+                logger.warning(f"RTP cache {path} is older than {self.video_file}, consider rebuilding it")
+            
+            logger.info(f"Loaded RTP cache {path}: {cache.count} packets, {cache.seconds:.1f}s loop")
+            self._replay_cache = cache
+            self._replay_epoch = time.monotonic()
+            return cache
+    
+    def _replay_start(self, cache: RTPCache) -> int:
+        """
+        replay 会话的第一个包：循环时间线当前位置之前最近的关键帧起点
+        
+        Args:
+            cache: RTP 包缓存
+            
+        Returns:
+            int: 包序号，未启用 gop_start 或缓存中没有可识别的关键帧时为 0
+        """
+        if not self.gop_start:
+            return 0
+        position = int((time.monotonic() - self._replay_epoch) * RTP_CLOCK)
+        return self._packet_at(cache, load_keyframe_index(cache.path), position)[1]
@@ -0,0 +1,254 @@
+"""
+MP4 视频轨道读取
+解析 moov 中的样本表（stts / ctts / stss / stsz / stsc / stco），按样本直接引用内存映射文件中的数据，
+供进程内 PS 封装使用，不需要 FFmpeg 解封装
+"""
+import logging
+import mmap
+import struct
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 支持的 H.264 样本描述
+H264_CODECS = (b"avc1", b"avc3")
+# VisualSampleEntry 固定字段长度（其后为 avcC 等子 box）
+_VISUAL_SAMPLE_ENTRY_SIZE = 78
+
+
+def _iter_boxes(buf, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    遍历 [start, end) 范围内的 box
+
+    Yields:
+        tuple: (box 类型, 内容起始位置, box 结束位置)
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            break
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _find(buf, start: int, end: int, kind: bytes) -> Optional[Tuple[int, int]]:
+    """查找第一个指定类型的子 box，返回 (内容起始, 结束)"""
+    for box_kind, box_start, box_end in _iter_boxes(buf, start, end):
+        if box_kind == kind:
+            return box_start, box_end
+    return None
+
+
+class MP4VideoTrack:
+    """
+    MP4 文件中的 H.264 视频轨道
+
+    样本数据通过 memoryview 引用内存映射的文件，读取 NAL 单元时不复制数据
+    """
+
+    def __init__(self, path: str):
+        """
+        打开文件并解析视频轨道的样本表
+
+        Args:
+            path: MP4 文件路径
+
+        Raises:
+            ValueError: 文件中没有可用的 H.264 视频轨道
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self._mmap)
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self):
+        buf = self.view
+        moov = _find(buf, 0, len(buf), b"moov")
+        if moov is None:
+            raise ValueError(f"No moov box in {self.path}")
+
+        for kind, start, end in _iter_boxes(buf, *moov):
+            if kind == b"trak" and self._is_video(buf, start, end):
+                self._parse_track(buf, start, end)
+                return
+        raise ValueError(f"No video track in {self.path}")
+
+    @staticmethod
+    def _is_video(buf, start: int, end: int) -> bool:
+        mdia = _find(buf, start, end, b"mdia")
+        hdlr = mdia and _find(buf, *mdia, b"hdlr")
+        return bool(hdlr) and bytes(buf[hdlr[0] + 8:hdlr[0] + 12]) == b"vide"
+
+    def _parse_track(self, buf, start: int, end: int):
+        mdia = _find(buf, start, end, b"mdia")
+        mdhd = _find(buf, *mdia, b"mdhd")
+        version = buf[mdhd[0]]
+        self.timescale = struct.unpack_from(">I", buf, mdhd[0] + (20 if version == 1 else 12))[0]
+
+        stbl = _find(buf, *_find(buf, *mdia, b"minf"), b"stbl")
+        boxes = {kind: (box_start, box_end) for kind, box_start, box_end in _iter_boxes(buf, *stbl)}
+        if b"moof" in boxes or b"stsz" not in boxes:
+            raise ValueError(f"Unsupported MP4 layout in {self.path}")
+
+        self._parse_sample_description(buf, *boxes[b"stsd"])
+        self.sizes = self._parse_sizes(buf, boxes[b"stsz"][0])
+        self.count = len(self.sizes)
+        self.offsets = self._parse_offsets(buf, boxes)
+        self.dts, self.duration = self._parse_times(buf, boxes[b"stts"][0])
+        self.cts = self._parse_composition(buf, boxes.get(b"ctts"))
+        self.keyframes = self._parse_sync(buf, boxes.get(b"stss"))
+
+    def _parse_sample_description(self, buf, start: int, end: int):
+        """读取 avc1 样本描述：分辨率、H.264 profile、NAL 长度字段大小、SPS / PPS"""
+        entries = start + 8
+        kind, entry_start, entry_end = next(_iter_boxes(buf, entries, end))
+        if kind not in H264_CODECS:
+            raise ValueError(f"Unsupported video codec {kind.decode('ascii', errors='ignore')} in {self.path}")
+        self.codec = kind.decode("ascii")
+        self.width, self.height = struct.unpack_from(">HH", buf, entry_start + 24)
+
+        avcc = _find(buf, entry_start + _VISUAL_SAMPLE_ENTRY_SIZE, entry_end, b"avcC")
+        self.parameter_sets: List[bytes] = []
+        self.nal_length_size = 4
+        self.profile_idc: Optional[int] = None
+        if avcc is None:
+            return
+        pos = avcc[0]
+        # AVCProfileIndication（与 SPS 的 profile_idc 相同）
+        self.profile_idc = buf[pos + 1]
+        self.nal_length_size = (buf[pos + 4] & 0x03) + 1
+        pos += 5
+        for mask in (0x1F, 0xFF):
+            # SPS 个数（低 5 位）、PPS 个数
+            count = buf[pos] & mask
+            pos += 1
+            for _ in range(count):
+                length = struct.unpack_from(">H", buf, pos)[0]
+                self.parameter_sets.append(bytes(buf[pos + 2:pos + 2 + length]))
+                pos += 2 + length
+
+    @staticmethod
+    def _parse_sizes(buf, start: int) -> array:
+        sample_size, count = struct.unpack_from(">II", buf, start + 4)
+        if sample_size:
+            return array("L", [sample_size]) * count
+        return array("L", struct.unpack_from(f">{count}I", buf, start + 12))
+
+    def _parse_offsets(self, buf, boxes) -> array:
+        """由 stsc 和 stco / co64 计算每个样本在文件中的位置"""
+        if b"co64" in boxes:
+            start = boxes[b"co64"][0]
+            count = struct.unpack_from(">I", buf, start + 4)[0]
+            chunks = struct.unpack_from(f">{count}Q", buf, start + 8)
+        else:
+            start = boxes[b"stco"][0]
+            count = struct.unpack_from(">I", buf, start + 4)[0]
+            chunks = struct.unpack_from(f">{count}I", buf, start + 8)
+
+        start = boxes[b"stsc"][0]
+        runs = struct.unpack_from(">I", buf, start + 4)[0]
+        entries = [struct.unpack_from(">III", buf, start + 8 + index * 12)[:2] for index in range(runs)]
+
+        offsets = array("Q")
+        sample = 0
+        for index, (first_chunk, per_chunk) in enumerate(entries):
+            last_chunk = entries[index + 1][0] - 1 if index + 1 < runs else len(chunks)
+            for chunk in range(first_chunk - 1, last_chunk):
+                offset = chunks[chunk]
+                for _ in range(per_chunk):
+                    if sample >= self.count:
+                        return offsets
+                    offsets.append(offset)
+                    offset += self.sizes[sample]
+                    sample += 1
+        if sample < self.count:
+            raise ValueError(f"Sample table of {self.path} is truncated")
+        return offsets
+
+    def _parse_times(self, buf, start: int) -> Tuple[array, int]:
+        """解码时间（stts），返回每个样本的 DTS 和轨道总时长"""
+        count = struct.unpack_from(">I", buf, start + 4)[0]
+        dts = array("q")
+        time = 0
+        for index in range(count):
+            samples, delta = struct.unpack_from(">II", buf, start + 8 + index * 8)
+            for _ in range(samples):
+                dts.append(time)
+                time += delta
+        del dts[self.count:]
+        return dts, time
+
+    def _parse_composition(self, buf, box) -> array:
+        """显示时间偏移（ctts），没有 B 帧时全为 0"""
+        cts = array("l")
+        if box is None:
+            return array("l", [0]) * self.count
+        count = struct.unpack_from(">I", buf, box[0] + 4)[0]
+        for index in range(count):
+            samples, offset = struct.unpack_from(">Ii", buf, box[0] + 8 + index * 8)
+            cts.extend([offset] * samples)
+        del cts[self.count:]
+        # 偏移为负（ctts version 1）时整体平移，保证 PTS >= DTS
+        shift = min(cts) if cts else 0
+        if shift < 0:
+            cts = array("l", (offset - shift for offset in cts))
+        return cts
+
+    def _parse_sync(self, buf, box) -> array:
+        """关键帧标记（stss），没有 stss 时每个样本都是关键帧"""
+        if box is None:
+            return array("B", [1]) * self.count
+        keyframes = array("B", [0]) * self.count
+        count = struct.unpack_from(">I", buf, box[0] + 4)[0]
+        for number in struct.unpack_from(f">{count}I", buf, box[0] + 8):
+            if 0 < number <= self.count:
+                keyframes[number - 1] = 1
+        return keyframes
+
+    def sample(self, index: int) -> memoryview:
+        """样本数据（内存映射文件的视图）"""
+        offset = self.offsets[index]
+        return self.view[offset:offset + self.sizes[index]]
+
+    def nal_units(self, index: int) -> Iterator[memoryview]:
+        """
+        拆分样本中的 NAL 单元（去掉长度前缀）
+
+        Args:
+            index: 样本序号
+
+        Yields:
+            memoryview: NAL 单元
+        """
+        data = self.sample(index)
+        size = self.nal_length_size
+        pos, end = 0, len(data)
+        while pos + size <= end:
+            length = int.from_bytes(data[pos:pos + size], "big")
+            pos += size
+            if length == 0 or pos + length > end:
+                break
+            yield data[pos:pos + length]
+            pos += length
+
+    @property
+    def seconds(self) -> float:
+        """轨道时长（秒）"""
+        return self.duration / self.timescale if self.timescale else 0.0
+
+    def close(self):
+        self.view.release()
+        self._mmap.close()
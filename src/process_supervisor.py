@@ -0,0 +1,469 @@
+"""
+子进程监管
+单个线程用 selector 持续读取所有 FFmpeg 子进程的 stderr，按行写入每个进程的有界环形缓冲区
+（管道不会写满而阻塞子进程），管道关闭即进程退出时立即回调，不需要为每个进程启动轮询线程；
+以 -progress pipe:1 启动的进程同时解析标准输出的进度块，得到帧率、码率、速度和丢帧数，
+持续慢于实时时告警
+"""
+import logging
+import os
+import re
+import selectors
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个进程保留的 stderr 行数
+LOG_LINES = 20
+# 单行最大长度（超出时截断为一行）
+MAX_LINE = 1024
+# 单次读取的最大字节数
+READ_SIZE = 65536
+# 保留日志的已退出进程数
+EXITED_KEEP = 64
+# 没有待回收进程时 select 的超时（秒）
+SELECT_TIMEOUT = 1.0
+# stderr 关闭后等待进程退出的轮询间隔（秒）
+REAP_INTERVAL = 0.05
+# 终止进程时等待退出的时间（秒），超时后强制结束
+TERMINATE_TIMEOUT = 5.0
+# 速度（输出时长 / 实际时长）低于该值视为慢于实时
+BEHIND_SPEED = 0.95
+# 持续慢于实时超过该时间（秒）才告警，避免启动和短暂抖动误报
+BEHIND_AFTER = 3.0
+
+# 行结束符：\n 结束的是日志行，\r 结束的是 FFmpeg 覆盖刷新的状态行（frame=... speed=...）
+_LINE_END = re.compile(rb"[\r\n]")
+
+
+def _number(value: Optional[str], suffix: str = "") -> Optional[float]:
+    """解析进度块中的数值（去掉单位后缀），N/A 或格式错误时返回 None"""
+    if value is None:
+        return None
+    try:
+        return float(value.strip().rstrip(suffix) if suffix else value)
+    except ValueError:
+        return None
+
+
+class SupervisedProcess:
+    """被监管的子进程及其 stderr 环形缓冲区和最新的进度"""
+
+    __slots__ = ("name", "process", "lines", "status", "start_time", "end_time", "returncode",
+                 "on_exit", "stopping", "progress", "behind", "behind_since",
+                 "_partial", "_progress_partial", "_block", "_last_block")
+
+    def __init__(self, name: str, process: subprocess.Popen, log_lines: int,
+                 on_exit: Optional[Callable[["SupervisedProcess"], None]]):
+        """
+        初始化
+
+        Args:
+            name: 进程名称（会话标识或编码器名称）
+            process: 子进程
+            log_lines: 保留的 stderr 行数
+            on_exit: 进程自行退出时的回调（由监管线程调用，terminate 结束的进程不回调）
+        """
+        self.name = name
+        self.process = process
+        self.lines: deque = deque(maxlen=max(1, log_lines))
+        self.status = ""
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self.returncode: Optional[int] = None
+        self.on_exit = on_exit
+        self.stopping = False
+        # 最近一个完整进度块的统计，behind 为是否已告警慢于实时
+        self.progress: Dict[str, Any] = {}
+        self.behind = False
+        self.behind_since: Optional[float] = None
+        self._partial = b""
+        self._progress_partial = b""
+        self._block: Dict[str, str] = {}
+        # 上一个进度块的 (单调时间, 帧数, 输出时长)，用于计算最近一个周期的帧率和速度
+        self._last_block: Optional[tuple] = None
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def running(self) -> bool:
+        return self.returncode is None
+
+    def tail(self, count: Optional[int] = None) -> List[str]:
+        """
+        获取最后几行 stderr
+
+        Args:
+            count: 行数，None 时返回缓冲区中的所有行
+
+        Returns:
+            list: 日志行（由旧到新）
+        """
+        lines = list(self.lines)
+        return lines[-count:] if count else lines
+
+    def info(self, count: Optional[int] = None) -> Dict[str, Any]:
+        """
+        获取进程状态和最后几行 stderr
+
+        Args:
+            count: 日志行数，None 时返回缓冲区中的所有行
+
+        Returns:
+            dict: 进程号、是否运行、退出码、开始和结束时间、最新状态行、进度和日志
+        """
+        return {
+            "pid": self.pid,
+            "running": self.running,
+            "returncode": self.returncode,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "status": self.status,
+            "progress": self.progress_info(),
+            "log": self.tail(count),
+        }
+
+    def progress_info(self) -> Dict[str, Any]:
+        """
+        获取最新的进度统计
+
+        Returns:
+            dict: 帧数、帧率、码率（kbit/s）、速度、丢帧和重复帧数、输出时长（秒），
+                  最近一个进度周期的帧率和速度，是否慢于实时；没有进度输出时为空
+        """
+        return dict(self.progress, behind=self.behind) if self.progress else {}
+
+    def feed(self, data: bytes):
+        """按行拆分读到的 stderr 数据"""
+        buffer = self._partial + data
+        start = 0
+        for match in _LINE_END.finditer(buffer):
+            text = buffer[start:match.start()].decode("utf-8", errors="replace").rstrip()
+            start = match.end()
+            if not text:
+                continue
+            if match.group() == b"\r":
+                self.status = text
+            else:
+                self.lines.append(text)
+        self._partial = buffer[start:]
+        if len(self._partial) > MAX_LINE:
+            self.lines.append(self._partial[:MAX_LINE].decode("utf-8", errors="replace"))
+            self._partial = b""
+
+    def feed_progress(self, data: bytes) -> bool:
+        """
+        解析 -progress 输出（每行 key=value，progress=continue / end 结束一个块）
+
+        Args:
+            data: 读到的标准输出数据
+
+        Returns:
+            bool: 是否有新的完整进度块
+        """
+        lines = (self._progress_partial + data).split(b"\n")
+        self._progress_partial = lines.pop()
+        updated = False
+        for line in lines:
+            key, _, value = line.decode("ascii", errors="replace").strip().partition("=")
+            if key == "progress":
+                self._finish_block(value)
+                updated = True
+            elif key:
+                self._block[key] = value
+        return updated
+
+    def _finish_block(self, state: str):
+        block, self._block = self._block, {}
+        now = time.monotonic()
+        frames = int(_number(block.get("frame")) or 0)
+        out_time_us = _number(block.get("out_time_us")) or _number(block.get("out_time_ms"))
+        out_time = out_time_us / 1e6 if out_time_us and out_time_us > 0 else 0.0
+
+        # FFmpeg 输出的 fps 和 speed 是从启动开始的平均值，长时间运行后反映不出最近的变化，
+        # 另按相邻两个进度块之差计算最近一个周期的值
+        fps_now = speed_now = None
+        if self._last_block:
+            last_time, last_frames, last_out_time = self._last_block
+            elapsed = now - last_time
+            if elapsed > 0:
+                fps_now = round((frames - last_frames) / elapsed, 2)
+                speed_now = round((out_time - last_out_time) / elapsed, 3)
+        self._last_block = (now, frames, out_time)
+
+        self.progress = {
+            "frames": frames,
+            "fps": _number(block.get("fps")),
+            "bitrate_kbps": _number(block.get("bitrate"), "kbits/s"),
+            "speed": _number(block.get("speed"), "x"),
+            "drop_frames": int(_number(block.get("drop_frames")) or 0),
+            "dup_frames": int(_number(block.get("dup_frames")) or 0),
+            "out_time": round(out_time, 3),
+            "fps_now": fps_now,
+            "speed_now": speed_now,
+            "state": state,
+            "updated": time.time(),
+        }
+
+    def finish(self):
+        """进程退出后写入缓冲区中未结束的最后一行"""
+        if self._partial:
+            self.lines.append(self._partial.decode("utf-8", errors="replace").rstrip())
+            self._partial = b""
+
+
+class ProcessSupervisor:
+    """
+    子进程监管器
+
+    所有子进程的 stderr 管道设为非阻塞并注册到同一个 selector，监管线程读取就绪的管道；
+    读到 EOF 后回收进程并调用退出回调。已退出进程的日志保留一段时间供查询
+    """
+
+    def __init__(self, log_lines: int = LOG_LINES, behind_speed: float = BEHIND_SPEED):
+        """
+        初始化监管器
+
+        Args:
+            log_lines: 每个进程保留的 stderr 行数
+            behind_speed: 最近一个进度周期的速度低于该值并持续 BEHIND_AFTER 秒时告警
+        """
+        self.log_lines = log_lines
+        self.behind_speed = behind_speed
+        self._processes: Dict[str, SupervisedProcess] = {}
+        self._exited: "OrderedDict[str, SupervisedProcess]" = OrderedDict()
+        # stderr 已关闭、等待退出码的进程
+        self._reaping: List[SupervisedProcess] = []
+        # 已发送 SIGTERM、未等待退出的进程：(强制结束的时刻, 进程)
+        self._terminating: List[Tuple[float, SupervisedProcess]] = []
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event: Optional[threading.Event] = None
+        self.exits = 0
+        self.behind_alerts = 0
+
+    def spawn(self, name: str, cmd: List[str],
+              on_exit: Optional[Callable[[SupervisedProcess], None]] = None,
+              progress: bool = False) -> SupervisedProcess:
+        """
+        启动并监管子进程（标准输入为空设备，stderr 由监管线程读取）
+
+        Args:
+            name: 进程名称，同名进程仍在运行时失败
+            cmd: 命令行参数
+            on_exit: 进程自行退出时的回调
+            progress: 标准输出是否为 FFmpeg -progress 输出（由监管线程解析），否则为空设备
+
+        Returns:
+            SupervisedProcess: 被监管的进程
+
+        Raises:
+            OSError: 启动失败
+            ValueError: 同名进程仍在运行
+        """
+        with self._lock:
+            if name in self._processes:
+                raise ValueError(f"Process already running: {name}")
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE if progress else subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE)
+            proc = SupervisedProcess(name, process, self.log_lines, on_exit)
+            for pipe, is_progress in ((process.stderr, False), (process.stdout, True)):
+                if pipe:
+                    os.set_blocking(pipe.fileno(), False)
+                    self._selector.register(pipe, selectors.EVENT_READ, (proc, is_progress))
+            self._processes[name] = proc
+            self._exited.pop(name, None)
+            if self._thread is None:
+                self._stop_event = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop_event,),
+                                                name="process-supervisor", daemon=True)
+                self._thread.start()
+        return proc
+
+    def get(self, name: str) -> Optional[SupervisedProcess]:
+        """
+        查找进程（包括最近退出的进程）
+
+        Args:
+            name: 进程名称
+
+        Returns:
+            SupervisedProcess: 进程，不存在时返回 None
+        """
+        with self._lock:
+            return self._processes.get(name) or self._exited.get(name)
+
+    def terminate(self, proc: SupervisedProcess, timeout: float = TERMINATE_TIMEOUT, wait: bool = True):
+        """
+        终止进程（超时后强制结束），不调用退出回调
+
+        Args:
+            proc: 进程
+            timeout: 等待退出的时间（秒）
+            wait: 是否等待进程退出；为 False 时只发送 SIGTERM 后立即返回，
+                  由监管线程回收，超时仍未退出时强制结束
+        """
+        proc.stopping = True
+        process = proc.process
+        if process.poll() is not None:
+            return
+        if not wait:
+            process.terminate()
+            with self._lock:
+                self._terminating.append((time.monotonic() + timeout, proc))
+            return
+        try:
+            process.terminate()
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Process {proc.name} (pid {proc.pid}) did not terminate, killing it")
+            process.kill()
+            process.wait()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取监管统计
+
+        Returns:
+            dict: 运行中的进程数、累计自行退出的进程数、当前慢于实时的进程数、累计慢于实时告警次数
+        """
+        with self._lock:
+            return {
+                "processes": len(self._processes),
+                "exits": self.exits,
+                "behind": sum(1 for proc in self._processes.values() if proc.behind),
+                "behind_alerts": self.behind_alerts,
+            }
+
+    def stop(self):
+        """终止所有进程并停止监管线程"""
+        with self._lock:
+            processes = list(self._processes.values())
+        for proc in processes:
+            self.terminate(proc)
+        with self._lock:
+            thread = self._thread
+            if self._stop_event:
+                self._stop_event.set()
+            self._thread = self._stop_event = None
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=SELECT_TIMEOUT * 2)
+
+    def _run(self, stop_event: threading.Event):
+        """监管线程：读取就绪的 stderr 和进度输出，回收已关闭 stderr 的进程"""
+        while not stop_event.is_set():
+            try:
+                events = self._selector.select(
+                    timeout=REAP_INTERVAL if self._reaping or self._terminating else SELECT_TIMEOUT)
+            except OSError:
+                # 管道在 select 期间被关闭
+                events = []
+            for key, _ in events:
+                proc, is_progress = key.data
+                if not self._read(proc, key.fileobj, is_progress):
+                    self._close_pipe(proc, key.fileobj)
+                    if not is_progress:
+                        self._reaping.append(proc)
+            if self._reaping:
+                self._reaping = [proc for proc in self._reaping if not self._reap(proc)]
+            if self._terminating:
+                self._kill_overdue()
+
+    def _kill_overdue(self):
+        """强制结束发送 SIGTERM 后超时仍未退出的进程（进程退出后照常由 stderr 关闭触发回收）"""
+        now = time.monotonic()
+        overdue = []
+        with self._lock:
+            pending, self._terminating = self._terminating, []
+            for deadline, proc in pending:
+                if proc.process.poll() is not None:
+                    continue
+                if deadline > now:
+                    self._terminating.append((deadline, proc))
+                else:
+                    overdue.append(proc)
+        for proc in overdue:
+            logger.warning(f"Process {proc.name} (pid {proc.pid}) did not terminate, killing it")
+            proc.process.kill()
+
+    def _read(self, proc: SupervisedProcess, pipe, is_progress: bool) -> bool:
+        """读取管道中的所有数据，返回管道是否仍然打开"""
+        fd = pipe.fileno()
+        while True:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            if not data:
+                return False
+            if not is_progress:
+                proc.feed(data)
+            elif proc.feed_progress(data):
+                self._check_speed(proc)
+
+    def _check_speed(self, proc: SupervisedProcess):
+        """最近一个进度周期的速度持续低于 behind_speed 时告警，恢复后记录"""
+        progress = proc.progress
+        speed = progress.get("speed_now")
+        if speed is None or proc.stopping:
+            return
+        now = time.monotonic()
+        if speed < self.behind_speed:
+            if proc.behind_since is None:
+                proc.behind_since = now
+            elif not proc.behind and now - proc.behind_since >= BEHIND_AFTER:
+                proc.behind = True
+                self.behind_alerts += 1
+                logger.warning(f"FFmpeg process {proc.name} is falling behind real time: "
+                               f"speed {speed}x (average {progress['speed']}x), fps {progress['fps_now']}, "
+                               f"{progress['drop_frames']} frames dropped")
+        else:
+            proc.behind_since = None
+            if proc.behind:
+                proc.behind = False
+                logger.info(f"FFmpeg process {proc.name} caught up with real time (speed {speed}x)")
+
+    def _close_pipe(self, proc: SupervisedProcess, pipe):
+        if pipe is proc.process.stderr:
+            proc.finish()
+        try:
+            self._selector.unregister(pipe)
+        except (KeyError, ValueError):
+            pass
+        pipe.close()
+
+    def _reap(self, proc: SupervisedProcess) -> bool:
+        """进程已退出时记录退出码、保留日志并调用回调，返回是否已回收"""
+        returncode = proc.process.poll()
+        if returncode is None:
+            return False
+        proc.returncode = returncode
+        proc.end_time = time.time()
+        proc.behind = False
+        stdout = proc.process.stdout
+        if stdout and not stdout.closed:
+            self._close_pipe(proc, stdout)
+        with self._lock:
+            if self._processes.get(proc.name) is proc:
+                del self._processes[proc.name]
+            self._exited[proc.name] = proc
+            while len(self._exited) > EXITED_KEEP:
+                self._exited.popitem(last=False)
+            if not proc.stopping:
+                self.exits += 1
+        if proc.on_exit and not proc.stopping:
+            try:
+                proc.on_exit(proc)
+            except Exception as e:
+                logger.error(f"Error in exit callback of {proc.name}: {e}", exc_info=True)
+        return True
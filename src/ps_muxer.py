@@ -0,0 +1,273 @@
+"""
+GB28181 PS（MPEG-2 Program Stream）封装
+把 H.264 访问单元封装为 PS 包（pack header、system header、PSM、PES）并按 RTP 负载大小切分。
+输出为缓冲区片段列表，NAL 数据以 memoryview 引用源文件，封装和切分过程中不复制负载
+"""
+import logging
+import struct
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Buffer = Union[bytes, memoryview]
+
+# GB28181 PS over RTP 的负载类型（SDP a=rtpmap:96 PS/90000）
+PS_PAYLOAD_TYPE = 96
+# 单个 RTP 包的最大负载（字节）：加上 RTP / UDP / IP 头部不超过以太网 MTU
+RTP_PS_PAYLOAD = 1400
+RTP_CLOCK = 90000
+
+# PS 流 ID 与流类型
+VIDEO_STREAM_ID = 0xE0
+STREAM_TYPE_H264 = 0x1B
+START_CODE = b"\x00\x00\x00\x01"
+# PES_packet_length 为 16 位，单个 PES 包放不下的帧拆分为多个 PES
+MAX_PES_LENGTH = 0xFFFF
+# 默认复用码率（单位 50 字节/秒），约 8 Mbit/s
+DEFAULT_MUX_RATE = 20000
+
+
+def _crc32_mpeg2(data: bytes) -> int:
+    """MPEG-2 CRC32（多项式 0x04C11DB7，不反转，初值 0xFFFFFFFF）"""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def _timestamp(prefix: int, value: int) -> bytes:
+    """PES 头中的 33 位 PTS / DTS 字段（5 字节，带标记位）"""
+    value &= (1 << 33) - 1
+    return bytes((
+        (prefix << 4) | ((value >> 29) & 0x0E) | 0x01,
+        (value >> 22) & 0xFF,
+        ((value >> 14) & 0xFE) | 0x01,
+        (value >> 7) & 0xFF,
+        ((value << 1) & 0xFE) | 0x01,
+    ))
+
+
+def pack_header(scr: int, mux_rate: int = DEFAULT_MUX_RATE) -> bytes:
+    """
+    构建 pack header（14 字节，无填充）
+
+    Args:
+        scr: 系统时钟基准（90kHz，扩展部分为 0）
+        mux_rate: 复用码率（单位 50 字节/秒）
+
+    Returns:
+        bytes: pack header
+    """
+    scr &= (1 << 33) - 1
+    return b"\x00\x00\x01\xba" + bytes((
+        0x44 | ((scr >> 27) & 0x38) | ((scr >> 28) & 0x03),
+        (scr >> 20) & 0xFF,
+        ((scr >> 12) & 0xF8) | 0x04 | ((scr >> 13) & 0x03),
+        (scr >> 5) & 0xFF,
+        ((scr << 3) & 0xF8) | 0x04,
+        0x01,
+        (mux_rate >> 14) & 0xFF,
+        (mux_rate >> 6) & 0xFF,
+        ((mux_rate << 2) & 0xFC) | 0x03,
+        0xF8,
+    ))
+
+
+def system_header(rate_bound: int = DEFAULT_MUX_RATE) -> bytes:
+    """
+    构建 system header（只有一个视频流）
+
+    Args:
+        rate_bound: 复用码率上限（单位 50 字节/秒）
+
+    Returns:
+        bytes: system header
+    """
+    body = bytes((
+        0x80 | ((rate_bound >> 15) & 0x7F),
+        (rate_bound >> 7) & 0xFF,
+        ((rate_bound << 1) & 0xFE) | 0x01,
+        0x00,  # audio_bound=0, fixed_flag=0, CSPS_flag=0
+        0xE1,  # 音视频锁定标志、标记位、video_bound=1
+        0x7F,  # packet_rate_restriction_flag=0
+        # 视频流：P-STD 缓冲区以 1024 字节为单位，上限 2 MB
+        VIDEO_STREAM_ID, 0xE8, 0x00,
+    ))
+    return b"\x00\x00\x01\xbb" + struct.pack(">H", len(body)) + body
+
+
+def program_stream_map(stream_type: int = STREAM_TYPE_H264) -> bytes:
+    """
+    构建 PSM（节目流映射），包含 CRC32
+
+    Args:
+        stream_type: 视频流类型，0x1B 为 H.264
+
+    Returns:
+        bytes: PSM
+    """
+    es_map = bytes((stream_type, VIDEO_STREAM_ID, 0x00, 0x00))
+    # current_next_indicator=1、版本 0；program_stream_info_length=0
+    body = b"\xe0\xff" + b"\x00\x00" + struct.pack(">H", len(es_map)) + es_map
+    header = b"\x00\x00\x01\xbc" + struct.pack(">H", len(body) + 4)
+    return header + body + struct.pack(">I", _crc32_mpeg2(header + body))
+
+
+def pes_header(payload_length: int, pts: Optional[int] = None, dts: Optional[int] = None) -> bytes:
+    """
+    构建视频 PES 包头
+
+    Args:
+        payload_length: PES 负载长度
+        pts: 显示时间戳（90kHz），None 表示不带时间戳（帧的后续 PES 包）
+        dts: 解码时间戳，与 PTS 相同或为 None 时只写 PTS
+
+    Returns:
+        bytes: PES 包头
+    """
+    if pts is None:
+        fields = b""
+        flags = 0x00
+    elif dts is None or dts == pts:
+        fields = _timestamp(0x2, pts)
+        flags = 0x80
+    else:
+        fields = _timestamp(0x3, pts) + _timestamp(0x1, dts)
+        flags = 0xC0
+    # 带时间戳的 PES 为访问单元起始，设置 data_alignment_indicator
+    alignment = 0x84 if pts is not None else 0x80
+    length = 3 + len(fields) + payload_length
+    return b"\x00\x00\x01" + bytes((VIDEO_STREAM_ID,)) + struct.pack(">HBBB", length, alignment, flags,
+                                                                        len(fields)) + fields
+
+
+def split_buffers(buffers: Iterable[Buffer], size: int,
+                  first_size: Optional[int] = None) -> Iterator[List[memoryview]]:
+    """
+    把缓冲区序列按固定大小切分（切分处只创建 memoryview 切片，不复制数据）
+
+    Args:
+        buffers: 缓冲区序列
+        size: 每段的最大字节数
+        first_size: 第一段的最大字节数，默认与 size 相同
+
+    Yields:
+        list: 一段数据的缓冲区片段，总长度不超过 size
+    """
+    chunk: List[memoryview] = []
+    room = first_size or size
+    for buffer in buffers:
+        view = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        pos, length = 0, len(view)
+        while pos < length:
+            take = min(room, length - pos)
+            chunk.append(view[pos:pos + take] if take < length else view)
+            pos += take
+            room -= take
+            if room == 0:
+                yield chunk
+                chunk, room = [], size
+    if chunk:
+        yield chunk
+
+
+class PSMuxer:
+    """
+    H.264 到 PS 的封装器
+
+    每帧一个 pack header；关键帧前加 system header、PSM 和 SPS / PPS，
+    平台从任意关键帧开始都能解码
+    """
+
+    def __init__(self, parameter_sets: Iterable[bytes] = (), mux_rate: int = DEFAULT_MUX_RATE):
+        """
+        初始化封装器
+
+        Args:
+            parameter_sets: SPS / PPS（不含起始码），在每个关键帧前重复发送
+            mux_rate: 复用码率（单位 50 字节/秒）
+        """
+        self.parameter_sets = [memoryview(bytes(nal)) for nal in parameter_sets]
+        self.mux_rate = max(1, min(mux_rate, (1 << 22) - 1))
+        self._system_header = system_header(self.mux_rate)
+        self._psm = program_stream_map()
+        self._start_code = memoryview(START_CODE)
+
+    def mux_frame(self, nal_units: Iterable[Buffer], pts: int, dts: int, keyframe: bool) -> List[Buffer]:
+        """
+        封装一帧
+
+        Args:
+            nal_units: 帧的 NAL 单元（不含起始码或长度前缀）
+            pts: 显示时间戳（90kHz）
+            dts: 解码时间戳（90kHz），同时作为 SCR
+            keyframe: 是否为关键帧
+
+        Returns:
+            list: PS 数据的缓冲区片段
+        """
+        start_code = self._start_code
+        elementary: List[Buffer] = []
+        if keyframe:
+            for nal in self.parameter_sets:
+                elementary.append(start_code)
+                elementary.append(nal)
+        for nal in nal_units:
+            elementary.append(start_code)
+            elementary.append(nal)
+
+        output: List[Buffer] = [pack_header(dts, self.mux_rate)]
+        if keyframe:
+            output.append(self._system_header)
+            output.append(self._psm)
+
+        # 首个 PES 带 PTS（5 字节），PTS 与 DTS 不同时再带 DTS
+        first_room = MAX_PES_LENGTH - 3 - (10 if dts != pts else 5)
+        total = sum(len(buffer) for buffer in elementary)
+        if total <= first_room:
+            output.append(pes_header(total, pts, dts))
+            output.extend(elementary)
+            return output
+
+        # 大帧拆分为多个 PES：首个带时间戳，其余只有基本头
+        first = True
+        for chunk in split_buffers(elementary, MAX_PES_LENGTH - 3, first_room):
+            length = sum(len(view) for view in chunk)
+            output.append(pes_header(length, pts, dts) if first else pes_header(length))
+            output.extend(chunk)
+            first = False
+        return output
+
+
+def iter_rtp_payloads(track, max_payload: int = RTP_PS_PAYLOAD) -> Iterator[Tuple[int, int, bool, List[memoryview]]]:
+    """
+    把视频轨道的每一帧封装为 PS 并切分为 RTP 负载
+
+    同一帧的 RTP 包时间戳相同（DTS），最后一个包设置 marker；发送时间在帧间隔内均匀分布
+
+    Args:
+        track: 视频轨道（MP4VideoTrack）
+        max_payload: 单个 RTP 包的最大负载
+
+    Yields:
+        tuple: (发送偏移, RTP 时间戳, marker, 负载缓冲区片段)，时间单位为 90kHz
+    """
+    scale = RTP_CLOCK / track.timescale
+    bitrate = sum(track.sizes) * 8 / track.seconds if track.seconds else 0
+    muxer = PSMuxer(track.parameter_sets, mux_rate=int(bitrate * 1.5 / 8 / 50) or DEFAULT_MUX_RATE)
+    duration = round(track.duration * scale)
+
+    for index in range(track.count):
+        dts = round(track.dts[index] * scale)
+        pts = round((track.dts[index] + track.cts[index]) * scale)
+        next_dts = round(track.dts[index + 1] * scale) if index + 1 < track.count else duration
+        frame = muxer.mux_frame(track.nal_units(index), pts, dts, bool(track.keyframes[index]))
+
+        packets = list(split_buffers(frame, max_payload))
+        span = max(0, next_dts - dts)
+        last = len(packets) - 1
+        for number, payload in enumerate(packets):
+            yield dts + span * number // len(packets), dts, number == last, payload
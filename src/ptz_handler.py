@@ -3,8 +3,8 @@ PTZ 云台控制处理器
 处理平台的 PTZ 控制命令
 """
 import logging
-from typing import Dict, Any
-from xml_builder import XMLBuilder, parse_xml_message
+from typing import Dict, Any, Union
+from xml_builder import XMLBuilder, parse_manscdp
 from gb28181_protocol import parse_ptz_command
 
 logger = logging.getLogger(__name__)
@@ -31,18 +31,18 @@ class PTZHandler:
         
         logger.info(f"PTZHandler initialized for device {self.device_id}, PTZ enabled: {self.ptz_enabled}")
     
-    def handle_ptz_control(self, xml_message: str) -> str:
+    def handle_ptz_control(self, xml_message: Union[str, Dict[str, Any]]) -> str:
         """
         处理 PTZ 控制命令
         
         Args:
-            xml_message: XML 控制消息
+            xml_message: XML 控制消息，或 parse_manscdp 的解析结果
             
         Returns:
             str: XML 响应消息
         """
         try:
-            parsed = parse_xml_message(xml_message)
+            parsed = parse_manscdp(xml_message)
             sn = parsed.get("SN", "1")
             device_id = parsed.get("DeviceID")
             ptz_cmd = parsed.get("PTZCmd", "")
@@ -0,0 +1,206 @@
+"""
+模拟录像索引
+按 (通道, 时间) 确定性地计算录像记录，不预先生成列表，任意时间范围的查询都按需逐条产生
+"""
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 时间计算的基准点（本地时间，与查询中的无时区时间一致）
+EPOCH = datetime(2000, 1, 1)
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# 默认录像文件时长（秒）：每通道每天 1440 个定时录像文件
+DEFAULT_SEGMENT_SECONDS = 60
+# 默认每小时报警录像数
+DEFAULT_ALARMS_PER_HOUR = 6
+# 报警录像时长范围（秒）
+ALARM_MIN_SECONDS = 10
+ALARM_MAX_SECONDS = 120
+# 模拟码率（bit/s），用于估算文件大小
+BITRATE = 4 * 1024 * 1024
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix(seed: int, value: int) -> int:
+    """splitmix64：由种子和序号得到确定的 64 位伪随机数"""
+    z = (seed + (value + 1) * 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+class RecordIndex:
+    """
+    确定性的模拟录像索引
+
+    每个通道按 segment_seconds 切分为连续的定时录像文件，另在每小时内的
+    固定（由通道和小时决定）位置产生 alarms_per_hour 条报警录像。
+    同一查询总是得到相同结果，记录数可在不生成记录的情况下计算（用于 SumNum）
+    """
+
+    def __init__(self, channels: List[Dict[str, Any]], segment_seconds: int = DEFAULT_SEGMENT_SECONDS,
+                 alarms_per_hour: int = DEFAULT_ALARMS_PER_HOUR):
+        """
+        初始化录像索引
+
+        Args:
+            channels: 通道配置列表
+            segment_seconds: 定时录像文件时长（秒）
+            alarms_per_hour: 每小时报警录像数
+        """
+        self.channels = channels
+        self.segment_seconds = max(1, int(segment_seconds))
+        self.alarms_per_hour = max(0, int(alarms_per_hour))
+
+    def select_channels(self, device_id: Optional[str]) -> List[Dict[str, Any]]:
+        """
+        确定查询涉及的通道：查询目标为某个通道时只查该通道，否则查询设备的全部通道
+
+        Args:
+            device_id: 查询消息中的 DeviceID
+
+        Returns:
+            list: 通道配置列表
+        """
+        for channel in self.channels:
+            if channel.get("channel_id") == device_id:
+                return [channel]
+        return self.channels
+
+    def count(self, channels: List[Dict[str, Any]], start: datetime, end: datetime) -> int:
+        """
+        统计时间范围内的录像数（不生成记录）
+
+        Args:
+            channels: 通道配置列表
+            start: 开始时间
+            end: 结束时间
+
+        Returns:
+            int: 录像数
+        """
+        start_s, end_s = self._seconds(start), self._seconds(end)
+        if end_s <= start_s:
+            return 0
+        segments = -(-end_s // self.segment_seconds) - start_s // self.segment_seconds
+        total = 0
+        for channel in channels:
+            seed = self._seed(channel)
+            alarms = sum(1 for _ in self._alarms(seed, start_s, end_s))
+            total += segments + alarms
+        return total
+
+    def iter_records(self, channels: List[Dict[str, Any]], start: datetime,
+                     end: datetime) -> Iterator[Dict[str, str]]:
+        """
+        逐条产生时间范围内的录像记录（按通道、开始时间排序）
+
+        与范围有交集的录像均返回，录像本身的起止时间不截断
+
+        Args:
+            channels: 通道配置列表
+            start: 开始时间
+            end: 结束时间
+
+        Yields:
+            dict: 录像记录
+        """
+        start_s, end_s = self._seconds(start), self._seconds(end)
+        if end_s <= start_s:
+            return
+        for channel in channels:
+            yield from self._iter_channel(channel, start_s, end_s)
+
+    def _iter_channel(self, channel: Dict[str, Any], start_s: int, end_s: int) -> Iterator[Dict[str, str]]:
+        """逐小时合并定时录像与报警录像"""
+        seed = self._seed(channel)
+        length = self.segment_seconds
+        first = start_s // length * length
+
+        # 报警录像可能从范围开始前的一小时延续进来；首个定时录像也可能早于范围开始
+        hour = min(first, start_s - ALARM_MAX_SECONDS) // 3600 * 3600
+        while hour < end_s:
+            hour_end = hour + 3600
+            entries = []
+            # 该小时内开始、且与范围有交集的定时录像
+            segment = max(first, -(-hour // length) * length)
+            while segment < min(hour_end, end_s):
+                entries.append((segment, segment + length, "time"))
+                segment += length
+            for alarm_start, alarm_end in self._hour_alarms(seed, hour // 3600):
+                if alarm_start < end_s and alarm_end > start_s:
+                    entries.append((alarm_start, alarm_end, "alarm"))
+            entries.sort()
+            for record_start, record_end, record_type in entries:
+                yield self._record(channel, seed, record_start, record_end, record_type)
+            hour = hour_end
+
+    def _alarms(self, seed: int, start_s: int, end_s: int) -> Iterator[tuple]:
+        """与范围有交集的报警录像 (开始, 结束)"""
+        hour = (start_s - ALARM_MAX_SECONDS) // 3600
+        while hour * 3600 < end_s:
+            for alarm_start, alarm_end in self._hour_alarms(seed, hour):
+                if alarm_start < end_s and alarm_end > start_s:
+                    yield alarm_start, alarm_end
+            hour += 1
+
+    def _hour_alarms(self, seed: int, hour: int) -> Iterator[tuple]:
+        """某小时内的报警录像 (开始, 结束)，位置和时长由通道与小时决定"""
+        for index in range(self.alarms_per_hour):
+            value = _mix(seed, hour * 64 + index)
+            start = hour * 3600 + value % 3600
+            duration = ALARM_MIN_SECONDS + (value >> 32) % (ALARM_MAX_SECONDS - ALARM_MIN_SECONDS + 1)
+            yield start, start + duration
+
+    @staticmethod
+    def _record(channel: Dict[str, Any], seed: int, start_s: int, end_s: int, record_type: str) -> Dict[str, str]:
+        """构建单条录像记录"""
+        channel_id = channel.get("channel_id")
+        start_dt = EPOCH + timedelta(seconds=start_s)
+        stamp = start_dt.strftime("%Y%m%d%H%M%S")
+        # 文件大小按码率估算，±20% 波动
+        size = (end_s - start_s) * BITRATE // 8 * (80 + _mix(seed, start_s) % 41) // 100
+        return {
+            "device_id": channel_id,
+            "name": f"{channel.get('name', 'Channel')}_{record_type}_{stamp}",
+            "file_path": f"/record/{start_dt.strftime('%Y%m%d')}/{channel_id}/{stamp}_{record_type}.mp4",
+            "start_time": start_dt.strftime(TIME_FORMAT),
+            "end_time": (EPOCH + timedelta(seconds=end_s)).strftime(TIME_FORMAT),
+            "secrecy": "0",
+            "type": record_type,  # time: 定时录像, alarm: 报警录像
+            "file_size": str(size),
+        }
+
+    @staticmethod
+    def _seed(channel: Dict[str, Any]) -> int:
+        return zlib.crc32(str(channel.get("channel_id")).encode("utf-8"))
+
+    @staticmethod
+    def _seconds(value: datetime) -> int:
+        return int((value - EPOCH).total_seconds())
+
+
+def parse_time_range(start_time: Optional[str], end_time: Optional[str]) -> Optional[tuple]:
+    """
+    解析查询的时间范围，未指定时取最近 24 小时
+
+    Args:
+        start_time: 开始时间字符串
+        end_time: 结束时间字符串
+
+    Returns:
+        tuple: (开始, 结束) datetime，解析失败时返回 None
+    """
+    try:
+        if start_time and end_time:
+            return datetime.strptime(start_time, TIME_FORMAT), datetime.strptime(end_time, TIME_FORMAT)
+        end_dt = datetime.now().replace(microsecond=0)
+        return end_dt - timedelta(hours=24), end_dt
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Failed to parse time range: {e}")
+        return None
@@ -0,0 +1,445 @@
+"""
+预打包 RTP 回放
+离线把视频文件编码并打包为 RTP 包文件（每个包带发送时间偏移），运行时内存映射该文件，
+由 RTP 发送调度器为所有会话循环发送，每个包只改写序号、时间戳和 SSRC
+"""
+import logging
+import math
+import mmap
+import os
+import random
+import socket
+import struct
+import subprocess
+import time
+from array import array
+from collections import deque
+from functools import cached_property
+from typing import Any, BinaryIO, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from mp4_reader import MP4VideoTrack
+from ps_muxer import PS_PAYLOAD_TYPE, RTP_PS_PAYLOAD, iter_rtp_payloads
+from rtp_scheduler import MAX_LAG, PacedStream
+from rtp_tcp import TCPMediaConnection, is_keyframe
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件格式：文件头 + 连续的包记录（发送偏移、包长度、完整 RTP 包）
+# RTP 头中的时间戳为相对值（同一帧的包相同），marker 和负载类型原样发送
+CACHE_MAGIC = b"GBRTPC01"
+_HEADER = struct.Struct("<8sHHIQ")  # 魔数, 版本, 负载类型, 包数, 循环周期（90kHz）
+_RECORD = struct.Struct("<IH")      # 发送偏移（90kHz）, RTP 包长度
+CACHE_VERSION = 1
+
+# RTP 时钟频率
+RTP_CLOCK = 90000
+RTP_HEADER_SIZE = 12
+# MPEG-TS over RTP（RFC 2250）：负载类型 33，每个 RTP 包 7 个 TS 包
+MP2T_PAYLOAD_TYPE = 33
+TS_PACKET_SIZE = 188
+TS_PACKETS_PER_RTP = 7
+_PCR_WRAP = 1 << 33
+
+# 暂停的回放会话检查控制命令的间隔（秒）
+PAUSE_POLL = 0.05
+
+_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+def default_cache_path(video_file: str) -> str:
+    """视频文件对应的默认缓存文件路径"""
+    return video_file + ".rtp"
+
+
+def _read_pcr(packet: bytes) -> Optional[int]:
+    """读取 TS 包自适应字段中的 PCR（90kHz 基准部分），没有时返回 None"""
+    if not packet[3] & 0x20 or packet[4] < 7 or not packet[5] & 0x10:
+        return None
+    return (packet[6] << 25) | (packet[7] << 17) | (packet[8] << 9) | (packet[9] << 1) | (packet[10] >> 7)
+
+
+def _iter_ts_packets(stream: BinaryIO) -> Iterator[bytes]:
+    """按 188 字节切分 TS 流，失步时重新查找同步字节"""
+    buffer = b""
+    while True:
+        chunk = stream.read(TS_PACKET_SIZE * 512)
+        if not chunk:
+            return
+        buffer += chunk
+        pos = 0
+        while len(buffer) - pos >= TS_PACKET_SIZE:
+            if buffer[pos] != 0x47:
+                sync = buffer.find(b"\x47", pos + 1)
+                if sync == -1:
+                    pos = len(buffer)
+                    break
+                pos = sync
+                continue
+            yield buffer[pos:pos + TS_PACKET_SIZE]
+            pos += TS_PACKET_SIZE
+        buffer = buffer[pos:]
+
+
+def iter_ts_payloads(stream: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+    """
+    把 MPEG-TS 流按 7 个 TS 包打包为 RTP 负载，并由 PCR 计算发送时间
+
+    两个 PCR 之间的负载按 TS 包位置线性插值，使发送均匀；首个 PCR 之前的负载时间为 0
+
+    Args:
+        stream: TS 字节流
+
+    Yields:
+        tuple: (相对首个 PCR 的发送偏移（90kHz）, RTP 负载)
+    """
+    chunk_size = TS_PACKET_SIZE * TS_PACKETS_PER_RTP
+    origin = last_raw = None
+    wraps = 0
+    anchor: Optional[Tuple[int, int]] = None  # 上一个 PCR：(TS 包序号, 时间)
+    rate = 0.0  # 每个 TS 包的时间（90kHz）
+    pending: List[Tuple[int, bytes]] = []  # 等待下一个 PCR 确定时间的负载：(首个 TS 包序号, 负载)
+    group = bytearray()
+    group_start = count = latest = 0
+
+    def resolve(index: int) -> int:
+        if anchor is None:
+            return 0
+        return max(latest, anchor[1] + int((index - anchor[0]) * rate))
+
+    for packet in _iter_ts_packets(stream):
+        raw = _read_pcr(packet)
+        if raw is not None:
+            if last_raw is not None and raw < last_raw - (_PCR_WRAP >> 1):
+                wraps += 1
+            last_raw = raw
+            if origin is None:
+                origin = raw
+            now = raw + wraps * _PCR_WRAP - origin
+            if anchor is not None and count > anchor[0] and now > anchor[1]:
+                rate = (now - anchor[1]) / (count - anchor[0])
+            for first, payload in pending:
+                latest = resolve(first)
+                yield latest, payload
+            pending.clear()
+            anchor = (count, now)
+
+        if not group:
+            group_start = count
+        group += packet
+        count += 1
+        if len(group) == chunk_size:
+            pending.append((group_start, bytes(group)))
+            group = bytearray()
+
+    if group:
+        pending.append((group_start, bytes(group)))
+    # 最后一个 PCR 之后的负载按最近的码率外推
+    for first, payload in pending:
+        latest = resolve(first)
+        yield latest, payload
+
+
+def write_packets(packets: Iterable[Tuple[int, int, bool, Sequence]], cache_file: str, payload_type: int,
+                  duration: Optional[int] = None) -> Tuple[int, float]:
+    """
+    把 RTP 负载写入缓存文件（先写临时文件，完成后替换）
+
+    Args:
+        packets: (发送偏移, RTP 时间戳, marker, 负载缓冲区片段) 序列，时间单位为 90kHz
+        cache_file: 缓存文件路径
+        payload_type: RTP 负载类型
+        duration: 循环周期（90kHz），None 时取最后一个包的偏移再加一个平均包间隔
+
+    Returns:
+        tuple: (包数, 循环周期秒数)
+    """
+    temp_file = cache_file + ".tmp"
+    rtp_header = struct.Struct("!BBHII")
+    count = last = 0
+    with open(temp_file, "wb") as f:
+        f.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, payload_type, 0, 0))
+        for offset, stamp, marker, payload in packets:
+            length = RTP_HEADER_SIZE + sum(len(buffer) for buffer in payload)
+            f.write(_RECORD.pack(offset, length))
+            f.write(rtp_header.pack(0x80, payload_type | (0x80 if marker else 0), count & 0xFFFF, stamp, 0))
+            for buffer in payload:
+                f.write(buffer)
+            count += 1
+            last = offset
+        if not count:
+            raise ValueError("no packets in input")
+        if duration is None:
+            duration = last + max(1, last // max(1, count - 1))
+        f.seek(0)
+        f.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, payload_type, count, duration))
+    os.replace(temp_file, cache_file)
+    return count, duration / RTP_CLOCK
+
+
+def write_cache(stream: BinaryIO, cache_file: str, payload_type: int = MP2T_PAYLOAD_TYPE) -> Tuple[int, float]:
+    """
+    把 TS 流打包并写入缓存文件
+
+    Args:
+        stream: TS 字节流
+        cache_file: 缓存文件路径
+        payload_type: RTP 负载类型
+
+    Returns:
+        tuple: (包数, 循环周期秒数)
+    """
+    packets = ((offset, offset, False, (payload,)) for offset, payload in iter_ts_payloads(stream))
+    return write_packets(packets, cache_file, payload_type)
+
+
+def build_ps_cache(video_file: str, cache_file: str, max_payload: int = RTP_PS_PAYLOAD) -> Tuple[int, float]:
+    """
+    用进程内 PS 封装把 MP4 文件中的 H.264 视频打包写入缓存文件（不重新编码，不需要 FFmpeg）
+
+    Args:
+        video_file: MP4 文件路径
+        cache_file: 缓存文件路径
+        max_payload: 单个 RTP 包的最大负载
+
+    Returns:
+        tuple: (包数, 循环周期秒数)
+
+    Raises:
+        ValueError: 文件不是 H.264 编码的 MP4
+    """
+    logger.info(f"Building PS RTP cache {cache_file} from {video_file}")
+    track = MP4VideoTrack(video_file)
+    try:
+        duration = round(track.duration * RTP_CLOCK / track.timescale)
+        return write_packets(iter_rtp_payloads(track, max_payload), cache_file, PS_PAYLOAD_TYPE, duration)
+    finally:
+        track.close()
+
+
+def build_cache(video_file: str, cache_file: str, encoder_args: List[str]) -> Tuple[int, float]:
+    """
+    用 FFmpeg 把视频文件编码为 TS 流并打包写入缓存文件（离线步骤，不限速运行）
+
+    Args:
+        video_file: 视频文件路径
+        cache_file: 缓存文件路径
+        encoder_args: FFmpeg 视频编码参数
+
+    Returns:
+        tuple: (包数, 循环周期秒数)
+    """
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", video_file]
+    cmd.extend(encoder_args)
+    cmd.extend(["-an", "-f", "mpegts", "pipe:1"])
+    logger.info(f"Building RTP cache {cache_file} from {video_file}")
+    logger.debug(f"FFmpeg command: {' '.join(cmd)}")
+
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        result = write_cache(process.stdout, cache_file)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode("utf-8", errors="ignore")
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg exited with code {process.returncode}: {stderr.strip()}")
+    return result
+
+
+class RTPCache:
+    """内存映射的 RTP 包缓存文件，多个会话共享同一份映射"""
+
+    def __init__(self, path: str):
+        """
+        打开缓存文件并建立包索引
+
+        Args:
+            path: 缓存文件路径
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.payload_type, count, self.duration = _HEADER.unpack_from(self._mmap, 0)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            self._mmap.close()
+            raise ValueError(f"Not an RTP cache file: {path}")
+
+        self.view = memoryview(self._mmap)
+        # 包索引：数据位置、长度、发送偏移、RTP 时间戳
+        self.positions = array("L")
+        self.lengths = array("H")
+        self.offsets = array("L")
+        self.stamps = array("L")
+        pos = _HEADER.size
+        for _ in range(count):
+            offset, length = _RECORD.unpack_from(self._mmap, pos)
+            pos += _RECORD.size
+            self.positions.append(pos)
+            self.lengths.append(length)
+            self.offsets.append(offset)
+            self.stamps.append(struct.unpack_from("!I", self._mmap, pos + 4)[0])
+            pos += length
+        self.count = count
+
+    @cached_property
+    def keyframes(self) -> array:
+        """每个包是否为关键帧起点（RTP over TCP 发送缓冲区溢出后从关键帧恢复），首次使用时计算"""
+        view = self.view
+        return array("B", (is_keyframe(view[pos:pos + length]) for pos, length in zip(self.positions, self.lengths)))
+
+    @property
+    def seconds(self) -> float:
+        """循环周期（秒）"""
+        return self.duration / RTP_CLOCK
+
+    def close(self):
+        """释放内存映射"""
+        self.view.release()
+        self._mmap.close()
+
+
+class ReplayStream(PacedStream):
+    """
+    单个回放会话：按缓存中的发送偏移循环发送，由 RTPScheduler 调度
+
+    录像回放和下载会话另有倍速（只改变发送节奏，RTP 时间戳仍为媒体时间）、终点、暂停和跳转；
+    控制命令可以在任意线程提交，由发送线程在下一次 send_due 时执行
+    """
+
+    __slots__ = ("cache", "seq", "ts_base", "index", "loop", "origin", "header", "tcp",
+                 "scale", "end", "paused", "commands")
+
+    def __init__(self, call_id: str, cache: RTPCache, addr: tuple, ssrc: Optional[int] = None,
+                 tcp: Optional[TCPMediaConnection] = None, start: int = 0, scale: float = 1.0,
+                 end: Optional[int] = None):
+        """
+        初始化回放会话
+
+        Args:
+            call_id: 会话标识
+            cache: RTP 包缓存
+            addr: 目标地址 (IP, 端口)
+            ssrc: SSRC，None 时随机生成
+            tcp: RTP over TCP 连接，None 时通过 UDP 发送
+            start: 第一个发送的包序号（关键帧起点），该包立即发送
+            scale: 发送倍速
+            end: 媒体位置终点（90kHz，从缓存开头起算、循环累加），到达后会话结束；None 表示无限循环
+        """
+        if not math.isfinite(scale) or scale <= 0:
+            raise ValueError(f"Invalid replay scale: {scale}")
+        super().__init__(call_id, addr, random.getrandbits(32) if ssrc is None else ssrc)
+        self.cache = cache
+        # 序号和时间戳的初始值随机（RFC 3550）
+        self.seq = random.getrandbits(16)
+        self.ts_base = random.getrandbits(32)
+        self.index = start
+        self.loop = 0
+        self.scale = scale
+        self.end = end
+        self.paused = False
+        # 待执行的控制命令：(命令, 参数)
+        self.commands: Deque[Tuple[str, Any]] = deque()
+        self.origin = time.monotonic() - cache.offsets[start] / (RTP_CLOCK * scale)
+        # 每个会话一个 RTP 头缓冲区，发送时在其中改写序号、时间戳和 SSRC
+        self.header = bytearray(RTP_HEADER_SIZE)
+        self.tcp = tcp
+
+    @property
+    def position(self) -> int:
+        """下一个包的媒体位置（90kHz，从缓存开头起算、循环累加）"""
+        return self.loop * self.cache.duration + self.cache.offsets[self.index]
+
+    def control(self, command: str, value: Any = None):
+        """
+        提交控制命令（线程安全）
+
+        Args:
+            command: scale（value 为倍速）/ pause / resume / seek（value 为 (循环次数, 包序号)）
+            value: 命令参数
+        """
+        self.commands.append((command, value))
+
+    def _apply_commands(self, now: float):
+        """执行控制命令，然后以下一个包立即到期重新计时"""
+        while self.commands:
+            command, value = self.commands.popleft()
+            if command == "scale":
+                if math.isfinite(value) and value > 0:
+                    self.scale = value
+                else:
+                    logger.warning(f"Ignoring invalid replay scale {value} for {self.call_id}")
+            elif command == "pause":
+                self.paused = True
+            elif command == "resume":
+                self.paused = False
+            elif command == "seek":
+                self.loop, self.index = value
+        self.origin = now - self.position / (RTP_CLOCK * self.scale)
+        self.last_lateness = 0.0
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics = super().metrics()
+        metrics.update({"scale": self.scale, "paused": self.paused, "position": round(self.position / RTP_CLOCK, 3)})
+        return metrics
+
+    def send_due(self, now: float, sock: socket.socket) -> Optional[float]:
+        if self.commands:
+            self._apply_commands(now)
+        if self.paused:
+            return now + PAUSE_POLL
+        cache = self.cache
+        view, positions, lengths, offsets = cache.view, cache.positions, cache.lengths, cache.offsets
+        stamps, header, tcp = cache.stamps, self.header, self.tcp
+        keyframes = cache.keyframes if tcp else None
+        index, loop, seq = self.index, self.loop, self.seq
+        late_after, late_packets, jitter = self.late_after, self.late_packets, self.jitter
+        max_lateness, last_lateness = self.max_lateness, self.last_lateness
+        clock = RTP_CLOCK * self.scale
+        end = self.end
+        while True:
+            base = loop * cache.duration
+            if end is not None and base + offsets[index] >= end:
+                due = None
+                break
+            due = self.origin + (base + offsets[index]) / clock
+            if due > now:
+                break
+            lateness = now - due
+            if lateness > late_after:
+                late_packets += 1
+            if lateness > max_lateness:
+                max_lateness = lateness
+            delta = lateness - last_lateness
+            jitter += ((delta if delta >= 0 else -delta) - jitter) / 16
+            last_lateness = lateness
+            if lateness > MAX_LAG:
+                # 发送线程被长时间阻塞：放弃积压，从当前包开始重新计时
+                self.origin += lateness
+                self.resyncs += 1
+                due = now
+
+            pos = positions[index]
+            header[0:2] = view[pos:pos + 2]
+            stamp = (self.ts_base + base + stamps[index]) & 0xFFFFFFFF
+            struct.pack_into("!HII", header, 2, seq, stamp, self.ssrc)
+            payload = view[pos + RTP_HEADER_SIZE:pos + lengths[index]]
+            try:
+                if tcp:
+                    tcp.send_packet((header, payload), keyframes[index])
+                elif _SENDMSG:
+                    sock.sendmsg((header, payload), (), 0, self.addr)
+                else:
+                    sock.sendto(bytes(header) + payload, self.addr)
+            except OSError as e:
+                logger.debug(f"Error sending RTP to {self.addr}: {e}")
+            seq = (seq + 1) & 0xFFFF
+            self.packets += 1
+
+            index += 1
+            if index == cache.count:
+                index = 0
+                loop += 1
+        self.index, self.loop, self.seq = index, loop, seq
+        self.late_packets, self.jitter = late_packets, jitter
+        self.max_lateness, self.last_lateness = max_lateness, last_lateness
+        return due
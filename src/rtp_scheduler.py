@@ -0,0 +1,282 @@
+"""
+RTP 发送调度
+单个定时线程用最小堆按各会话下一个包的到期时间排序，每次醒来批量发送所有到期的包，
+并统计每个会话的发送抖动和迟发包数；有终点的会话（录像回放、下载）发送完毕后自动移除
+"""
+import heapq
+import itertools
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认调度精度（秒）：定时线程两次醒来的最小间隔，同一间隔内到期的包批量发送
+DEFAULT_TICK = 0.005
+# 包的实际发送时间比到期时间晚超过该值（秒）计为迟发
+LATE_THRESHOLD = 0.010
+# 没有会话时的休眠时间（秒）
+IDLE_WAIT = 1.0
+# 发送落后超过该值（秒，如线程被长时间阻塞）时放弃追赶，从当前时间重新计时
+MAX_LAG = 0.5
+
+
+class PacedStream:
+    """
+    按到期时间发送的 RTP 会话
+
+    子类实现 send_due：发送所有已到期的包并返回下一个包的到期时间（会话结束时返回 None），
+    同时更新发送统计（packets、late_packets、jitter、max_lateness、last_lateness）
+    """
+
+    __slots__ = ("call_id", "addr", "ssrc", "start_time", "active", "late_after",
+                 "packets", "late_packets", "resyncs", "jitter", "max_lateness", "last_lateness")
+
+    def __init__(self, call_id: str, addr: tuple, ssrc: int):
+        """
+        初始化会话
+
+        Args:
+            call_id: 会话标识
+            addr: 目标地址 (IP, 端口)
+            ssrc: SSRC
+        """
+        self.call_id = call_id
+        self.addr = addr
+        self.ssrc = ssrc
+        self.start_time = time.time()
+        self.active = True
+        self.late_after = LATE_THRESHOLD
+        self.packets = 0
+        self.late_packets = 0
+        self.resyncs = 0
+        # 发送抖动：相邻两个包迟发时间之差的平滑均值（与 RFC 3550 到达抖动的计算方式相同），
+        # 迟发时间为包的实际发送时间减去到期时间（秒）
+        self.jitter = 0.0
+        self.max_lateness = 0.0
+        self.last_lateness = 0.0
+
+    def send_due(self, now: float, sock: socket.socket) -> Optional[float]:
+        """
+        发送所有已到期的包
+
+        Args:
+            now: 当前单调时间
+            sock: 发送套接字
+
+        Returns:
+            float: 下一个包的到期时间，会话的包已全部发送时返回 None
+        """
+        raise NotImplementedError
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取会话的发送统计
+
+        Returns:
+            dict: 目标地址、开始时间、已发送包数、迟发包数、抖动和最大迟发时间（毫秒）
+        """
+        return {
+            "target_ip": self.addr[0],
+            "target_port": self.addr[1],
+            "start_time": self.start_time,
+            "packets": self.packets,
+            "late_packets": self.late_packets,
+            "resyncs": self.resyncs,
+            "jitter_ms": round(self.jitter * 1000, 3),
+            "max_lateness_ms": round(self.max_lateness * 1000, 3),
+        }
+
+
+class RTPScheduler:
+    """
+    RTP 发送调度器
+
+    所有会话共享一个发送线程和一个 UDP 套接字；堆中每个会话一项（下一个包的到期时间），
+    移除的会话在出堆时丢弃。发送线程、待加入队列和套接字在添加第一个会话时创建，stop 时释放
+    """
+
+    def __init__(self, tick: float = DEFAULT_TICK, late_after: float = LATE_THRESHOLD,
+                 on_finish: Optional[Callable[[PacedStream], None]] = None):
+        """
+        初始化调度器
+
+        Args:
+            tick: 调度精度（秒），定时线程两次醒来的最小间隔
+            late_after: 迟发阈值（秒）
+            on_finish: 会话发送完毕被移除后的回调（在发送线程中调用）
+        """
+        self.tick = max(0.0005, tick)
+        self.late_after = late_after
+        self.on_finish = on_finish
+        self._streams: Dict[str, PacedStream] = {}
+        # 发送线程读取的会话快照（增删会话时整体替换）
+        self._snapshot: Tuple[PacedStream, ...] = ()
+        # 新会话先放入当前发送线程的队列，由发送线程加入堆（堆只由发送线程访问）；
+        # 每个线程有自己的队列，stop 后未及时退出的旧线程不会取走新线程的会话
+        self._pending: Optional[Deque[PacedStream]] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event: Optional[threading.Event] = None
+        self._retired = {"packets": 0, "late_packets": 0, "resyncs": 0}
+        self.wakeups = 0
+
+    def add(self, stream: PacedStream) -> bool:
+        """
+        添加会话，第一个包立即到期
+
+        Args:
+            stream: 会话
+
+        Returns:
+            bool: 是否添加成功（call_id 已存在时失败）
+        """
+        with self._lock:
+            if stream.call_id in self._streams:
+                logger.warning(f"Stream already exists for call_id: {stream.call_id}")
+                return False
+            stream.late_after = self.late_after
+            self._streams[stream.call_id] = stream
+            self._snapshot = tuple(self._streams.values())
+            if self._thread is None:
+                self._stop_event = threading.Event()
+                self._pending = deque()
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._thread = threading.Thread(target=self._run, args=(self._stop_event, self._pending, self._sock),
+                                                name="rtp-scheduler", daemon=True)
+                self._thread.start()
+            self._pending.append(stream)
+        self._wake.set()
+        return True
+
+    def remove(self, call_id: str) -> Optional[PacedStream]:
+        """
+        移除会话
+
+        Args:
+            call_id: 会话标识
+
+        Returns:
+            PacedStream: 被移除的会话，不存在时返回 None
+        """
+        with self._lock:
+            stream = self._streams.pop(call_id, None)
+            if stream is None:
+                return None
+            stream.active = False
+            self._snapshot = tuple(self._streams.values())
+            self._retire(stream)
+        return stream
+
+    def get(self, call_id: str) -> Optional[PacedStream]:
+        """
+        获取会话
+
+        Args:
+            call_id: 会话标识
+
+        Returns:
+            PacedStream: 会话，不存在时返回 None
+        """
+        with self._lock:
+            return self._streams.get(call_id)
+
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取当前会话及其发送统计
+
+        Returns:
+            dict: call_id -> 会话统计
+        """
+        return {stream.call_id: stream.metrics() for stream in self._snapshot}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取调度统计
+
+        Returns:
+            dict: 会话数、已发送包数、迟发包数、重新对齐次数、平均和最大抖动（毫秒）、线程醒来次数
+        """
+        streams = self._snapshot
+        jitters = [stream.jitter for stream in streams]
+        return {
+            "streams": len(streams),
+            "packets_sent": self._retired["packets"] + sum(stream.packets for stream in streams),
+            "late_packets": self._retired["late_packets"] + sum(stream.late_packets for stream in streams),
+            "resyncs": self._retired["resyncs"] + sum(stream.resyncs for stream in streams),
+            "jitter_ms": round(sum(jitters) / len(jitters) * 1000, 3) if jitters else 0.0,
+            "max_jitter_ms": round(max(jitters) * 1000, 3) if jitters else 0.0,
+            "wakeups": self.wakeups,
+        }
+
+    def stop(self):
+        """移除所有会话，停止发送线程并关闭套接字"""
+        with self._lock:
+            for stream in self._streams.values():
+                stream.active = False
+                self._retire(stream)
+            self._streams.clear()
+            self._snapshot = ()
+            thread, sock = self._thread, self._sock
+            if self._stop_event:
+                self._stop_event.set()
+            self._thread = self._stop_event = self._pending = self._sock = None
+        self._wake.set()
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=IDLE_WAIT * 2)
+        # 发送线程仍在运行时（超时或在发送线程中调用）由其退出时关闭
+        if sock and not (thread and thread.is_alive()):
+            sock.close()
+
+    def _retire(self, stream: PacedStream):
+        self._retired["packets"] += stream.packets
+        self._retired["late_packets"] += stream.late_packets
+        self._retired["resyncs"] += stream.resyncs
+
+    def _run(self, stop_event: threading.Event, pending: Deque[PacedStream], sock: socket.socket):
+        """发送线程：弹出所有到期的会话并发送，休眠到堆顶的到期时间（不短于 tick）"""
+        tick = self.tick
+        heap: List[Tuple[float, int, PacedStream]] = []
+        order = itertools.count()
+        heappush, heappop, monotonic = heapq.heappush, heapq.heappop, time.monotonic
+        while not stop_event.is_set():
+            self._wake.clear()
+            self.wakeups += 1
+            while pending:
+                heappush(heap, (monotonic(), next(order), pending.popleft()))
+
+            now = monotonic()
+            while heap and heap[0][0] <= now:
+                stream = heappop(heap)[2]
+                if not stream.active:
+                    continue
+                # 每个会话取一次当前时间，批量中靠后的会话也按实际发送时间统计迟发
+                due = stream.send_due(monotonic(), sock)
+                if due is None:
+                    self._finish(stream)
+                    continue
+                heappush(heap, (due, next(order), stream))
+
+            timeout = heap[0][0] - monotonic() if heap else IDLE_WAIT
+            self._wake.wait(max(tick, timeout))
+        sock.close()
+
+    def _finish(self, stream: PacedStream):
+        """移除发送完毕的会话并通知（发送线程调用）"""
+        with self._lock:
+            if self._streams.get(stream.call_id) is not stream:
+                return
+            del self._streams[stream.call_id]
+            stream.active = False
+            self._snapshot = tuple(self._streams.values())
+            self._retire(stream)
+        if self.on_finish:
+            try:
+                self.on_finish(stream)
+            except Exception as e:
+                logger.error(f"Error in stream finish callback for {stream.call_id}: {e}", exc_info=True)
@@ -0,0 +1,579 @@
+"""
+RTP over TCP（RFC 4571）媒体传输
+每个 RTP 包前加 2 字节长度后写入 TCP 连接；支持本端主动连接（a=setup:active）和
+本端监听等待平台连接（a=setup:passive）。所有连接为非阻塞套接字，由单个 selector 线程
+完成连接建立、缓冲区写出和对端关闭检测；每个连接的写缓冲区有上限，
+写不出去时丢弃后续的包直到下一个关键帧，不无限排队
+"""
+import errno
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Sequence, Union
+
+logger = logging.getLogger(__name__)
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# 每个连接的写缓冲区上限（字节）：超过后丢包直到下一个关键帧
+MAX_WRITE_BUFFER = 512 * 1024
+# 主动连接和等待平台连接的超时时间（秒）
+CONNECT_TIMEOUT = 5.0
+ACCEPT_TIMEOUT = 30.0
+# selector 线程检查超时的间隔（秒）
+HOUSEKEEPING_INTERVAL = 1.0
+# ffmpeg 模式下中转的单个数据报最大长度与每次读取的最大个数
+MAX_DATAGRAM = 65535
+MAX_BATCH = 64
+
+_FRAME = struct.Struct("!H")
+_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+# 连接状态
+STATE_LISTENING = "listening"
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+STATE_CLOSED = "closed"
+
+# 负载类型：MPEG-TS（RFC 2250）和 GB28181 PS
+_MP2T_PAYLOAD_TYPE = 33
+_PS_PAYLOAD_TYPE = 96
+_TS_PACKET_SIZE = 188
+_PACK_START = b"\x00\x00\x01\xba"
+_SYSTEM_HEADER_START = b"\x00\x00\x01\xbb"
+
+
+def is_keyframe(packet: Buffer) -> bool:
+    """
+    判断 RTP 包是否为关键帧的起点（解码器可以从该包开始解码）
+
+    PS 负载：带 system header 的 pack（关键帧才发送 system header 和 PSM）；
+    MPEG-TS 负载：任一 TS 包带 random_access_indicator；其他负载类型无法判断，总是返回 True
+
+    Args:
+        packet: 完整的 RTP 包
+
+    Returns:
+        bool: 是否为关键帧起点
+    """
+    if len(packet) < 12:
+        return False
+    payload_type = packet[1] & 0x7F
+    offset = 12 + 4 * (packet[0] & 0x0F)
+    if packet[0] & 0x10 and len(packet) >= offset + 4:
+        offset += 4 + 4 * ((packet[offset + 2] << 8) | packet[offset + 3])
+
+    if payload_type == _MP2T_PAYLOAD_TYPE:
+        for pos in range(offset, len(packet) - 5, _TS_PACKET_SIZE):
+            # 自适应字段存在、长度非 0、random_access_indicator 置位
+            if packet[pos] == 0x47 and packet[pos + 3] & 0x20 and packet[pos + 4] and packet[pos + 5] & 0x40:
+                return True
+        return False
+    if payload_type == _PS_PAYLOAD_TYPE:
+        if len(packet) < offset + 14 or packet[offset:offset + 4] != _PACK_START:
+            return False
+        pos = offset + 14 + (packet[offset + 13] & 0x07)
+        return packet[pos:pos + 4] == _SYSTEM_HEADER_START
+    return True
+
+
+class TCPMediaConnection:
+    """
+    单个会话的 RTP over TCP 连接
+
+    send_packet 可以在任意线程调用：写缓冲区为空时直接写入套接字，写不完的部分复制后排队，
+    由 selector 线程在套接字可写时写出
+    """
+
+    def __init__(self, transport: "TCPMediaTransport", call_id: str, role: str, sock: socket.socket,
+                 max_buffer: int):
+        self.transport = transport
+        self.call_id = call_id
+        self.role = role  # active（本端连接平台）/ passive（平台连接本端）
+        self.sock = sock
+        self.listener: Optional[socket.socket] = None
+        self.relay: Optional[socket.socket] = None
+        self.peer: Optional[tuple] = None
+        self.local_port = 0
+        self.state = STATE_CONNECTING
+        self.deadline = time.monotonic() + (CONNECT_TIMEOUT if role == "active" else ACCEPT_TIMEOUT)
+        self.max_buffer = max_buffer
+        self.queue: Deque[memoryview] = deque()
+        self.buffered = 0
+        # 连接建立后以及写缓冲区溢出后，从下一个关键帧开始发送
+        self.waiting_keyframe = True
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.bytes_sent = 0
+        self.overflows = 0
+
+    def send_packet(self, buffers: Sequence[Buffer], keyframe: bool) -> bool:
+        """
+        发送一个 RTP 包（加 2 字节长度前缀）
+
+        Args:
+            buffers: RTP 包的缓冲区片段（如改写后的 RTP 头 + 负载），调用返回后可以复用
+            keyframe: 该包是否为关键帧起点
+
+        Returns:
+            bool: 是否已发送或排队，False 表示被丢弃
+        """
+        size = sum(len(buffer) for buffer in buffers)
+        need_write = False
+        with self.lock:
+            if self.state != STATE_CONNECTED or size > 0xFFFF:
+                self.packets_dropped += 1
+                return False
+            if self.waiting_keyframe:
+                if not keyframe:
+                    self.packets_dropped += 1
+                    return False
+                self.waiting_keyframe = False
+            if self.buffered + size + _FRAME.size > self.max_buffer:
+                # 平台接收跟不上：丢弃到下一个关键帧，已排队的数据继续写出
+                self.waiting_keyframe = True
+                self.overflows += 1
+                self.packets_dropped += 1
+                return False
+
+            frame = [_FRAME.pack(size), *buffers]
+            sent = 0
+            if not self.queue:
+                try:
+                    sent = self.sock.sendmsg(frame) if _SENDMSG else self.sock.send(b"".join(frame))
+                except (BlockingIOError, InterruptedError):
+                    sent = 0
+                except OSError as e:
+                    self._close_locked(f"send failed: {e}")
+                    self.packets_dropped += 1
+                    return False
+            total = size + _FRAME.size
+            if sent < total:
+                # 未写完的部分复制后排队（调用方的缓冲区会被复用）
+                remainder = memoryview(b"".join(frame)[sent:])
+                need_write = not self.queue
+                self.queue.append(remainder)
+                self.buffered += len(remainder)
+            self.packets_sent += 1
+            self.bytes_sent += total
+        if need_write:
+            self.transport._call(self.transport._watch_write, self)
+        return True
+
+    def flush(self) -> bool:
+        """
+        写出排队的数据（selector 线程调用）
+
+        Returns:
+            bool: 写缓冲区是否已清空
+        """
+        with self.lock:
+            queue = self.queue
+            while queue:
+                try:
+                    sent = self.sock.send(queue[0])
+                except (BlockingIOError, InterruptedError):
+                    return False
+                except OSError as e:
+                    self._close_locked(f"send failed: {e}")
+                    return True
+                self.buffered -= sent
+                if sent < len(queue[0]):
+                    queue[0] = queue[0][sent:]
+                    return False
+                queue.popleft()
+            return True
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取连接统计
+
+        Returns:
+            dict: 角色、状态、对端地址、写缓冲区字节数、已发送 / 丢弃包数、缓冲区溢出次数
+        """
+        return {
+            "role": self.role,
+            "state": self.state,
+            "peer": f"{self.peer[0]}:{self.peer[1]}" if self.peer else None,
+            "local_port": self.local_port,
+            "buffered": self.buffered,
+            "packets_sent": self.packets_sent,
+            "packets_dropped": self.packets_dropped,
+            "overflows": self.overflows,
+        }
+
+    def _close_locked(self, reason: str):
+        if self.state != STATE_CLOSED:
+            logger.warning(f"TCP media connection for call_id {self.call_id} closed: {reason}")
+            self.state = STATE_CLOSED
+            self.queue.clear()
+            self.buffered = 0
+
+
+class TCPMediaTransport:
+    """
+    RTP over TCP 连接管理
+
+    所有连接共享一个 selector 线程（首次使用时启动）；其他线程对 selector 的修改
+    通过命令队列交给该线程执行
+    """
+
+    def __init__(self, max_buffer: int = MAX_WRITE_BUFFER):
+        """
+        初始化连接管理
+
+        Args:
+            max_buffer: 每个连接的写缓冲区上限（字节）
+        """
+        self.max_buffer = max_buffer
+        self._connections: Dict[str, TCPMediaConnection] = {}
+        self._lock = threading.Lock()
+        self._commands: Deque[tuple] = deque()
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wake_recv: Optional[socket.socket] = None
+        self._wake_send: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event: Optional[threading.Event] = None
+        self._retired = {"packets_sent": 0, "packets_dropped": 0}
+
+    def connect(self, call_id: str, target_ip: str, target_port: int) -> Optional[TCPMediaConnection]:
+        """
+        主动连接平台（本端 a=setup:active）
+
+        Args:
+            call_id: 会话标识
+            target_ip: 平台媒体地址
+            target_port: 平台媒体端口
+
+        Returns:
+            TCPMediaConnection: 连接（异步建立，建立前发送的包被丢弃），失败时返回 None
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            result = sock.connect_ex((target_ip, target_port))
+        except OSError as e:
+            result = e.errno
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            logger.error(f"Error connecting TCP media to {target_ip}:{target_port}: {os.strerror(result)}")
+            sock.close()
+            return None
+        conn = TCPMediaConnection(self, call_id, "active", sock, self.max_buffer)
+        conn.peer = (target_ip, target_port)
+        if not self._add(conn):
+            sock.close()
+            return None
+        logger.info(f"Connecting TCP media for call_id {call_id} to {target_ip}:{target_port}")
+        self._call(self._register, conn, sock, selectors.EVENT_WRITE, "connect")
+        return conn
+
+    def listen(self, call_id: str, bind_ip: str) -> Optional[TCPMediaConnection]:
+        """
+        监听随机端口等待平台连接（本端 a=setup:passive），只接受第一个连接
+
+        Args:
+            call_id: 会话标识
+            bind_ip: 监听地址
+
+        Returns:
+            TCPMediaConnection: 连接（local_port 为 SDP 应答中的端口），失败时返回 None
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listener.bind((bind_ip, 0))
+            listener.listen(1)
+        except OSError as e:
+            logger.error(f"Error listening for TCP media on {bind_ip}: {e}")
+            listener.close()
+            return None
+        listener.setblocking(False)
+        conn = TCPMediaConnection(self, call_id, "passive", listener, self.max_buffer)
+        conn.listener = listener
+        conn.local_port = listener.getsockname()[1]
+        conn.state = STATE_LISTENING
+        if not self._add(conn):
+            listener.close()
+            return None
+        self._call(self._register, conn, listener, selectors.EVENT_READ, "accept")
+        logger.info(f"Listening for TCP media for call_id {call_id} on {bind_ip}:{conn.local_port}")
+        return conn
+
+    def relay_port(self, conn: TCPMediaConnection) -> Optional[int]:
+        """
+        为外部进程（FFmpeg）创建本机 UDP 中转端口，收到的 RTP 包转发到 TCP 连接（RTCP 丢弃）
+
+        Args:
+            conn: TCP 连接
+
+        Returns:
+            int: 本机 UDP 端口，失败时返回 None
+        """
+        relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            relay.bind(("127.0.0.1", 0))
+        except OSError as e:
+            logger.error(f"Error binding TCP media relay for call_id {conn.call_id}: {e}")
+            relay.close()
+            return None
+        relay.setblocking(False)
+        conn.relay = relay
+        self._call(self._register, conn, relay, selectors.EVENT_READ, "relay")
+        return relay.getsockname()[1]
+
+    def get(self, call_id: str) -> Optional[TCPMediaConnection]:
+        """获取会话的连接"""
+        return self._connections.get(call_id)
+
+    def close(self, call_id: str) -> bool:
+        """
+        关闭会话的连接
+
+        Args:
+            call_id: 会话标识
+
+        Returns:
+            bool: 连接是否存在
+        """
+        with self._lock:
+            conn = self._connections.pop(call_id, None)
+            if conn is None:
+                return False
+            self._retired["packets_sent"] += conn.packets_sent
+            self._retired["packets_dropped"] += conn.packets_dropped
+        with conn.lock:
+            conn.state = STATE_CLOSED
+        self._call(self._release, conn)
+        logger.info(f"TCP media connection closed for call_id {call_id} "
+                    f"({conn.packets_sent} packets sent, {conn.packets_dropped} dropped)")
+        return True
+
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取所有连接的统计
+
+        Returns:
+            dict: call_id -> 连接统计
+        """
+        with self._lock:
+            connections = list(self._connections.values())
+        return {conn.call_id: conn.metrics() for conn in connections}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取汇总统计
+
+        Returns:
+            dict: 连接数、已建立连接数、已发送包数、丢弃包数
+        """
+        with self._lock:
+            connections = list(self._connections.values())
+            retired = dict(self._retired)
+        return {
+            "connections": len(connections),
+            "connected": sum(1 for conn in connections if conn.state == STATE_CONNECTED),
+            "packets_sent": retired["packets_sent"] + sum(conn.packets_sent for conn in connections),
+            "packets_dropped": retired["packets_dropped"] + sum(conn.packets_dropped for conn in connections),
+        }
+
+    def stop(self):
+        """关闭所有连接并停止 selector 线程"""
+        with self._lock:
+            call_ids = list(self._connections)
+        for call_id in call_ids:
+            self.close(call_id)
+        with self._lock:
+            thread, stop_event = self._thread, self._stop_event
+            self._thread = self._stop_event = None
+        if stop_event:
+            stop_event.set()
+            self._wake()
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=HOUSEKEEPING_INTERVAL * 2)
+
+    def _add(self, conn: TCPMediaConnection) -> bool:
+        with self._lock:
+            if conn.call_id in self._connections:
+                logger.warning(f"TCP media connection already exists for call_id: {conn.call_id}")
+                return False
+            self._connections[conn.call_id] = conn
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._wake_recv, self._wake_send = socket.socketpair()
+                self._wake_recv.setblocking(False)
+                self._wake_send.setblocking(False)
+                self._selector.register(self._wake_recv, selectors.EVENT_READ, ("wake", None))
+                self._stop_event = threading.Event()
+                self._thread = threading.Thread(target=self._run,
+                                                args=(self._stop_event, self._selector, self._wake_recv,
+                                                      self._wake_send),
+                                                name="rtp-tcp", daemon=True)
+                self._thread.start()
+        return True
+
+    def _call(self, func: Callable, *args):
+        """在 selector 线程中执行 func(*args)"""
+        self._commands.append((func, args))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b"\x00")
+        except (AttributeError, BlockingIOError, OSError):
+            pass
+
+    def _register(self, conn: TCPMediaConnection, sock: socket.socket, events: int, kind: str):
+        if conn.state == STATE_CLOSED:
+            return
+        self._selector.register(sock, events, (kind, conn))
+
+    def _watch_write(self, conn: TCPMediaConnection):
+        """写缓冲区非空：关注可写事件"""
+        if conn.state == STATE_CONNECTED and conn.queue:
+            self._modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, ("stream", conn))
+
+    def _modify(self, sock: socket.socket, events: int, data: tuple):
+        try:
+            self._selector.modify(sock, events, data)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def _unregister(self, sock: Optional[socket.socket]):
+        if sock is None:
+            return
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError, OSError):
+            pass
+        sock.close()
+
+    def _release(self, conn: TCPMediaConnection):
+        """关闭连接的所有套接字（selector 线程中执行）"""
+        for sock in {conn.sock, conn.listener, conn.relay}:
+            self._unregister(sock)
+
+    def _run(self, stop_event: threading.Event, selector: selectors.BaseSelector,
+             wake_recv: socket.socket, wake_send: socket.socket):
+        """selector 线程：建立连接、写出缓冲区、检测对端关闭、中转 UDP 数据报"""
+        next_housekeeping = time.monotonic() + HOUSEKEEPING_INTERVAL
+        while not stop_event.is_set():
+            for key, events in selector.select(timeout=HOUSEKEEPING_INTERVAL):
+                kind, conn = key.data
+                try:
+                    if kind == "wake":
+                        self._drain_wake()
+                    elif kind == "accept":
+                        self._on_accept(conn)
+                    elif kind == "connect":
+                        self._on_connect(conn)
+                    elif kind == "relay":
+                        self._on_relay(conn)
+                    else:
+                        self._on_stream(conn, events)
+                except Exception as e:
+                    logger.error(f"Error in TCP media loop for call_id {conn and conn.call_id}: {e}",
+                                 exc_info=True)
+
+            while self._commands:
+                func, args = self._commands.popleft()
+                func(*args)
+
+            now = time.monotonic()
+            if now >= next_housekeeping:
+                next_housekeeping = now + HOUSEKEEPING_INTERVAL
+                self._housekeeping(now)
+
+        for sock in [key.fileobj for key in selector.get_map().values() if key.fileobj is not wake_recv]:
+            self._unregister(sock)
+        selector.close()
+        wake_recv.close()
+        wake_send.close()
+
+    def _drain_wake(self):
+        try:
+            while self._wake_recv.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _on_accept(self, conn: TCPMediaConnection):
+        try:
+            sock, peer = conn.listener.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # 只接受一个连接，之后关闭监听端口
+        self._unregister(conn.listener)
+        with conn.lock:
+            if conn.state == STATE_CLOSED:
+                sock.close()
+                return
+            conn.sock, conn.peer, conn.state = sock, peer, STATE_CONNECTED
+        self._selector.register(sock, selectors.EVENT_READ, ("stream", conn))
+        logger.info(f"TCP media connection accepted for call_id {conn.call_id} from {peer[0]}:{peer[1]}")
+
+    def _on_connect(self, conn: TCPMediaConnection):
+        error = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            with conn.lock:
+                conn._close_locked(f"connect to {conn.peer[0]}:{conn.peer[1]} failed: {os.strerror(error)}")
+            self._unregister(conn.sock)
+            return
+        with conn.lock:
+            if conn.state == STATE_CLOSED:
+                return
+            conn.state = STATE_CONNECTED
+            conn.local_port = conn.sock.getsockname()[1]
+        self._modify(conn.sock, selectors.EVENT_READ, ("stream", conn))
+        logger.info(f"TCP media connected for call_id {conn.call_id} to {conn.peer[0]}:{conn.peer[1]}")
+
+    def _on_stream(self, conn: TCPMediaConnection, events: int):
+        if events & selectors.EVENT_READ:
+            # 平台可能在同一连接上发送 RTCP，读取后丢弃；读到 EOF 表示对端关闭
+            try:
+                data = conn.sock.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError as e:
+                data = b""
+                logger.debug(f"TCP media recv error for call_id {conn.call_id}: {e}")
+            if data == b"":
+                with conn.lock:
+                    conn._close_locked("closed by peer")
+                self._unregister(conn.sock)
+                return
+        if events & selectors.EVENT_WRITE and conn.flush():
+            if conn.state == STATE_CLOSED:
+                self._unregister(conn.sock)
+            else:
+                self._modify(conn.sock, selectors.EVENT_READ, ("stream", conn))
+
+    def _on_relay(self, conn: TCPMediaConnection):
+        for _ in range(MAX_BATCH):
+            try:
+                data = conn.relay.recv(MAX_DATAGRAM)
+            except (BlockingIOError, OSError):
+                return
+            # RTCP（负载类型 200-204）不转发
+            if len(data) < 12 or 200 <= data[1] <= 204:
+                continue
+            conn.send_packet((data,), is_keyframe(data))
+
+    def _housekeeping(self, now: float):
+        """关闭超时未建立的连接"""
+        with self._lock:
+            connections = list(self._connections.values())
+        for conn in connections:
+            if conn.state in (STATE_LISTENING, STATE_CONNECTING) and now > conn.deadline:
+                with conn.lock:
+                    conn._close_locked(f"{conn.role} connection timed out")
+                for sock in (conn.sock, conn.listener):
+                    self._unregister(sock)
@@ -0,0 +1,226 @@
+"""
+SIP 摘要认证（RFC 2617 / RFC 3261 22.4）
+缓存 HA1，支持 qop=auth（nonce-count / cnonce）、MD5-sess 和 stale=true 的 nonce 更新
+"""
+import hashlib
+import itertools
+import logging
+import random
+import re
+from functools import lru_cache
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 认证参数：name=token 或 name="quoted string"（引号内可含逗号和转义字符）
+_PARAM_RE = re.compile(r'([\w-]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^\s,]+))')
+_UNESCAPE_RE = re.compile(r"\\(.)")
+
+
+def parse_auth_header(header: str) -> Dict[str, str]:
+    """
+    解析 WWW-Authenticate / Authorization 头
+
+    Args:
+        header: 头部值，如 'Digest realm="3402000000", nonce="...", qop="auth"'
+
+    Returns:
+        dict: 认证参数（参数名小写），scheme 为认证方案
+    """
+    scheme, _, params = header.strip().partition(" ")
+    result = {"scheme": scheme}
+
+    if "\\" in params:
+        # 含转义字符时逐个匹配参数
+        for match in _PARAM_RE.finditer(params):
+            quoted = match.group(2)
+            value = _UNESCAPE_RE.sub(r"\1", quoted) if quoted is not None else match.group(3)
+            result[match.group(1).lower()] = value
+        return result
+
+    # 快速路径：直接按逗号拆分；引号内含逗号时（拆开的值引号不成对）改为按引号切分
+    for item in params.split(","):
+        name, _, value = item.partition("=")
+        value = value.strip()
+        if value[:1] == '"':
+            if len(value) < 2 or value[-1] != '"':
+                return _parse_quoted(params, {"scheme": scheme})
+            value = value[1:-1]
+        elif not value:
+            continue
+        name = name.strip()
+        if name:
+            result[name.lower()] = value
+    return result
+
+
+def _parse_quoted(params: str, result: Dict[str, str]) -> Dict[str, str]:
+    """引号内的值含逗号时按引号切分参数，结果写入 result"""
+    # 按引号切分：奇数段为引号内的值（可含逗号），偶数段按逗号拆分为参数
+    key = None
+    for index, piece in enumerate(params.split('"')):
+        if index % 2:
+            if key:
+                result[key] = piece
+            key = None
+            continue
+        for item in piece.split(","):
+            name, equals, value = item.partition("=")
+            name = name.strip()
+            if not name:
+                continue
+            value = value.strip()
+            if value:
+                result[name.lower()] = value
+            elif equals:
+                # 值在下一个引号段中
+                key = name.lower()
+    return result
+
+
+def _md5(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=65536)
+def compute_ha1(username: str, realm: str, password: str) -> str:
+    """
+    HA1 = MD5(username:realm:password)，同一用户和认证域只计算一次
+
+    Args:
+        username: 用户名
+        realm: 认证域
+        password: 密码
+
+    Returns:
+        str: HA1 十六进制串
+    """
+    return _md5(f"{username}:{realm}:{password}")
+
+
+@lru_cache(maxsize=1024)
+def compute_ha2(method: str, uri: str) -> str:
+    """HA2 = MD5(method:uri)，设备的请求 URI 固定，按 (方法, URI) 缓存"""
+    return _md5(f"{method}:{uri}")
+
+
+def digest_response(ha1: str, nonce: str, ha2: str, qop: Optional[str] = None,
+                    nc: str = "", cnonce: str = "") -> str:
+    """
+    计算 response 值
+
+    Args:
+        ha1: HA1（MD5-sess 时为会话 HA1）
+        nonce: 服务器 nonce
+        ha2: HA2
+        qop: 保护质量，None 表示服务器未要求（RFC 2069 兼容方式）
+        nc: nonce-count（8 位十六进制）
+        cnonce: 客户端 nonce
+
+    Returns:
+        str: response 十六进制串
+    """
+    if qop:
+        return _md5(f"{ha1}:{nonce}:{nc}:{cnonce}:{qop}:{ha2}")
+    return _md5(f"{ha1}:{nonce}:{ha2}")
+
+
+class DigestAuth:
+    """
+    单个 SIP 用户的摘要认证状态
+
+    保存最近一次挑战的 realm / nonce 等参数：后续请求（如注册刷新）直接携带认证头，
+    nonce 过期时服务器返回 stale=true 的 401，更新 nonce 后重发一次即可，不必重新走无认证请求
+    """
+
+    def __init__(self, username: str, password: str):
+        """
+        初始化认证状态
+
+        Args:
+            username: SIP 用户名
+            password: SIP 密码
+        """
+        self.username = username
+        self.password = password or ""
+        self.realm = ""
+        self.nonce = ""
+        self.opaque: Optional[str] = None
+        self.algorithm = "MD5"
+        self.session = False
+        self.qop: Optional[str] = None
+        self.stale = False
+        self._nc = itertools.count(1)
+
+    @property
+    def ready(self) -> bool:
+        """是否已收到挑战，可以生成认证头"""
+        return bool(self.nonce)
+
+    def on_challenge(self, header: str) -> bool:
+        """
+        处理 401/407 响应中的挑战
+
+        Args:
+            header: WWW-Authenticate / Proxy-Authenticate 头部值
+
+        Returns:
+            bool: 挑战是否有效（Digest 方案且包含 nonce）
+        """
+        params = parse_auth_header(header)
+        if params["scheme"].lower() != "digest" or not params.get("nonce"):
+            logger.warning(f"Unsupported auth challenge for {self.username}: {header}")
+            return False
+
+        algorithm = params.get("algorithm", "MD5")
+        session = algorithm.upper() == "MD5-SESS"
+        if not session and algorithm.upper() != "MD5":
+            logger.warning(f"Unsupported digest algorithm {algorithm} for {self.username}, using MD5")
+            algorithm = "MD5"
+
+        if params["nonce"] != self.nonce:
+            # 新 nonce 的 nonce-count 从 1 开始
+            self._nc = itertools.count(1)
+        self.realm = params.get("realm", "")
+        self.nonce = params["nonce"]
+        self.opaque = params.get("opaque")
+        self.algorithm = algorithm
+        self.session = session
+        # 服务器提供多个 qop 选项时选择 auth
+        qop = params.get("qop")
+        self.qop = "auth" if qop and "auth" in (option.strip() for option in qop.split(",")) else None
+        stale = params.get("stale")
+        self.stale = stale is not None and stale.lower() == "true"
+        return True
+
+    def authorization(self, method: str, uri: str) -> str:
+        """
+        生成 Authorization 头部值
+
+        Args:
+            method: SIP 方法
+            uri: 请求 URI
+
+        Returns:
+            str: Authorization 头内容
+        """
+        ha1 = compute_ha1(self.username, self.realm, self.password)
+        nc = cnonce = ""
+        if self.qop or self.session:
+            cnonce = "%016x" % random.getrandbits(64)
+        if self.session:
+            ha1 = _md5(f"{ha1}:{self.nonce}:{cnonce}")
+        if self.qop:
+            nc = "%08x" % next(self._nc)
+
+        response = digest_response(ha1, self.nonce, compute_ha2(method, uri), self.qop, nc, cnonce)
+
+        header = (f'Digest username="{self.username}", realm="{self.realm}", nonce="{self.nonce}", '
+                  f'uri="{uri}", response="{response}", algorithm={self.algorithm}')
+        if self.qop:
+            header += f', qop={self.qop}, nc={nc}, cnonce="{cnonce}"'
+        elif cnonce:
+            header += f', cnonce="{cnonce}"'
+        if self.opaque is not None:
+            header += f', opaque="{self.opaque}"'
+        return header
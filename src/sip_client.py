@@ -2,32 +2,48 @@
 SIP 客户端实现
 处理 SIP 信令：注册、心跳、消息、INVITE 等
 """
+import asyncio
 import socket
 import threading
 import time
 import logging
+import random
 import re
-from typing import Optional, Dict, Any, Callable
+from typing import Optional, Dict, Any, Callable, Iterator
 from datetime import datetime
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from utils import (
     generate_call_id, generate_tag, generate_branch,
-    calculate_digest_response, parse_sip_auth_header,
     format_sip_uri, get_local_ip
 )
-from xml_builder import XMLBuilder, parse_xml_message
+from sip_auth import DigestAuth
+from xml_builder import XMLBuilder, parse_manscdp, timestamp_sn
+from gb28181_protocol import SESSION_DOWNLOAD, SESSION_PLAY, SESSION_PLAYBACK, clamp_scale, parse_mansrtsp
 from catalog_handler import CatalogHandler
 from ptz_handler import PTZHandler
 from media_server import MediaServer
+from media_probe import SDP_CODECS
+from sip_transaction import ClientTransactionLayer, retransmit_intervals
+from sip_parser import SIPMessage, parse_message
+from sip_templates import SIPTemplate
+from timer_wheel import TimerWheel, get_default_wheel
 
 logger = logging.getLogger(__name__)
 
+# INVITE 200 OK 后等待 ACK 的超时时间（64*T1，秒）
+ACK_TIMEOUT = 32
+# 注册刷新失败后的重试间隔（秒）
+REGISTER_RETRY_INTERVAL = 30
+# IPv4 + UDP 头部长度（字节），计算单个数据报可容纳的 SIP 消息长度
+UDP_IP_OVERHEAD = 28
+
 
 class SIPClient:
     """SIP 客户端"""
     
     def __init__(self, device_config: Dict[str, Any], server_config: Dict[str, Any],
-                 media_server: MediaServer):
+                 media_server: MediaServer, engine=None, timers: Optional[TimerWheel] = None):
         """
         初始化 SIP 客户端
         
@@ -35,6 +51,8 @@ class SIPClient:
             device_config: 设备配置
             server_config: SIP 服务器配置
             media_server: 媒体服务器实例
+            engine: 异步 SIP 引擎（SIPEngine），为 None 时使用独立线程模式
+            timers: 共享时间轮，为 None 时使用进程级默认时间轮
         """
         self.device_id = device_config.get("device_id")
         self.sip_user = device_config.get("sip_user")
@@ -45,14 +63,25 @@ class SIPClient:
         self.server_port = server_config.get("server_port", 5060)
         self.server_id = server_config.get("server_id")
         self.domain = server_config.get("domain")
+        self.register_timeout = server_config.get("register_timeout", 5.0)
+        self.register_expires = server_config.get("register_expires", 3600)
+        self.keepalive_interval = server_config.get("keepalive_interval", 60)
+        # 定时任务抖动比例，避免大量设备在同一时刻发送心跳
+        self.timer_jitter = server_config.get("timer_jitter", 0.1)
+        # 路径 MTU：目录等大响应按此拆分为多个 MESSAGE，避免 IP 分片
+        self.sip_mtu = server_config.get("sip_mtu", 1500)
+        # 多条 MESSAGE 连续发送的速率（条/秒），0 表示不限速
+        self.message_send_rate = server_config.get("message_send_rate", 50)
         
+        self.engine = engine
         self.local_ip = get_local_ip()
-        self.local_port = self._find_available_port(5060)
+        # 端口在启动时绑定（线程模式从 5060 起查找，引擎模式由系统分配或使用共享端口）
+        self.local_port = 0
         
         self.media_server = media_server
         
         # 创建处理器
-        self.catalog_handler = CatalogHandler(device_config)
+        self.catalog_handler = CatalogHandler(device_config, server_config.get("record_options"))
         self.ptz_handler = PTZHandler(device_config)
         
         # SIP 会话状态
@@ -60,49 +89,62 @@ class SIPClient:
         self.registered = False
         self.call_id = generate_call_id()
         self.from_tag = generate_tag()
-        self.auth_info = {}
+        # 摘要认证状态（收到挑战后，后续注册直接携带认证头）
+        self.auth = DigestAuth(self.sip_user, self.sip_password)
+        
+        # 预编译的请求模板（绑定端口后生成）
+        self.server_uri = f"sip:{self.server_ip}:{self.server_port}"
+        self.register_template: Optional[SIPTemplate] = None
+        self.message_template: Optional[SIPTemplate] = None
+        # 心跳消息体内容固定，只有 SN 随每次发送变化
+        self.keepalive_body = XMLBuilder.prerender_keepalive(self.device_id, status="OK")
+        
+        # 客户端事务层（按 Via branch / CSeq 匹配响应）
+        self.transactions = ClientTransactionLayer()
         
         # 活动的 INVITE 会话
         self.active_calls = {}  # call_id -> session_info
         
-        # UDP Socket
+        # UDP Socket（线程模式）/ asyncio 传输（引擎模式）
         self.sock = None
+        self.transport = None
         self.running = False
         
-        # 线程
+        # 接收线程（线程模式）
         self.recv_thread = None
-        self.keepalive_thread = None
+        
+        # 定时任务（心跳、注册刷新）
+        self.timers = timers or get_default_wheel()
+        self.keepalive_timer = None
+        self.refresh_timer = None
+        self._rng = random.Random(self.device_id)
         
         logger.info(f"SIPClient initialized for device {self.device_id}")
     
-    def _find_available_port(self, preferred_port: int) -> int:
+    def _bind_available_port(self, preferred_port: int) -> socket.socket:
         """
-        查找可用端口
+        绑定可用端口，直接绑定而非先探测再关闭，并行启动多个设备时不会冲突
         
         Args:
             preferred_port: 首选端口
             
         Returns:
-            int: 可用端口
+            socket.socket: 已绑定的 UDP socket
         """
-        import socket
-        
         # 尝试首选端口
         for port in range(preferred_port, preferred_port + 100):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             try:
-                test_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                test_sock.bind((self.local_ip, port))
-                test_sock.close()
-                return port
+                sock.bind((self.local_ip, port))
+                return sock
             except OSError:
+                sock.close()
                 continue
         
         # 如果都不可用，使用0让系统分配
-        test_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        test_sock.bind((self.local_ip, 0))
-        port = test_sock.getsockname()[1]
-        test_sock.close()
-        return port
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.local_ip, 0))
+        return sock
     
     def start(self) -> bool:
         """
@@ -113,10 +155,10 @@ class SIPClient:
         """
         try:
             # 创建 UDP socket
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.sock.bind((self.local_ip, self.local_port))
+            self.sock = self._bind_available_port(5060)
+            self.local_port = self.sock.getsockname()[1]
             self.sock.settimeout(1.0)
+            self._compile_templates()
             
             self.running = True
             
@@ -126,14 +168,9 @@ class SIPClient:
             
             logger.info(f"SIP client started on {self.local_ip}:{self.local_port}")
             
-            # 发送注册请求
+            # 发送注册请求（成功后自动调度心跳和注册刷新）
             if self.register():
                 logger.info("Registration successful")
-                
-                # 启动心跳线程
-                self.keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
-                self.keepalive_thread.start()
-                
                 return True
             else:
                 logger.error("Registration failed")
@@ -143,10 +180,37 @@ class SIPClient:
             logger.error(f"Error starting SIP client: {e}", exc_info=True)
             return False
     
+    async def start_async(self) -> bool:
+        """
+        在异步引擎中启动 SIP 客户端
+        
+        Returns:
+            bool: 是否启动成功
+        """
+        try:
+            if not await self.engine.attach(self):
+                return False
+            self._compile_templates()
+            
+            self.running = True
+            logger.info(f"SIP client started on {self.local_ip}:{self.local_port} (asyncio)")
+            
+            if await self.register_async():
+                logger.info(f"Registration successful for device {self.device_id}")
+                return True
+            else:
+                logger.error(f"Registration failed for device {self.device_id}")
+                return False
+                
+        except Exception as e:
+            logger.error(f"Error starting SIP client: {e}", exc_info=True)
+            return False
+    
     def stop(self):
         """停止 SIP 客户端"""
         logger.info("Stopping SIP client")
         self.running = False
+        self._cancel_timers()
         
         # 注销
         if self.registered:
@@ -156,90 +220,268 @@ class SIPClient:
         self.media_server.stop_all_streams()
         
         # 关闭 socket
-        if self.sock:
-            self.sock.close()
+        self.close()
         
         logger.info("SIP client stopped")
     
-    def register(self) -> bool:
+    def close(self):
+        """释放 socket（线程模式）或 UDP 端点（引擎模式）"""
+        self.running = False
+        if self.engine:
+            self.engine.detach(self)
+        elif self.sock:
+            self.sock.close()
+    
+    def register(self, timeout: Optional[float] = None) -> bool:
         """
-        发送 REGISTER 请求
+        发送 REGISTER 请求，收到 200 OK 后立即返回
         
+        Args:
+            timeout: 注册超时时间（秒），默认使用配置值
+            
         Returns:
             bool: 是否注册成功
         """
+        if self.engine:
+            # 引擎模式下从其他线程（如 Web 界面）调用时，提交到事件循环执行
+            return self.engine.run_coroutine(self.register_async(timeout))
+        
         try:
-            # 第一次注册请求（无认证）
-            request = self._build_register_request()
-            self._send_request(request)
+            deadline = time.monotonic() + (timeout or self.register_timeout)
             
-            # 等待响应
-            time.sleep(1)
+            # 已有挑战参数时直接携带认证头（注册刷新），否则先发无认证请求；
+            # 收到 401 挑战（或 stale=true 的新 nonce）后带认证重发一次
+            for retry_allowed in (True, False):
+                response = self._register_transaction(self.auth.ready, deadline)
+                result = self._register_result(response, retry_allowed)
+                if result is not None:
+                    return result
+            return False
             
-            # 如果需要认证，发送带认证的请求
-            if self.auth_info:
-                request = self._build_register_request(with_auth=True)
-                self._send_request(request)
-                time.sleep(1)
+        except Exception as e:
+            logger.error(f"Error in register: {e}", exc_info=True)
+            return False
+    
+    async def register_async(self, timeout: Optional[float] = None) -> bool:
+        """
+        发送 REGISTER 请求（异步引擎模式），收到 200 OK 后立即返回
+        
+        Args:
+            timeout: 注册超时时间（秒），默认使用配置值
             
-            return self.registered
+        Returns:
+            bool: 是否注册成功
+        """
+        try:
+            deadline = time.monotonic() + (timeout or self.register_timeout)
+            
+            for retry_allowed in (True, False):
+                response = await self._register_transaction_async(self.auth.ready, deadline)
+                result = self._register_result(response, retry_allowed)
+                if result is not None:
+                    return result
+            return False
             
         except Exception as e:
             logger.error(f"Error in register: {e}", exc_info=True)
             return False
     
+    def _register_transaction(self, with_auth: bool, deadline: float) -> Optional[SIPMessage]:
+        """
+        执行一次 REGISTER 事务，按 Timer E 重传直到收到最终响应或超时
+        
+        Args:
+            with_auth: 是否包含认证信息
+            deadline: 截止时间（time.monotonic）
+            
+        Returns:
+            SIPMessage: 最终响应，超时返回 None
+        """
+        branch = generate_branch()
+        request = self._build_register_request(with_auth=with_auth, branch=branch)
+        future = self.transactions.begin(branch, self.cseq, "REGISTER")
+        try:
+            for wait in retransmit_intervals(deadline - time.monotonic()):
+                self._send_request(request)
+                try:
+                    return future.result(wait)
+                except FutureTimeoutError:
+                    continue
+            return None
+        finally:
+            self.transactions.end(branch)
+    
+    async def _register_transaction_async(self, with_auth: bool, deadline: float) -> Optional[SIPMessage]:
+        """
+        执行一次 REGISTER 事务（异步引擎模式）
+        
+        Args:
+            with_auth: 是否包含认证信息
+            deadline: 截止时间（time.monotonic）
+            
+        Returns:
+            SIPMessage: 最终响应，超时返回 None
+        """
+        branch = generate_branch()
+        request = self._build_register_request(with_auth=with_auth, branch=branch)
+        waiter = asyncio.wrap_future(self.transactions.begin(branch, self.cseq, "REGISTER"))
+        try:
+            for wait in retransmit_intervals(deadline - time.monotonic()):
+                self._send_request(request)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(waiter), wait)
+                except asyncio.TimeoutError:
+                    continue
+            return None
+        finally:
+            self.transactions.end(branch)
+    
+    def _register_result(self, response: Optional[SIPMessage], retry_allowed: bool) -> Optional[bool]:
+        """
+        处理 REGISTER 最终响应
+        
+        Args:
+            response: 最终响应，超时为 None
+            retry_allowed: 收到 401 时是否允许携带新的认证信息重试
+            
+        Returns:
+            bool: 注册结果；None 表示需要携带认证信息重试
+        """
+        if response is None:
+            logger.error(f"REGISTER timed out for device {self.device_id}")
+            return False
+        
+        if response.status_code == 200:
+            self.registered = True
+            logger.info(f"Device {self.device_id} registered successfully")
+            self._on_registered()
+            return True
+        
+        if response.status_code == 401 and retry_allowed and self.auth.ready:
+            if self.auth.stale:
+                logger.info(f"Nonce stale for device {self.device_id}, retrying with new nonce")
+            return None
+        
+        logger.error(f"REGISTER rejected with {response.status_code} for device {self.device_id}")
+        return False
+    
     def unregister(self):
         """注销设备"""
         try:
             logger.info("Unregistering device")
+            self._cancel_timers()
             request = self._build_register_request(expires=0, with_auth=True)
             self._send_request(request)
             self.registered = False
         except Exception as e:
             logger.error(f"Error in unregister: {e}", exc_info=True)
     
-    def _build_register_request(self, expires: int = 3600, with_auth: bool = False) -> str:
+    def _compile_templates(self):
+        """
+        按设备信息和本地地址预编译 REGISTER / MESSAGE 请求模板
+        
+        设备的 URI、From tag、本地地址在运行期间不变，直接写入模板；
+        每次请求只填入 branch、Call-ID、CSeq 以及 Expires/认证头或消息体
+        """
+        uri = format_sip_uri(self.sip_user, self.domain)
+        to_uri = format_sip_uri(self.server_id, self.domain)
+        via = f"Via: SIP/2.0/UDP {self.local_ip}:{self.local_port};rport;branch={{branch}}"
+        
+        self.register_template = SIPTemplate(
+            f"REGISTER {self.server_uri} SIP/2.0",
+            via,
+            f"From: <{uri}>;tag={self.from_tag}",
+            f"To: <{uri}>",
+            "Call-ID: {call_id}",
+            "CSeq: {cseq:d} REGISTER",
+            f"Contact: <sip:{self.sip_user}@{self.local_ip}:{self.local_port}>",
+            "Max-Forwards: 70",
+            "Expires: {expires:d}",
+            "User-Agent: GB28181-Simulator/1.0",
+            # 认证头为可选行，不需要时填入空串
+            "{authorization}Content-Length: 0",
+            "",
+            "",
+        )
+        
+        self.message_template = SIPTemplate(
+            f"MESSAGE {self.server_uri} SIP/2.0",
+            via,
+            f"From: <{uri}>;tag={self.from_tag}",
+            f"To: <{to_uri}>",
+            "Call-ID: {call_id}",
+            "CSeq: {cseq:d} MESSAGE",
+            "Content-Type: Application/MANSCDP+xml",
+            "Max-Forwards: 70",
+            "Content-Length: {length:d}",
+            "",
+            "{body}",
+        )
+        
+        # MESSAGE 头部按最长的 branch / Call-ID / CSeq / Content-Length 估算，其余字节留给消息体
+        header_size = len(self.message_template.render(
+            generate_branch().encode(), generate_call_id().encode(), 10 ** 9, 10 ** 5, b""
+        ))
+        self.catalog_handler.set_part_bytes(self.sip_mtu - UDP_IP_OVERHEAD - header_size)
+    
+    def _build_register_request(self, expires: Optional[int] = None, with_auth: bool = False,
+                                branch: Optional[str] = None) -> bytes:
         """
         构建 REGISTER 请求
         
         Args:
-            expires: 过期时间（秒）
+            expires: 过期时间（秒），默认使用配置的注册有效期
             with_auth: 是否包含认证信息
+            branch: Via branch，默认随机生成
             
         Returns:
-            str: SIP 请求消息
+            bytes: SIP 请求消息
         """
+        if expires is None:
+            expires = self.register_expires
+        if self.register_template is None:
+            self._compile_templates()
         self.cseq += 1
-        branch = generate_branch()
-        
-        uri = format_sip_uri(self.sip_user, self.domain)
-        server_uri = f"sip:{self.server_ip}:{self.server_port}"
-        
-        lines = [
-            f"REGISTER {server_uri} SIP/2.0",
-            f"Via: SIP/2.0/UDP {self.local_ip}:{self.local_port};rport;branch={branch}",
-            f"From: <{uri}>;tag={self.from_tag}",
-            f"To: <{uri}>",
-            f"Call-ID: {self.call_id}",
-            f"CSeq: {self.cseq} REGISTER",
-            f"Contact: <sip:{self.sip_user}@{self.local_ip}:{self.local_port}>",
-            f"Max-Forwards: 70",
-            f"Expires: {expires}",
-            f"User-Agent: GB28181-Simulator/1.0",
-        ]
         
         # 添加认证信息
-        if with_auth and self.auth_info:
-            auth_header = self._build_auth_header("REGISTER", server_uri)
-            lines.append(f"Authorization: {auth_header}")
+        authorization = b""
+        if with_auth and self.auth.ready:
+            authorization = f"Authorization: {self._build_auth_header('REGISTER', self.server_uri)}\r\n".encode()
         
-        lines.extend([
-            f"Content-Length: 0",
-            "",
-            ""
-        ])
+        # 槽位顺序：branch, call_id, cseq, expires, authorization
+        return self.register_template.render(
+            (branch or generate_branch()).encode(),
+            self.call_id.encode(),
+            self.cseq,
+            expires,
+            authorization,
+        )
+    
+    def _build_message_request(self, body: str, call_id: Optional[str] = None) -> bytes:
+        """
+        构建携带 MANSCDP XML 消息体的 MESSAGE 请求
         
-        return "\r\n".join(lines)
+        Args:
+            body: XML 消息体
+            call_id: 使用的 Call-ID（如媒体通知沿用点播会话的 Call-ID），None 时生成新的
+            
+        Returns:
+            bytes: SIP 请求消息
+        """
+        if self.message_template is None:
+            self._compile_templates()
+        self.cseq += 1
+        payload = body.encode("utf-8")
+        
+        # 槽位顺序：branch, call_id, cseq, length, body
+        # Content-Length 按编码后的字节数计算（通道名称等可能包含中文）
+        return self.message_template.render(
+            generate_branch().encode(),
+            (call_id or generate_call_id()).encode(),
+            self.cseq,
+            len(payload),
+            payload,
+        )
     
     def _build_auth_header(self, method: str, uri: str) -> str:
         """
@@ -252,27 +494,9 @@ class SIPClient:
         Returns:
             str: Authorization 头内容
         """
-        response = calculate_digest_response(
-            username=self.sip_user,
-            realm=self.auth_info.get("realm", ""),
-            password=self.sip_password,
-            method=method,
-            uri=uri,
-            nonce=self.auth_info.get("nonce", "")
-        )
-        
-        parts = [
-            f'Digest username="{self.sip_user}"',
-            f'realm="{self.auth_info.get("realm", "")}"',
-            f'nonce="{self.auth_info.get("nonce", "")}"',
-            f'uri="{uri}"',
-            f'response="{response}"',
-            f'algorithm=MD5',
-        ]
-        
-        return ", ".join(parts)
+        return self.auth.authorization(method, uri)
     
-    def _send_request(self, request: str):
+    def _send_request(self, request: bytes):
         """
         发送 SIP 请求
         
@@ -280,12 +504,13 @@ class SIPClient:
             request: SIP 请求消息
         """
         try:
-            logger.debug(f"Sending request:\n{request}")
-            self.sock.sendto(request.encode(), (self.server_ip, self.server_port))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Sending request:\n{request.decode('utf-8', errors='ignore')}")
+            self._sendto(request, (self.server_ip, self.server_port))
         except Exception as e:
             logger.error(f"Error sending request: {e}", exc_info=True)
     
-    def _send_response(self, response: str, addr: tuple):
+    def _send_response(self, response: bytes, addr: tuple):
         """
         发送 SIP 响应
         
@@ -294,11 +519,45 @@ class SIPClient:
             addr: 目标地址
         """
         try:
-            logger.debug(f"Sending response to {addr}:\n{response}")
-            self.sock.sendto(response.encode(), addr)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Sending response to {addr}:\n{response.decode('utf-8', errors='ignore')}")
+            self._sendto(response, addr)
         except Exception as e:
             logger.error(f"Error sending response: {e}", exc_info=True)
     
+    def _sendto(self, data: bytes, addr: tuple):
+        """
+        通过当前传输发送数据报
+        
+        Args:
+            data: 数据
+            addr: 目标地址
+        """
+        if self.engine:
+            if self.transport is None:
+                logger.warning(f"Transport not ready for device {self.device_id}, dropping datagram")
+                return
+            if self.engine.in_loop_thread():
+                self.transport.sendto(data, addr)
+            else:
+                self.engine.call_soon(self.transport.sendto, data, addr)
+        else:
+            self.sock.sendto(data, addr)
+    
+    def _call_later(self, delay: float, callback: Callable, *args):
+        """
+        延迟执行回调：引擎模式下交给事件循环调度，线程模式下直接等待
+        
+        Args:
+            delay: 延迟时间（秒）
+            callback: 回调函数
+        """
+        if self.engine:
+            self.engine.call_later(delay, callback, *args)
+        else:
+            time.sleep(delay)
+            callback(*args)
+    
     def _receive_loop(self):
         """接收循环"""
         logger.info("Receive loop started")
@@ -306,12 +565,7 @@ class SIPClient:
         while self.running:
             try:
                 data, addr = self.sock.recvfrom(65535)
-                message = data.decode('utf-8', errors='ignore')
-                
-                logger.debug(f"Received from {addr}:\n{message}")
-                
-                # 处理消息
-                self._handle_message(message, addr)
+                self._on_datagram(data, addr)
                 
             except socket.timeout:
                 continue
@@ -321,144 +575,147 @@ class SIPClient:
         
         logger.info("Receive loop stopped")
     
-    def _handle_message(self, message: str, addr: tuple):
+    def _on_datagram(self, data: bytes, addr: tuple):
+        """
+        处理收到的数据报
+        
+        Args:
+            data: 原始数据
+            addr: 发送方地址
+        """
+        message = parse_message(data)
+        if message is None:
+            logger.debug(f"Ignoring non-SIP datagram from {addr}")
+            return
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Received from {addr}:\n{message.text()}")
+        
+        self._handle_message(message, addr)
+    
+    def _handle_message(self, message: SIPMessage, addr: tuple):
         """
         处理接收到的 SIP 消息
         
         Args:
-            message: SIP 消息
+            message: 已定位的 SIP 消息
             addr: 发送方地址
         """
         try:
-            lines = message.split('\r\n')
-            if not lines:
-                return
-            
-            first_line = lines[0]
-            
-            # 解析消息类型
-            if first_line.startswith('SIP/2.0'):
-                # 这是响应
-                self._handle_response(message, lines, addr)
+            if message.is_response:
+                self._handle_response(message, addr)
             else:
-                # 这是请求
-                self._handle_request(message, lines, addr)
+                self._handle_request(message, addr)
                 
         except Exception as e:
             logger.error(f"Error handling message: {e}", exc_info=True)
     
-    def _handle_response(self, message: str, lines: list, addr: tuple):
+    def _handle_response(self, message: SIPMessage, addr: tuple):
         """
-        处理 SIP 响应
+        处理 SIP 响应（只读取状态码和事务匹配所需的头部）
         
         Args:
-            message: 完整消息
-            lines: 消息行列表
+            message: SIP 响应
             addr: 发送方地址
         """
         try:
-            status_line = lines[0]
-            status_code = int(status_line.split()[1])
+            status_code = message.status_code
             
             logger.info(f"Received response: {status_code}")
             
-            if status_code == 200:
-                # OK 响应
-                if 'REGISTER' in message:
-                    self.registered = True
-                    logger.info("Device registered successfully")
-                    
-            elif status_code == 401:
+            if status_code == 401:
                 # 需要认证
                 logger.info("Authentication required")
-                for line in lines:
-                    if line.startswith('WWW-Authenticate:'):
-                        auth_str = line[17:].strip()
-                        self.auth_info = parse_sip_auth_header(auth_str)
-                        logger.debug(f"Auth info: {self.auth_info}")
-                        
+                auth_str = message.get("WWW-Authenticate")
+                if auth_str:
+                    self.auth.on_challenge(auth_str)
+                    logger.debug(f"Auth challenge: realm={self.auth.realm}, nonce={self.auth.nonce}, "
+                                 f"qop={self.auth.qop}, stale={self.auth.stale}")
+            
+            # 结束对应的客户端事务（注册结果由事务发起方处理）
+            self.transactions.on_response(message)
+            
         except Exception as e:
             logger.error(f"Error handling response: {e}", exc_info=True)
     
-    def _handle_request(self, message: str, lines: list, addr: tuple):
+    def _handle_request(self, message: SIPMessage, addr: tuple):
         """
         处理 SIP 请求
         
         Args:
-            message: 完整消息
-            lines: 消息行列表
+            message: SIP 请求
             addr: 发送方地址
         """
         try:
-            request_line = lines[0]
-            method = request_line.split()[0]
+            method = message.method
             
             logger.info(f"Received request: {method}")
             
             if method == "MESSAGE":
-                self._handle_message_request(message, lines, addr)
+                self._handle_message_request(message, addr)
             elif method == "INVITE":
-                self._handle_invite_request(message, lines, addr)
+                self._handle_invite_request(message, addr)
             elif method == "ACK":
-                self._handle_ack_request(message, lines, addr)
+                self._handle_ack_request(message, addr)
             elif method == "BYE":
-                self._handle_bye_request(message, lines, addr)
+                self._handle_bye_request(message, addr)
+            elif method == "INFO":
+                self._handle_info_request(message, addr)
             else:
                 logger.warning(f"Unsupported method: {method}")
                 
         except Exception as e:
             logger.error(f"Error handling request: {e}", exc_info=True)
     
-    def _handle_message_request(self, message: str, lines: list, addr: tuple):
+    def _handle_message_request(self, message: SIPMessage, addr: tuple):
         """处理 MESSAGE 请求"""
         try:
-            # 提取头部字段
-            headers = self._parse_headers(lines)
-            
-            # 提取消息体
-            body_start = message.find('\r\n\r\n')
-            if body_start != -1:
-                body = message[body_start + 4:]
-                
-                # 解析 XML 消息
-                parsed = parse_xml_message(body)
+            # 提取消息体（按 Content-Length 偏移读取，不解码全部头部）
+            if message.content_length:
+                # 直接从原始字节中提取查询字段，解析结果交给各处理器，不再重复解析
+                parsed = parse_manscdp(message.body)
                 cmd_type = parsed.get("CmdType", "")
                 
                 logger.info(f"Received MESSAGE with CmdType: {cmd_type}")
                 
                 # 发送 200 OK
-                self._send_message_ok(headers, addr)
+                self._send_message_ok(message, addr)
                 
                 # 处理不同类型的查询
                 response_body = None
                 if cmd_type == "Catalog":
-                    response_body = self.catalog_handler.handle_catalog_query(body)
+                    # 目录响应可能分为多条，按配置速率依次发送
+                    parts = self.catalog_handler.handle_catalog_query(parsed)
+                    if parts:
+                        self._call_later(0.1, self._send_message_parts, iter(parts), message, None)
                 elif cmd_type == "DeviceInfo":
-                    response_body = self.catalog_handler.handle_device_info_query(body)
+                    response_body = self.catalog_handler.handle_device_info_query(parsed)
                 elif cmd_type == "DeviceStatus":
-                    response_body = self.catalog_handler.handle_device_status_query(body)
+                    response_body = self.catalog_handler.handle_device_status_query(parsed)
                 elif cmd_type == "DeviceControl":
-                    response_body = self.ptz_handler.handle_ptz_control(body)
+                    response_body = self.ptz_handler.handle_ptz_control(parsed)
                 elif cmd_type == "RecordInfo":
-                    response_body = self.catalog_handler.handle_record_info_query(body)
+                    # 录像列表按需逐片生成，与目录响应一样匀速发送
+                    parts = self.catalog_handler.handle_record_info_query(parsed)
+                    if parts:
+                        self._call_later(0.1, self._send_message_parts, parts, message, None)
                 
-                # 发送响应消息
+                # 发送响应消息（短暂延迟）
                 if response_body:
-                    time.sleep(0.1)  # 短暂延迟
-                    self._send_message_with_body(response_body, headers)
+                    self._call_later(0.1, self._send_message_with_body, response_body, message)
                     
         except Exception as e:
             logger.error(f"Error handling MESSAGE request: {e}", exc_info=True)
     
-    def _handle_invite_request(self, message: str, lines: list, addr: tuple):
+    def _handle_invite_request(self, message: SIPMessage, addr: tuple):
         """处理 INVITE 请求"""
         try:
-            headers = self._parse_headers(lines)
+            # 会话中保存全部头部
+            headers = message.headers()
             
             # 提取 SDP
-            body_start = message.find('\r\n\r\n')
-            if body_start != -1:
-                sdp = message[body_start + 4:]
+            if message.content_length:
+                sdp = message.body_text()
                 
                 # 解析 SDP 获取媒体信息
                 media_info = self._parse_sdp(sdp)
@@ -466,87 +723,156 @@ class SIPClient:
                 logger.info(f"Received INVITE with media info: {media_info}")
                 
                 # 发送 100 Trying
-                self._send_trying(headers, addr)
+                self._send_trying(message, addr)
                 
-                # 发送 200 OK with SDP
-                time.sleep(0.1)
                 call_id = headers.get("Call-ID", "")
                 
-                # 构建 SDP 响应
-                response_sdp = self._build_sdp_response(media_info)
-                self._send_invite_ok(headers, response_sdp, addr)
+                if media_info.get("transport") == "TCP":
+                    # 平台 a=setup:active 表示由平台发起连接，本端监听并在应答中给出端口；
+                    # 否则（passive 或未指定）本端在 ACK 后主动连接平台
+                    if media_info.get("setup") == "active":
+                        media_info["local_setup"] = "passive"
+                        media_info["local_port"] = self.media_server.prepare_tcp_listener(call_id, self.local_ip) or 0
+                    else:
+                        media_info["local_setup"] = "active"
                 
-                # 保存会话信息
+                # 保存会话信息（先于 200 OK，确保 ACK 到达时会话已存在）
                 self.active_calls[call_id] = {
                     "media_info": media_info,
                     "headers": headers,
-                    "start_time": time.time()
+                    "start_time": time.time(),
+                    # 超时未收到 ACK 则清理会话
+                    "ack_timer": self._schedule(ACK_TIMEOUT, self._on_ack_timeout, call_id)
                 }
                 
+                # 构建 SDP 响应，短暂延迟后发送 200 OK with SDP
+                response_sdp = self._build_sdp_response(media_info)
+                self._call_later(0.1, self._send_invite_ok, message, response_sdp, addr)
+                
         except Exception as e:
             logger.error(f"Error handling INVITE request: {e}", exc_info=True)
     
-    def _handle_ack_request(self, message: str, lines: list, addr: tuple):
+    def _handle_ack_request(self, message: SIPMessage, addr: tuple):
         """处理 ACK 请求"""
         try:
-            headers = self._parse_headers(lines)
-            call_id = headers.get("Call-ID", "")
+            call_id = message.call_id
             
             logger.info(f"Received ACK for call {call_id}")
             
             # 启动媒体流推送
             if call_id in self.active_calls:
                 session = self.active_calls[call_id]
+                self.timers.cancel(session.pop("ack_timer", None))
                 media_info = session["media_info"]
                 
                 # 启动 FFmpeg 推流
                 target_ip = media_info.get("ip")
                 target_port = media_info.get("port")
                 
-                if target_ip and target_port:
+                if target_ip and target_port and media_info.get("session") in (SESSION_PLAYBACK, SESSION_DOWNLOAD):
+                    # 录像回放 / 下载：从 t= 行的开始时间对应的位置发送，下载按 downloadspeed 倍速
+                    download = media_info["session"] == SESSION_DOWNLOAD
+                    self.media_server.start_playback(
+                        call_id=call_id,
+                        target_ip=target_ip,
+                        target_port=target_port,
+                        transport=media_info.get("transport", "UDP"),
+                        ssrc=media_info.get("ssrc"),
+                        setup=media_info.get("local_setup", "active"),
+                        start_time=media_info.get("start_time", 0),
+                        end_time=media_info.get("end_time", 0),
+                        scale=media_info.get("download_speed", 1.0) if download else 1.0,
+                        on_finish=self._on_playback_finish
+                    )
+                elif target_ip and target_port:
                     self.media_server.start_stream(
                         call_id=call_id,
                         target_ip=target_ip,
                         target_port=target_port,
-                        transport=media_info.get("transport", "UDP")
+                        transport=media_info.get("transport", "UDP"),
+                        ssrc=media_info.get("ssrc"),
+                        profile=self.media_server.negotiate_profile(media_info.get("codec"),
+                                                                    media_info.get("profile_idc")),
+                        setup=media_info.get("local_setup", "active")
                     )
                     
         except Exception as e:
             logger.error(f"Error handling ACK request: {e}", exc_info=True)
     
-    def _handle_bye_request(self, message: str, lines: list, addr: tuple):
+    def _handle_bye_request(self, message: SIPMessage, addr: tuple):
         """处理 BYE 请求"""
         try:
-            headers = self._parse_headers(lines)
-            call_id = headers.get("Call-ID", "")
+            call_id = message.call_id
             
             logger.info(f"Received BYE for call {call_id}")
             
             # 发送 200 OK
-            self._send_bye_ok(headers, addr)
+            self._send_bye_ok(message, addr)
             
             # 停止媒体流
             self.media_server.stop_stream(call_id)
             
             # 移除会话
-            if call_id in self.active_calls:
-                del self.active_calls[call_id]
+            session = self.active_calls.pop(call_id, None)
+            if session:
+                self.timers.cancel(session.get("ack_timer"))
                 
         except Exception as e:
             logger.error(f"Error handling BYE request: {e}", exc_info=True)
     
-    def _parse_headers(self, lines: list) -> dict:
-        """解析 SIP 头部"""
-        headers = {}
-        for line in lines[1:]:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                headers[key.strip()] = value.strip()
-        return headers
+    def _handle_info_request(self, message: SIPMessage, addr: tuple):
+        """处理 INFO 请求（录像回放控制，MANSRTSP）"""
+        try:
+            call_id = message.call_id
+            session = self.active_calls.get(call_id)
+            if session is None:
+                self._send_response(self._build_response(481, "Call/Transaction Does Not Exist", message), addr)
+                return
+            
+            self._send_response(self._build_ok_response("INFO", message), addr)
+            
+            command = parse_mansrtsp(message.body_text()) if message.content_length else {"error": "Empty body"}
+            if "error" in command:
+                logger.warning(f"Invalid playback control for call {call_id}: {command['error']}")
+                return
+            
+            logger.info(f"Received playback control {command['method']} for call {call_id}")
+            if command["method"] == "PLAY":
+                # PLAY 继续播放，可同时改变倍速（Scale）或跳转（Range）；不支持倒放
+                scale = clamp_scale(command["scale"])
+                if command["scale"] is not None and scale is None:
+                    logger.warning(f"Unsupported playback scale {command['scale']} for call {call_id}")
+                self.media_server.control_playback(call_id, scale=scale, pause=False, seek=command["range"])
+            elif command["method"] == "PAUSE":
+                self.media_server.control_playback(call_id, pause=True)
+            elif command["method"] == "TEARDOWN":
+                self.media_server.stop_stream(call_id)
+            else:
+                logger.warning(f"Unsupported playback control method: {command['method']}")
+                
+        except Exception as e:
+            logger.error(f"Error handling INFO request: {e}", exc_info=True)
+    
+    def _on_playback_finish(self, call_id: str):
+        """录像回放 / 下载发送完毕（媒体发送线程回调），转到定时器线程发送媒体通知"""
+        self._schedule(0, self._send_media_status, call_id)
+    
+    def _send_media_status(self, call_id: str):
+        """发送录像文件结束通知（MediaStatus，NotifyType 121），沿用点播会话的 Call-ID"""
+        session = self.active_calls.get(call_id)
+        if session is None:
+            return
+        channel_id = session["media_info"].get("channel_id") or self.device_id
+        logger.info(f"Playback of {channel_id} finished for call {call_id}, sending MediaStatus")
+        try:
+            self._send_request(self._build_message_request(XMLBuilder.build_media_status(channel_id), call_id))
+        except Exception as e:
+            logger.error(f"Error sending MediaStatus: {e}", exc_info=True)
     
     def _parse_sdp(self, sdp: str) -> dict:
         """解析 SDP"""
         info = {}
+        payloads, rtpmap, fmtp = [], {}, {}
         for line in sdp.split('\r\n'):
             if line.startswith('c='):
                 # c=IN IP4 192.168.1.100
@@ -560,158 +886,256 @@ class SIPClient:
                     info["port"] = int(parts[1])
                 if len(parts) >= 3:
                     info["transport"] = "TCP" if "TCP" in parts[2] else "UDP"
+                payloads = parts[3:]
+            elif line.startswith('a=rtpmap:'):
+                # a=rtpmap:96 PS/90000
+                payload, _, encoding = line[9:].partition(' ')
+                rtpmap[payload] = encoding.split('/')[0].strip().upper()
+            elif line.startswith('a=fmtp:'):
+                # a=fmtp:98 profile-level-id=42e01e;packetization-mode=1
+                payload, _, params = line[7:].partition(' ')
+                fmtp[payload] = params
+            elif line.startswith('a=setup:'):
+                # a=setup:active / passive（RFC 4145，TCP 传输时平台的角色）
+                info["setup"] = line[8:].strip().lower()
+            elif line.startswith('y='):
+                # y=0100000001（GB28181 SSRC）
+                info["ssrc"] = line[2:].strip()
+            elif line.startswith('s='):
+                # s=Play / Playback / Download
+                info["session"] = line[2:].strip()
+            elif line.startswith('u='):
+                # u=34020000001320000001:0（回放的通道和录像类型）
+                info["channel_id"] = line[2:].split(':')[0].strip()
+            elif line.startswith('t='):
+                # t=1700000000 1700003600（回放的录像时间范围，Unix 秒；实时流为 t=0 0）
+                parts = line[2:].split()
+                if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+                    info["start_time"], info["end_time"] = int(parts[0]), int(parts[1])
+            elif line.startswith('a=downloadspeed:'):
+                # a=downloadspeed:4（下载倍速）
+                try:
+                    download_speed = clamp_scale(float(line[16:].strip()))
+                    if download_speed is not None:
+                        info["download_speed"] = max(1.0, download_speed)
+                except ValueError:
+                    pass
+        
+        # 按 m= 行的顺序取第一个支持的编码；H.264 的 profile-level-id 首字节为 profile_idc
+        for payload in payloads:
+            codec = SDP_CODECS.get(rtpmap.get(payload, ""))
+            if codec:
+                info["codec"] = codec
+                for param in fmtp.get(payload, "").split(';'):
+                    name, _, value = param.strip().partition('=')
+                    if name.lower() == "profile-level-id" and len(value) == 6:
+                        try:
+                            info["profile_idc"] = int(value[:2], 16)
+                        except ValueError:
+                            pass
+                break
         return info
     
     def _build_sdp_response(self, request_media: dict) -> str:
         """构建 SDP 响应"""
+        tcp = request_media.get("transport") == "TCP"
+        port = request_media.get("local_port", request_media.get('port', 30000))
         sdp_lines = [
             "v=0",
             f"o={self.sip_user} 0 0 IN IP4 {self.local_ip}",
-            "s=Play",
+            f"s={request_media.get('session') or SESSION_PLAY}",
             f"c=IN IP4 {self.local_ip}",
-            "t=0 0",
-            f"m=video {request_media.get('port', 30000)} RTP/AVP 96 98 97",
+            f"t={request_media.get('start_time', 0)} {request_media.get('end_time', 0)}",
+            f"m=video {port} {'TCP/RTP/AVP' if tcp else 'RTP/AVP'} 96 98 97",
             "a=rtpmap:96 PS/90000",
             "a=rtpmap:98 H264/90000",
             "a=rtpmap:97 MPEG4/90000",
             "a=recvonly",
-            f"y={self.device_id.zfill(10)}",
         ]
+        if tcp:
+            sdp_lines += [f"a=setup:{request_media.get('local_setup', 'active')}", "a=connection:new"]
+        sdp_lines.append(f"y={request_media.get('ssrc') or self.device_id.zfill(10)}")
         return "\r\n".join(sdp_lines) + "\r\n"
     
-    def _send_message_ok(self, request_headers: dict, addr: tuple):
+    def _send_message_ok(self, request: SIPMessage, addr: tuple):
         """发送 MESSAGE 的 200 OK 响应"""
-        response = self._build_ok_response("MESSAGE", request_headers)
+        response = self._build_ok_response("MESSAGE", request)
         self._send_response(response, addr)
     
-    def _send_trying(self, request_headers: dict, addr: tuple):
+    def _send_trying(self, request: SIPMessage, addr: tuple):
         """发送 100 Trying"""
-        response = self._build_response(100, "Trying", request_headers)
+        response = self._build_response(100, "Trying", request)
         self._send_response(response, addr)
     
-    def _send_invite_ok(self, request_headers: dict, sdp: str, addr: tuple):
+    def _send_invite_ok(self, request: SIPMessage, sdp: str, addr: tuple):
         """发送 INVITE 的 200 OK 响应"""
-        response = self._build_ok_response("INVITE", request_headers, body=sdp)
+        response = self._build_ok_response("INVITE", request, body=sdp)
         self._send_response(response, addr)
     
-    def _send_bye_ok(self, request_headers: dict, addr: tuple):
+    def _send_bye_ok(self, request: SIPMessage, addr: tuple):
         """发送 BYE 的 200 OK 响应"""
-        response = self._build_ok_response("BYE", request_headers)
+        response = self._build_ok_response("BYE", request)
         self._send_response(response, addr)
     
-    def _build_ok_response(self, method: str, request_headers: dict, body: str = "") -> str:
+    def _build_ok_response(self, method: str, request: SIPMessage, body: str = "") -> bytes:
         """构建 200 OK 响应"""
-        return self._build_response(200, "OK", request_headers, method, body)
-    
-    def _build_response(self, code: int, reason: str, request_headers: dict, 
-                       method: str = "", body: str = "") -> str:
-        """构建 SIP 响应"""
-        lines = [
-            f"SIP/2.0 {code} {reason}",
-            f"Via: {request_headers.get('Via', '')}",
-            f"From: {request_headers.get('From', '')}",
-            f"To: {request_headers.get('To', '')}",
-            f"Call-ID: {request_headers.get('Call-ID', '')}",
-            f"CSeq: {request_headers.get('CSeq', '')}",
-        ]
+        return self._build_response(200, "OK", request, method, body)
+    
+    def _build_response(self, code: int, reason: str, request: SIPMessage, 
+                       method: str = "", body: str = "") -> bytes:
+        """构建 SIP 响应：请求的全部 Via（保持顺序）、From、To、Call-ID、CSeq 头部行原样回填，不解码"""
+        response = b"SIP/2.0 %d %s\r\n%s" % (code, reason.encode(), request.echoed_headers())
 
         # INVITE 的 200 OK 响应必须包含 Contact 头
         if code == 200 and method == "INVITE":
-            contact = request_headers.get("Contact")
+            contact = request.raw("Contact")
             if not contact:
                 # 默认用本地地址
-                contact = f"<sip:{self.sip_user}@{self.local_ip}:{self.local_port}>"
-            lines.append(f"Contact: {contact}")
+                contact = f"<sip:{self.sip_user}@{self.local_ip}:{self.local_port}>".encode()
+            response += b"Contact: %s\r\n" % contact
 
         if body:
-            lines.extend([
-                f"Content-Type: application/sdp",
-                f"Content-Length: {len(body)}",
-                "",
-                body
-            ])
-        else:
-            lines.extend([
-                f"Content-Length: 0",
-                "",
-                ""
-            ])
-
-        return "\r\n".join(lines)
+            # Content-Length 按编码后的字节数计算
+            payload = body.encode("utf-8")
+            return response + b"Content-Type: application/sdp\r\nContent-Length: %d\r\n\r\n%s" % (len(payload), payload)
+        return response + b"Content-Length: 0\r\n\r\n"
     
-    def _send_message_with_body(self, body: str, request_headers: dict):
+    def _send_message_with_body(self, body: str, request: SIPMessage):
         """发送带 XML 消息体的 MESSAGE 请求"""
         try:
-            self.cseq += 1
-            branch = generate_branch()
-            
-            from_uri = format_sip_uri(self.sip_user, self.domain)
-            to_uri = format_sip_uri(self.server_id, self.domain)
-            
-            lines = [
-                f"MESSAGE sip:{self.server_ip}:{self.server_port} SIP/2.0",
-                f"Via: SIP/2.0/UDP {self.local_ip}:{self.local_port};rport;branch={branch}",
-                f"From: <{from_uri}>;tag={self.from_tag}",
-                f"To: <{to_uri}>",
-                f"Call-ID: {generate_call_id()}",
-                f"CSeq: {self.cseq} MESSAGE",
-                f"Content-Type: Application/MANSCDP+xml",
-                f"Max-Forwards: 70",
-                f"Content-Length: {len(body)}",
-                "",
-                body
-            ]
-            
-            request = "\r\n".join(lines)
-            self._send_request(request)
-            
+            self._send_request(self._build_message_request(body))
         except Exception as e:
             logger.error(f"Error sending MESSAGE: {e}", exc_info=True)
     
-    def _keepalive_loop(self):
-        """心跳循环"""
-        logger.info("Keepalive loop started")
+    def _send_message_parts(self, bodies: Iterator[str], request: SIPMessage,
+                            started: Optional[float], index: int = 0, pending: Optional[str] = None):
+        """
+        按 message_send_rate 匀速发送多条 MESSAGE（如分片的目录、录像查询响应）
         
-        while self.running and self.registered:
-            try:
-                # 发送心跳消息
-                self._send_keepalive()
-                
-                # 每60秒发送一次心跳
-                time.sleep(60)
-                
-            except Exception as e:
-                logger.error(f"Error in keepalive loop: {e}", exc_info=True)
+        第 i 条的发送时刻为 started + i / rate；每次触发时补发所有已到期的分片，
+        剩余分片交给时间轮调度，不占用接收线程。消息体按需从迭代器中取出，
+        长录像列表不会一次性生成
         
-        logger.info("Keepalive loop stopped")
+        Args:
+            bodies: XML 消息体迭代器
+            request: 查询请求
+            started: 首条的发送时刻（time.monotonic），为 None 时取当前时刻
+            index: 下一条待发送的序号
+            pending: 已从迭代器取出、尚未到发送时刻的消息体
+        """
+        now = time.monotonic()
+        if started is None:
+            started = now
+        interval = 1.0 / self.message_send_rate if self.message_send_rate > 0 else 0.0
+        
+        try:
+            while True:
+                if pending is None:
+                    pending = next(bodies, None)
+                    if pending is None:
+                        break
+                if started + index * interval > now:
+                    break
+                self._send_message_with_body(pending, request)
+                pending = None
+                index += 1
+        except Exception as e:
+            logger.error(f"Error generating MESSAGE part {index}: {e}", exc_info=True)
+            return
+        
+        if pending is not None:
+            if self.running:
+                self._schedule(started + index * interval - now, self._send_message_parts,
+                               bodies, request, started, index, pending)
+        elif index > 1:
+            logger.info(f"Sent {index} MESSAGE parts for device {self.device_id}")
+    
+    def _schedule(self, delay: float, callback: Callable, *args):
+        """
+        在共享时间轮中添加定时任务，引擎模式下回调转交事件循环执行
+        
+        Args:
+            delay: 延迟时间（秒）
+            callback: 回调函数
+            
+        Returns:
+            Timer: 定时任务句柄
+        """
+        if self.engine:
+            return self.timers.schedule(delay, self.engine.call_soon, callback, *args)
+        return self.timers.schedule(delay, callback, *args)
+    
+    def _jittered(self, interval: float) -> float:
+        """为定时间隔加入设备级随机抖动"""
+        return interval * (1 + self._rng.uniform(-self.timer_jitter, self.timer_jitter))
+    
+    def _on_registered(self):
+        """注册成功后调度心跳和注册刷新"""
+        if self.keepalive_timer is None or not self.keepalive_timer.active:
+            # 首次心跳在抖动窗口内随机错开
+            phase = self._rng.uniform(0, self.keepalive_interval * self.timer_jitter)
+            self.keepalive_timer = self._schedule(phase, self._keepalive_tick)
+        
+        # 在有效期的 80% 处刷新注册
+        self.timers.cancel(self.refresh_timer)
+        self.refresh_timer = self._schedule(
+            self._jittered(self.register_expires * 0.8), self._refresh_registration
+        )
+    
+    def _cancel_timers(self):
+        """取消心跳和注册刷新定时任务"""
+        self.timers.cancel(self.keepalive_timer)
+        self.timers.cancel(self.refresh_timer)
+        self.keepalive_timer = None
+        self.refresh_timer = None
+    
+    def _keepalive_tick(self):
+        """心跳定时回调"""
+        if not (self.running and self.registered):
+            return
+        self._send_keepalive()
+        self.keepalive_timer = self._schedule(self._jittered(self.keepalive_interval), self._keepalive_tick)
+    
+    def _refresh_registration(self):
+        """注册刷新定时回调，注册过程不能阻塞时间轮线程"""
+        if not self.running:
+            return
+        if self.engine:
+            self.engine.loop.create_task(self._refresh_registration_async())
+        else:
+            threading.Thread(target=self._refresh_registration_sync, daemon=True).start()
+    
+    def _refresh_registration_sync(self):
+        if not self.register():
+            self._on_refresh_failed()
+    
+    async def _refresh_registration_async(self):
+        if not await self.register_async():
+            self._on_refresh_failed()
+    
+    def _on_refresh_failed(self):
+        """注册刷新失败，稍后重试"""
+        logger.warning(f"Registration refresh failed for device {self.device_id}, "
+                       f"retrying in {REGISTER_RETRY_INTERVAL}s")
+        if self.running:
+            self.refresh_timer = self._schedule(
+                self._jittered(REGISTER_RETRY_INTERVAL), self._refresh_registration
+            )
+    
+    def _on_ack_timeout(self, call_id: str):
+        """INVITE 会话在超时时间内未收到 ACK，清理会话"""
+        session = self.active_calls.get(call_id)
+        if session and "ack_timer" in session:
+            logger.warning(f"No ACK received for call {call_id} within {ACK_TIMEOUT}s, dropping session")
+            del self.active_calls[call_id]
+            # 释放为 TCP 媒体预先打开的监听端口
+            self.media_server.release_tcp(call_id)
     
     def _send_keepalive(self):
         """发送心跳消息"""
         try:
-            body = XMLBuilder.build_keepalive(self.device_id, status="OK")
-            
-            self.cseq += 1
-            branch = generate_branch()
-            
-            from_uri = format_sip_uri(self.sip_user, self.domain)
-            to_uri = format_sip_uri(self.server_id, self.domain)
-            
-            lines = [
-                f"MESSAGE sip:{self.server_ip}:{self.server_port} SIP/2.0",
-                f"Via: SIP/2.0/UDP {self.local_ip}:{self.local_port};rport;branch={branch}",
-                f"From: <{from_uri}>;tag={self.from_tag}",
-                f"To: <{to_uri}>",
-                f"Call-ID: {generate_call_id()}",
-                f"CSeq: {self.cseq} MESSAGE",
-                f"Content-Type: Application/MANSCDP+xml",
-                f"Max-Forwards: 70",
-                f"Content-Length: {len(body)}",
-                "",
-                body
-            ]
-            
-            request = "\r\n".join(lines)
-            self._send_request(request)
+            body = self.keepalive_body.render(timestamp_sn())
+            self._send_request(self._build_message_request(body))
             
             logger.debug("Keepalive sent")
             
@@ -721,3 +1145,15 @@ class SIPClient:
     def send_keepalive(self):
         """公开方法：发送心跳消息（用于 Web 界面控制）"""
         self._send_keepalive()
+    
+    def update_device_config(self, device_config: Dict[str, Any]):
+        """
+        应用更新后的设备配置（用于 Web 界面修改配置）
+        
+        目录、设备信息等查询响应立即按新配置生成；SIP 账号等注册参数需重启后生效
+        
+        Args:
+            device_config: 新的设备配置
+        """
+        self.device_config = device_config
+        self.catalog_handler.update_config(device_config)
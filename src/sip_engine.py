@@ -0,0 +1,326 @@
+"""
+异步 SIP 引擎
+使用单个 asyncio 事件循环驱动所有模拟设备的 SIP 信令
+"""
+import asyncio
+import logging
+import re
+import socket
+import threading
+from typing import List, Dict, Optional, Callable, Any
+
+from sip_parser import parse_message
+
+logger = logging.getLogger(__name__)
+
+# URI 方案名不区分大小写（RFC 3261 19.1.4）
+_SIP_SCHEME_RE = re.compile(rb"sip:", re.IGNORECASE)
+
+# 共享端口 socket 收发缓冲区大小（字节），实际值受内核 rmem_max/wmem_max 限制
+SHARED_SOCKET_BUFFER = 8 * 1024 * 1024
+
+
+class DeviceProtocol(asyncio.DatagramProtocol):
+    """单个设备的 UDP 协议对象，将收到的数据报交给对应的 SIPClient"""
+
+    def __init__(self, client):
+        """
+        初始化设备协议对象
+
+        Args:
+            client: SIPClient 实例
+        """
+        self.client = client
+
+    def connection_made(self, transport):
+        self.client.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        self.client._on_datagram(data, addr)
+
+    def error_received(self, exc: Exception):
+        logger.warning(f"UDP error for device {self.client.device_id}: {exc}")
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.client.transport = None
+
+
+class SharedPortProtocol(asyncio.DatagramProtocol):
+    """共享端口协议对象，按 SIP 用户将数据报分发给对应设备"""
+
+    def __init__(self, engine: "SIPEngine"):
+        """
+        初始化共享端口协议对象
+
+        Args:
+            engine: SIPEngine 实例
+        """
+        self.engine = engine
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        client = self.engine.dispatcher.route(data)
+        if client is None:
+            logger.debug(f"No device found for datagram from {addr}, dropped")
+            return
+        client._on_datagram(data, addr)
+
+    def error_received(self, exc: Exception):
+        logger.warning(f"UDP error on shared SIP port: {exc}")
+
+
+class SIPDispatcher:
+    """
+    共享端口消息分发器
+    
+    请求按 Request-URI 用户部分路由（回退到 To 用户），
+    响应按 From 用户部分路由（设备是 UAC，回退到 To 用户），
+    头部由 sip_parser 定位（头部名不区分大小写，含紧凑形式），索引为字典，查找复杂度 O(1)
+    """
+
+    def __init__(self):
+        """初始化分发器"""
+        self.index: Dict[str, Any] = {}
+
+    def add(self, client):
+        """
+        登记设备，设备 ID、SIP 用户和所有通道 ID 都指向同一设备
+
+        Args:
+            client: SIPClient 实例
+        """
+        for key in self._keys(client):
+            self.index[key] = client
+
+    def remove(self, client):
+        """移除设备"""
+        for key in self._keys(client):
+            if self.index.get(key) is client:
+                del self.index[key]
+
+    @staticmethod
+    def _keys(client) -> set:
+        keys = {client.device_id, client.sip_user}
+        for channel in client.device_config.get("channels", []) or []:
+            if channel.get("channel_id"):
+                keys.add(str(channel["channel_id"]))
+        keys.discard(None)
+        return keys
+
+    def route(self, data: bytes):
+        """
+        查找数据报对应的设备
+
+        Args:
+            data: 原始 SIP 消息
+
+        Returns:
+            SIPClient: 目标设备，找不到时返回 None
+        """
+        if data[:8] == b"SIP/2.0 ":
+            names = ("From", "To")
+        else:
+            # 请求先按起始行中的 Request-URI 查找，命中时无需定位头部
+            client = self._lookup(data[:data.find(b"\r\n")])
+            if client is not None:
+                return client
+            names = ("To",)
+
+        message = parse_message(data)
+        if message is None:
+            return None
+        for name in names:
+            client = self._lookup(message.raw(name))
+            if client is not None:
+                return client
+        return None
+
+    def _lookup(self, uri: Optional[bytes]):
+        """按 URI 的用户部分查找设备"""
+        user = _uri_user(uri) if uri else None
+        return self.index.get(user) if user else None
+
+
+def _uri_user(data: bytes) -> Optional[str]:
+    """提取 sip: URI 中的用户部分"""
+    match = _SIP_SCHEME_RE.search(data)
+    if match is None:
+        return None
+    start = match.end()
+    end = start
+    length = len(data)
+    while end < length and data[end] not in b"@;>: \r\n":
+        end += 1
+    if end >= length or data[end] != 0x40:  # '@'
+        return None
+    return data[start:end].decode("ascii", errors="ignore")
+
+
+class SIPEngine:
+    """异步 SIP 引擎：一个事件循环线程承载所有设备"""
+
+    def __init__(self, shared_ports: Optional[List[int]] = None, bind_ip: str = "0.0.0.0"):
+        """
+        初始化 SIP 引擎
+
+        Args:
+            shared_ports: 共享 SIP 端口列表，为空时每个设备绑定独立端口
+            bind_ip: 共享端口绑定地址
+        """
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.clients = []
+
+        # 共享端口模式
+        self.shared_ports = list(shared_ports or [])
+        self.bind_ip = bind_ip
+        self.shared_endpoints: List[SharedPortProtocol] = []
+        self.dispatcher = SIPDispatcher()
+
+        _raise_fd_limit()
+
+        logger.info("SIPEngine initialized")
+
+    def start(self):
+        """在后台线程中启动事件循环"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self.thread = threading.Thread(target=self._run_loop, name="sip-engine", daemon=True)
+        self.thread.start()
+        logger.info("SIP engine event loop started")
+
+        if self.shared_ports:
+            self.run_coroutine(self._open_shared_ports())
+
+    async def _open_shared_ports(self):
+        """绑定共享 SIP 端口"""
+        for port in self.shared_ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # 共享端口承载所有设备的流量，放大收发缓冲区避免突发时丢包
+            for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, opt, SHARED_SOCKET_BUFFER)
+                except OSError:
+                    pass
+            sock.bind((self.bind_ip, port))
+            _, protocol = await self.loop.create_datagram_endpoint(
+                lambda: SharedPortProtocol(self),
+                sock=sock
+            )
+            self.shared_endpoints.append(protocol)
+            logger.info(f"Shared SIP port bound on {self.bind_ip}:{port}")
+
+    def stop(self):
+        """停止事件循环"""
+        if not self.thread:
+            return
+
+        for endpoint in self.shared_endpoints:
+            if endpoint.transport:
+                self.loop.call_soon_threadsafe(endpoint.transport.close)
+        self.shared_endpoints = []
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.thread = None
+        logger.info("SIP engine event loop stopped")
+
+    def _run_loop(self):
+        """事件循环线程入口"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop_thread(self) -> bool:
+        """当前是否运行在事件循环线程中"""
+        return self.thread is not None and threading.current_thread() is self.thread
+
+    def run_coroutine(self, coro, timeout: Optional[float] = None) -> Any:
+        """
+        从其他线程提交协程并等待结果
+
+        Args:
+            coro: 协程对象
+            timeout: 等待超时时间（秒）
+
+        Returns:
+            协程返回值
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout)
+
+    def call_soon(self, callback: Callable, *args):
+        """线程安全地在事件循环中执行回调"""
+        if self.in_loop_thread():
+            self.loop.call_soon(callback, *args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay: float, callback: Callable, *args):
+        """线程安全地在事件循环中延迟执行回调"""
+        if self.in_loop_thread():
+            self.loop.call_later(delay, callback, *args)
+        else:
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback, *args)
+
+    async def attach(self, client) -> bool:
+        """
+        为设备创建 UDP 端点
+
+        Args:
+            client: SIPClient 实例
+
+        Returns:
+            bool: 是否创建成功
+        """
+        if self.shared_endpoints:
+            # 共享端口模式：按设备序号轮询分配端口池中的端口
+            endpoint = self.shared_endpoints[len(self.clients) % len(self.shared_endpoints)]
+            client.local_port = endpoint.transport.get_extra_info("sockname")[1]
+            client.transport = endpoint.transport
+            self.dispatcher.add(client)
+            self.clients.append(client)
+            return True
+
+        try:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: DeviceProtocol(client),
+                local_addr=(client.local_ip, client.local_port)
+            )
+            client.local_port = transport.get_extra_info("sockname")[1]
+            self.clients.append(client)
+            return True
+        except OSError as e:
+            logger.error(f"Error binding UDP endpoint for device {client.device_id}: {e}")
+            return False
+
+    def detach(self, client):
+        """关闭设备的 UDP 端点"""
+        if client in self.clients:
+            self.clients.remove(client)
+        if self.shared_endpoints:
+            self.dispatcher.remove(client)
+            client.transport = None
+        elif client.transport:
+            self.call_soon(client.transport.close)
+
+
+def _raise_fd_limit():
+    """尽量提高文件描述符软限制，每个设备端点占用一个 socket"""
+    try:
+        import resource
+    except ImportError:
+        return
+
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            target = hard if hard != resource.RLIM_INFINITY else 1048576
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            logger.debug(f"Raised RLIMIT_NOFILE from {soft} to {target}")
+    except (ValueError, OSError) as e:
+        logger.debug(f"Could not raise RLIMIT_NOFILE: {e}")
@@ -0,0 +1,259 @@
+"""
+SIP 消息解析器
+直接在收到的 bytes 上定位起始行、所需头部和消息体，避免整包解码与逐行拆分
+"""
+import re
+from typing import Dict, Optional, Tuple
+
+# 头部全称与紧凑形式（RFC 3261 7.3.3）
+COMPACT_FORMS = {
+    "Via": "v",
+    "From": "f",
+    "To": "t",
+    "Call-ID": "i",
+    "Contact": "m",
+    "Content-Type": "c",
+    "Content-Length": "l",
+}
+
+# 紧凑形式 -> 全称
+_EXPANDED = {compact: name for name, compact in COMPACT_FORMS.items()}
+
+# 常见请求方法的字节串 -> 字符串，省去逐条解码
+_METHODS = {method.encode("ascii"): method for method in
+            ("REGISTER", "MESSAGE", "INVITE", "ACK", "BYE", "CANCEL", "INFO", "OPTIONS", "NOTIFY", "SUBSCRIBE")}
+
+_BRANCH_RE = re.compile(rb"branch=([^;,\s]+)")
+
+# 响应需要原样回填的头部行（RFC 3261 8.2.6.2）：全部 Via、From、To、Call-ID、CSeq，头部名不区分大小写、含紧凑形式；
+# 以 \n 定位行首（上一行的 \r 已被 ".*" 吃掉），"." 不匹配 \n，匹配结果为包含行尾 \r 的整行
+_ECHOED_RE = re.compile(rb"\n((?:via|v|from|f|to|t|call-id|i|cseq)[ \t]*:.*)", re.IGNORECASE)
+
+# 头部名 -> (头部名字节串, b"\r\nName:", 紧凑形式字节串或 None)
+_NEEDLES: Dict[str, Tuple[bytes, bytes, Optional[bytes]]] = {}
+
+
+def _needles(name: str) -> Tuple[bytes, bytes, Optional[bytes]]:
+    """获取（并缓存）头部名对应的查找字节串"""
+    needles = _NEEDLES.get(name)
+    if needles is None:
+        key = name.encode("ascii")
+        compact = COMPACT_FORMS.get(name)
+        needles = _NEEDLES[name] = (
+            key,
+            b"\r\n" + key + b":",
+            compact.encode("ascii") if compact else None,
+        )
+    return needles
+
+
+class SIPMessage:
+    """
+    已定位的 SIP 消息
+
+    构造时只扫描起始行和头部结束位置：响应通常只需要状态码和 Via branch，
+    头部在用到时才在原始数据中定位；请求的应答用 echoed_headers() 一次取出需要回填的头部行。
+    消息体通过 memoryview 按偏移引用原始数据，不做拷贝
+    """
+
+    __slots__ = ("data", "is_response", "status_code", "method",
+                 "_line_end", "_header_end", "_body_offset", "_body_length", "_headers")
+
+    def __init__(self, data: bytes, line_end: int, header_end: int, body_offset: int):
+        self.data = data
+        self._line_end = line_end
+        self._header_end = header_end
+        self._body_offset = body_offset
+        self._body_length = None
+        self._headers = None
+
+        if data[:8] == b"SIP/2.0 ":
+            # SIP/2.0 200 OK
+            self.is_response = True
+            code = data[8:11]
+            self.status_code = int(code) if code.isdigit() else 0
+            self.method = ""
+        else:
+            # MESSAGE sip:xxx SIP/2.0
+            self.is_response = False
+            self.status_code = 0
+            method = data[:data.find(b" ", 0, line_end)]
+            self.method = _METHODS.get(method) or method.decode("ascii", errors="ignore").upper()
+
+    @property
+    def request_uri(self) -> str:
+        """请求 URI（响应为空字符串）"""
+        if self.is_response:
+            return ""
+        parts = self.data[:self._line_end].split(b" ", 2)
+        return parts[1].decode("ascii", errors="ignore") if len(parts) > 1 else ""
+
+    def raw(self, name: str) -> Optional[bytes]:
+        """
+        获取头部原始值（首个同名头部）
+
+        Args:
+            name: 头部名，如 "Call-ID"
+
+        Returns:
+            bytes: 去除首尾空白的头部值，不存在时返回 None
+        """
+        try:
+            key, needle, compact = _NEEDLES[name]
+        except KeyError:
+            key, needle, compact = _needles(name)
+        data = self.data
+        # 快速路径：按规范大小写直接查找
+        start = data.find(needle, self._line_end, self._header_end)
+        if start == -1:
+            return self._raw_slow(key, compact)
+        start += len(needle)
+        end = data.find(b"\r\n", start)
+        return data[start:end if end != -1 else self._header_end].strip()
+
+    def _raw_slow(self, key: bytes, compact: Optional[bytes]) -> Optional[bytes]:
+        """逐行比较头部名（紧凑形式、大小写不规范或冒号前有空白），仅在快速路径未命中时使用"""
+        names = (key.lower(), compact) if compact else (key.lower(),)
+        data = self.data
+        pos = self._line_end + 2
+        while pos < self._header_end:
+            end = data.find(b"\r\n", pos, self._header_end)
+            if end == -1:
+                end = self._header_end
+            colon = data.find(b":", pos, end)
+            if colon != -1 and data[pos:colon].strip().lower() in names:
+                return data[colon + 1:end].strip()
+            pos = end + 2
+        return None
+
+    def get(self, name: str, default: str = "") -> str:
+        """
+        获取头部值（与头部字典的 get 用法一致）
+
+        Args:
+            name: 头部名
+            default: 不存在时的默认值
+
+        Returns:
+            str: 头部值
+        """
+        value = self.raw(name)
+        if value is None:
+            return default
+        return value.decode("utf-8", errors="ignore")
+
+    def headers(self) -> Dict[str, str]:
+        """
+        一次性解码全部头部，供需要回填多个头部的请求使用（不解码消息体）
+
+        Returns:
+            dict: 头部名 -> 值，紧凑形式展开为全称，同名头部保留第一个
+        """
+        if self._headers is not None:
+            return self._headers
+        block = self.data[self._line_end + 2:self._header_end].decode("utf-8", errors="ignore")
+        headers = {}
+        # 倒序写入，同名头部最终保留第一个（如顶层 Via）
+        for line in reversed(block.split("\r\n")):
+            name, _, value = line.partition(":")
+            name = name.strip()
+            headers[_EXPANDED.get(name, name)] = value.strip()
+        self._headers = headers
+        return headers
+
+    def echoed_headers(self) -> bytes:
+        """
+        应答需要原样回填的头部行：全部 Via（保持原顺序）、From、To、Call-ID、CSeq
+
+        Returns:
+            bytes: 原始头部行（不解码），每行以 \r\n 结尾，没有这些头部时为空
+        """
+        # 窗口包含最后一个头部行的 \r\n，每个匹配都以 \r 结尾，用 \n 连接即还原行尾
+        lines = _ECHOED_RE.findall(self.data, self._line_end + 1, self._header_end + 2)
+        if not lines:
+            return b""
+        if not lines[-1].endswith(b"\r"):
+            # 没有空行分隔、最后一行没有行尾
+            lines[-1] += b"\r"
+        return b"\n".join(lines) + b"\n"
+
+    @property
+    def call_id(self) -> str:
+        return self.get("Call-ID")
+
+    @property
+    def cseq(self) -> Tuple[int, str]:
+        """CSeq 头解析结果 (序号, 方法)，解析失败时返回 (0, "")"""
+        value = self.raw("CSeq")
+        parts = value.split() if value else ()
+        if len(parts) != 2 or not parts[0].isdigit():
+            return 0, ""
+        return int(parts[0]), parts[1].decode("ascii", errors="ignore").upper()
+
+    @property
+    def via_branch(self) -> str:
+        """首个 Via 头的 branch 参数"""
+        # branch 参数只出现在 Via 头中，头部区域内的第一个匹配即为顶层 Via 的 branch
+        match = _BRANCH_RE.search(self.data, self._line_end, self._header_end)
+        return match.group(1).decode("ascii", errors="ignore") if match else ""
+
+    @property
+    def content_length(self) -> int:
+        """消息体长度：以 Content-Length 为准（不超过数据报实际长度），缺失时取剩余全部数据"""
+        if self._body_length is None:
+            if self._body_offset < 0:
+                self._body_length = 0
+            else:
+                available = len(self.data) - self._body_offset
+                if self._headers is not None:
+                    value = self._headers.get("Content-Length", "")
+                else:
+                    value = self.raw("Content-Length") or b""
+                self._body_length = min(int(value), available) if value.isdigit() else available
+        return self._body_length
+
+    @property
+    def body(self) -> memoryview:
+        """消息体（原始数据的零拷贝视图）"""
+        if self._body_offset < 0:
+            return memoryview(b"")
+        return memoryview(self.data)[self._body_offset:self._body_offset + self.content_length]
+
+    def body_text(self) -> str:
+        """消息体解码为字符串（小消息体切片后解码比经由 memoryview 更快）"""
+        if self._body_offset < 0:
+            return ""
+        end = self._body_offset + self.content_length
+        return self.data[self._body_offset:end].decode("utf-8", errors="ignore")
+
+    def text(self) -> str:
+        """完整消息解码为字符串（仅用于日志）"""
+        return self.data.decode("utf-8", errors="ignore")
+
+
+def parse_message(data: bytes) -> Optional[SIPMessage]:
+    """
+    定位 SIP 消息的起始行、头部区域和消息体
+
+    Args:
+        data: 收到的原始数据报
+
+    Returns:
+        SIPMessage: 解析结果，不是合法 SIP 消息时返回 None
+    """
+    line_end = data.find(b"\r\n")
+    if line_end <= 0:
+        return None
+
+    header_end = data.find(b"\r\n\r\n", line_end)
+    if header_end == -1:
+        # 没有空行分隔：整个数据报都是头部
+        header_end = len(data)
+        body_offset = -1
+    else:
+        body_offset = header_end + 4
+
+    message = SIPMessage(data, line_end, header_end, body_offset)
+    if message.is_response and not 100 <= message.status_code <= 699:
+        return None
+    return message
@@ -0,0 +1,49 @@
+"""
+SIP 消息字节模板
+每个设备的请求中大部分头部固定不变，预先编码为字节模板，发送时只填入变化的字段
+"""
+import re
+from typing import Tuple, Union
+
+_SLOT_RE = re.compile(r"\{(\w+)(?::d)?\}")
+
+
+class SIPTemplate:
+    """
+    预编译的 SIP 消息模板
+
+    模板文本中的 {name} 为字节串槽位，{name:d} 为整数槽位，
+    其余内容在编译时编码为 bytes，渲染时用一次 bytes 格式化完成拼接，
+    不再逐行格式化、拼接和编码
+    """
+
+    __slots__ = ("slots", "_template")
+
+    def __init__(self, *lines: str):
+        """
+        编译模板
+
+        Args:
+            lines: 消息各行（不含行尾 CRLF），最后一行之后不追加 CRLF
+        """
+        text = "\r\n".join(lines).replace("%", "%%")
+        slots = []
+
+        def compile_slot(match) -> str:
+            slots.append(match.group(1))
+            return "%d" if match.group(0).endswith(":d}") else "%s"
+
+        self._template = _SLOT_RE.sub(compile_slot, text).encode("utf-8")
+        self.slots: Tuple[str, ...] = tuple(slots)
+
+    def render(self, *values: Union[bytes, int]) -> bytes:
+        """
+        按槽位顺序填入字段生成消息
+
+        Args:
+            values: 槽位值，顺序与 slots 一致；{name} 槽位为 bytes，{name:d} 槽位为 int
+
+        Returns:
+            bytes: 完整消息
+        """
+        return self._template % values
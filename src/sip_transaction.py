@@ -0,0 +1,110 @@
+"""
+SIP 客户端事务层
+按 Via branch / CSeq 将响应匹配到等待中的请求
+"""
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Dict, Tuple
+
+from sip_parser import SIPMessage
+
+logger = logging.getLogger(__name__)
+
+# RFC 3261 定时器：UDP 重传初始间隔 T1 与最大间隔 T2（秒）
+TIMER_T1 = 0.5
+TIMER_T2 = 4.0
+
+
+def retransmit_intervals(timeout: float):
+    """
+    生成 UDP 重传等待间隔（Timer E：从 T1 开始翻倍，最大 T2）
+
+    Args:
+        timeout: 事务总超时时间（秒）
+
+    Yields:
+        float: 下一次重传前的等待时间
+    """
+    interval = TIMER_T1
+    elapsed = 0.0
+    while elapsed < timeout:
+        wait = min(interval, timeout - elapsed)
+        yield wait
+        elapsed += wait
+        interval = min(interval * 2, TIMER_T2)
+
+
+class ClientTransactionLayer:
+    """客户端事务层：每个等待中的请求对应一个 Future，收到最终响应时完成"""
+
+    def __init__(self):
+        """初始化事务层"""
+        self._by_branch: Dict[str, Future] = {}
+        self._by_cseq: Dict[Tuple[int, str], Future] = {}
+        self._keys: Dict[str, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, branch: str, cseq: int, method: str) -> Future:
+        """
+        登记一个新的客户端事务
+
+        Args:
+            branch: Via branch
+            cseq: CSeq 序号
+            method: 请求方法
+
+        Returns:
+            Future: 最终响应到达时完成，结果为 SIPMessage
+        """
+        future = Future()
+        key = (cseq, method.upper())
+        with self._lock:
+            self._by_branch[branch] = future
+            self._by_cseq[key] = future
+            self._keys[branch] = key
+        return future
+
+    def end(self, branch: str):
+        """
+        结束事务（完成或超时后调用）
+
+        Args:
+            branch: Via branch
+        """
+        with self._lock:
+            future = self._by_branch.pop(branch, None)
+            key = self._keys.pop(branch, None)
+            if key is not None and self._by_cseq.get(key) is future:
+                del self._by_cseq[key]
+
+    def on_response(self, response: SIPMessage) -> bool:
+        """
+        将响应匹配到等待中的事务
+
+        Args:
+            response: SIP 响应
+
+        Returns:
+            bool: 是否匹配到事务
+        """
+        # 临时响应（1xx）不结束事务
+        if response.status_code < 200:
+            return False
+
+        branch = response.via_branch
+        with self._lock:
+            future = self._by_branch.get(branch) if branch else None
+            if future is None:
+                future = self._by_cseq.get(response.cseq)
+
+        if future is None or future.done():
+            return False
+
+        future.set_result(response)
+        return True
+
+    def pending_count(self) -> int:
+        """等待中的事务数量"""
+        with self._lock:
+            return len(self._by_branch)
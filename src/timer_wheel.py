@@ -0,0 +1,234 @@
+"""
+分层时间轮定时器
+所有设备的心跳、注册刷新、会话超时等定时任务共用一个调度线程
+"""
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认每层槽位数：第 0 层 256 个 tick，往上每层 64 个槽位
+DEFAULT_WHEEL_SIZES = (256, 64, 64, 64)
+
+
+class Timer:
+    """定时任务句柄"""
+
+    __slots__ = ("deadline", "expiry_tick", "callback", "args", "cancelled", "fired")
+
+    def __init__(self, deadline: float, expiry_tick: int, callback: Callable, args: tuple):
+        self.deadline = deadline
+        self.expiry_tick = expiry_tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.fired = False
+
+    @property
+    def active(self) -> bool:
+        """是否仍在等待触发"""
+        return not (self.cancelled or self.fired)
+
+
+class TimerWheel:
+    """
+    分层时间轮
+
+    第 0 层每个槽位对应一个 tick，第 i 层每个槽位覆盖第 i-1 层一整圈；
+    高层槽位到期时将定时任务降级到低层，插入和取消均为 O(1)
+    """
+
+    def __init__(self, tick: float = 0.02, wheel_sizes: tuple = DEFAULT_WHEEL_SIZES):
+        """
+        初始化时间轮
+
+        Args:
+            tick: 时间精度（秒）
+            wheel_sizes: 每层槽位数
+        """
+        self.tick = tick
+        self.sizes = tuple(wheel_sizes)
+        # 每层一个槽位覆盖的 tick 数
+        self.spans = [1]
+        for size in self.sizes[:-1]:
+            self.spans.append(self.spans[-1] * size)
+        self.max_ticks = self.spans[-1] * self.sizes[-1]
+
+        self.wheels: List[List[List[Timer]]] = [[[] for _ in range(size)] for size in self.sizes]
+        self.start_time = time.monotonic()
+        self.current_tick = 0
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        # 统计信息
+        self.pending = 0
+        self.fired = 0
+        self.late_total = 0.0
+        self.late_max = 0.0
+
+    def start(self):
+        """启动调度线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+        self._thread.start()
+        logger.info(f"Timer wheel started (tick={self.tick}s, range={self.max_ticks * self.tick:.0f}s)")
+
+    def stop(self):
+        """停止调度线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """
+        添加定时任务
+
+        Args:
+            delay: 延迟时间（秒）
+            callback: 回调函数（在时间轮线程中执行，不应阻塞）
+
+        Returns:
+            Timer: 定时任务句柄，可用于取消
+        """
+        deadline = time.monotonic() + max(0.0, delay)
+        expiry_tick = math.ceil((deadline - self.start_time) / self.tick)
+        timer = Timer(deadline, expiry_tick, callback, args)
+        with self._lock:
+            self._insert(timer)
+            self.pending += 1
+        return timer
+
+    def cancel(self, timer: Optional[Timer]):
+        """
+        取消定时任务（惰性删除，到期时跳过）
+
+        Args:
+            timer: 定时任务句柄
+        """
+        if timer is None:
+            return
+        with self._lock:
+            if timer.active:
+                timer.cancelled = True
+                self.pending -= 1
+
+    def _insert(self, timer: Timer):
+        """按剩余 tick 数将定时任务放入对应层的槽位（调用方持有锁）"""
+        delta = timer.expiry_tick - self.current_tick
+        if delta <= 0:
+            # 已到期的任务放到下一个 tick
+            timer.expiry_tick = self.current_tick + 1
+            delta = 1
+
+        expiry = timer.expiry_tick
+        if delta >= self.max_ticks:
+            # 超出时间轮范围：先放在最高层可达的最远槽位，降级时重新计算
+            expiry = self.current_tick + self.max_ticks - 1
+
+        for level in range(len(self.sizes) - 1, -1, -1):
+            if level == 0 or delta >= self.spans[level]:
+                slot = (expiry // self.spans[level]) % self.sizes[level]
+                self.wheels[level][slot].append(timer)
+                return
+
+    def _advance(self, tick: int) -> List[Timer]:
+        """推进到指定 tick，返回到期的定时任务（调用方持有锁）"""
+        self.current_tick = tick
+
+        # 自高向低降级所有在本 tick 对齐的层（先于扫描第 0 层）；
+        # 到期 tick 恰好落在层边界上的任务在降级时即已到期，直接触发，不再重新插入（否则会推迟到下一个 tick）
+        due = []
+        aligned = [level for level in range(1, len(self.sizes)) if tick % self.spans[level] == 0]
+        for level in reversed(aligned):
+            slot = (tick // self.spans[level]) % self.sizes[level]
+            timers, self.wheels[level][slot] = self.wheels[level][slot], []
+            for timer in timers:
+                if not timer.active:
+                    continue
+                if timer.expiry_tick > tick:
+                    self._insert(timer)
+                    continue
+                timer.fired = True
+                self.pending -= 1
+                due.append(timer)
+
+        slot = tick % self.sizes[0]
+        timers, self.wheels[0][slot] = self.wheels[0][slot], []
+        for timer in timers:
+            if not timer.active:
+                continue
+            if timer.expiry_tick > tick:
+                # 超出范围的任务尚未到期，重新放回
+                self._insert(timer)
+                continue
+            timer.fired = True
+            self.pending -= 1
+            due.append(timer)
+        return due
+
+    def _run(self):
+        """调度线程主循环"""
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            target_tick = int((now - self.start_time) / self.tick)
+
+            due = []
+            with self._lock:
+                while self.current_tick < target_tick:
+                    due.extend(self._advance(self.current_tick + 1))
+
+            for timer in due:
+                late = max(0.0, time.monotonic() - timer.deadline)
+                self.fired += 1
+                self.late_total += late
+                if late > self.late_max:
+                    self.late_max = late
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    logger.error(f"Error in timer callback: {e}", exc_info=True)
+
+            next_time = self.start_time + (self.current_tick + 1) * self.tick
+            self._stop_event.wait(max(0.0, next_time - time.monotonic()))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取调度统计
+
+        Returns:
+            dict: 等待中的任务数、已触发数和触发延迟
+        """
+        return {
+            "pending": self.pending,
+            "fired": self.fired,
+            "tick": self.tick,
+            "late_avg_ms": round(self.late_total / self.fired * 1000, 3) if self.fired else 0.0,
+            "late_max_ms": round(self.late_max * 1000, 3),
+        }
+
+
+_default_wheel = None
+_default_lock = threading.Lock()
+
+
+def get_default_wheel() -> TimerWheel:
+    """
+    获取进程级共享时间轮（首次使用时启动）
+
+    Returns:
+        TimerWheel: 共享时间轮
+    """
+    global _default_wheel
+    with _default_lock:
+        if _default_wheel is None:
+            _default_wheel = TimerWheel()
+            _default_wheel.start()
+        return _default_wheel
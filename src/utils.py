@@ -1,84 +1,24 @@
 """
 工具函数模块
 """
-import hashlib
 import random
-import string
-from typing import Optional
+from bisect import bisect_left
+from typing import Optional, List, Dict, Any, Iterable
 
 
 def generate_call_id() -> str:
-    """生成 SIP Call-ID"""
-    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
-    return random_str
+    """生成 SIP Call-ID（128 位随机数的十六进制）"""
+    return "%032x" % random.getrandbits(128)
 
 
 def generate_tag() -> str:
     """生成 SIP Tag"""
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+    return "%010x" % random.getrandbits(40)
 
 
 def generate_branch() -> str:
-    """生成 SIP Branch"""
-    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=20))
-    return f"z9hG4bK{random_str}"
-
-
-def calculate_digest_response(username: str, realm: str, password: str, 
-                               method: str, uri: str, nonce: str) -> str:
-    """
-    计算 Digest 认证响应
-    
-    Args:
-        username: 用户名
-        realm: 认证域
-        password: 密码
-        method: SIP 方法 (如 REGISTER)
-        uri: 请求 URI
-        nonce: 服务器 nonce
-        
-    Returns:
-        str: response 值
-    """
-    # HA1 = MD5(username:realm:password)
-    ha1 = hashlib.md5(f"{username}:{realm}:{password}".encode()).hexdigest()
-    
-    # HA2 = MD5(method:uri)
-    ha2 = hashlib.md5(f"{method}:{uri}".encode()).hexdigest()
-    
-    # response = MD5(HA1:nonce:HA2)
-    response = hashlib.md5(f"{ha1}:{nonce}:{ha2}".encode()).hexdigest()
-    
-    return response
-
-
-def parse_sip_auth_header(auth_header: str) -> dict:
-    """
-    解析 SIP WWW-Authenticate 或 Authorization 头
-    
-    Args:
-        auth_header: 认证头字符串
-        
-    Returns:
-        dict: 解析后的认证参数
-    """
-    result = {}
-    
-    # 移除 "Digest " 前缀
-    if auth_header.startswith("Digest "):
-        auth_header = auth_header[7:]
-    
-    # 解析参数
-    parts = auth_header.split(',')
-    for part in parts:
-        part = part.strip()
-        if '=' in part:
-            key, value = part.split('=', 1)
-            key = key.strip()
-            value = value.strip().strip('"')
-            result[key] = value
-    
-    return result
+    """生成 SIP Branch（RFC 3261 magic cookie 前缀 + 80 位随机数）"""
+    return "z9hG4bK%020x" % random.getrandbits(80)
 
 
 def format_sip_uri(user: str, host: str, port: Optional[int] = None) -> str:
@@ -98,6 +38,31 @@ def format_sip_uri(user: str, host: str, port: Optional[int] = None) -> str:
     return f"sip:{user}@{host}"
 
 
+def parse_port_list(spec: str) -> List[int]:
+    """
+    解析端口列表配置
+    
+    支持单个端口 "5060"、范围 "5060-5063" 以及逗号分隔的组合 "5060,5070-5071"
+    
+    Args:
+        spec: 端口配置字符串
+        
+    Returns:
+        list: 端口列表
+    """
+    ports = []
+    for part in (spec or "").split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            ports.extend(range(int(start), int(end) + 1))
+        else:
+            ports.append(int(part))
+    return ports
+
+
 def get_local_ip(fallback: str = "127.0.0.1") -> str:
     """
     获取本地 IP 地址
@@ -129,3 +94,86 @@ def get_local_ip(fallback: str = "127.0.0.1") -> str:
         except Exception:
             pass
         return fallback
+
+
+# 延迟直方图的桶上界（毫秒），最后一个桶为超过最大上界的部分
+LATENCY_BUCKETS_MS = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class LatencyHistogram:
+    """
+    固定分桶的延迟直方图
+    
+    只记录各桶计数、总和与最大值，多个进程的快照可以用 merge_latency 按桶合并
+    """
+    
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+    
+    def record(self, seconds: float):
+        """
+        记录一次延迟
+        
+        Args:
+            seconds: 延迟（秒）
+        """
+        ms = seconds * 1000
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取直方图快照
+        
+        Returns:
+            dict: 次数、平均值、最大值、按桶上界估计的 p50 / p90 / p99（毫秒）和各桶计数
+        """
+        return _summarize(self.counts, self.total_ms, self.max_ms)
+
+
+def merge_latency(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    合并多个延迟直方图快照
+    
+    Args:
+        snapshots: LatencyHistogram.snapshot() 的结果
+        
+    Returns:
+        dict: 合并后的快照
+    """
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    total_ms = max_ms = 0.0
+    for snapshot in snapshots:
+        for index, value in enumerate(snapshot["buckets"].values()):
+            counts[index] += value
+        total_ms += snapshot["mean_ms"] * snapshot["count"]
+        max_ms = max(max_ms, snapshot["max_ms"])
+    return _summarize(counts, total_ms, max_ms)
+
+
+def _summarize(counts: List[int], total_ms: float, max_ms: float) -> Dict[str, Any]:
+    count = sum(counts)
+    
+    def percentile(fraction: float) -> float:
+        rank, seen = fraction * count, 0
+        for index, value in enumerate(counts):
+            seen += value
+            if value and seen >= rank:
+                return float(LATENCY_BUCKETS_MS[index]) if index < len(LATENCY_BUCKETS_MS) else round(max_ms, 1)
+        return 0.0
+    
+    labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+    return {
+        "count": count,
+        "mean_ms": round(total_ms / count, 1) if count else 0.0,
+        "max_ms": round(max_ms, 1),
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "buckets": dict(zip(labels, counts)),
+    }
@@ -70,6 +70,10 @@ class WebInterface:
         def get_devices():
             """获取设备列表"""
             devices_info = []
+            supervisor = getattr(self.simulator, 'supervisor', None)
+            if supervisor:
+                # 多进程模式：由各工作进程上报的状态汇总
+                devices_info = supervisor.get_devices()
             for client in self.simulator.clients:
                 device_info = {
                     'device_id': client.device_id,
@@ -92,6 +96,9 @@ class WebInterface:
         @self.app.route('/api/device/<device_id>/unregister', methods=['POST'])
         def unregister_device(device_id):
             """注销设备"""
+            if self._dispatch_to_worker(device_id, 'unregister'):
+                return jsonify({'success': True, 'message': 'Unregister command sent to worker'})
+            
             client = self._find_client(device_id)
             if not client:
                 return jsonify({'success': False, 'error': 'Device not found'}), 404
@@ -106,6 +113,9 @@ class WebInterface:
         @self.app.route('/api/device/<device_id>/register', methods=['POST'])
         def register_device(device_id):
             """重新注册设备"""
+            if self._dispatch_to_worker(device_id, 'register'):
+                return jsonify({'success': True, 'message': 'Register command sent to worker'})
+            
             client = self._find_client(device_id)
             if not client:
                 return jsonify({'success': False, 'error': 'Device not found'}), 404
@@ -122,6 +132,9 @@ class WebInterface:
         @self.app.route('/api/device/<device_id>/keepalive', methods=['POST'])
         def send_keepalive(device_id):
             """发送心跳"""
+            if self._dispatch_to_worker(device_id, 'keepalive'):
+                return jsonify({'success': True, 'message': 'Keepalive command sent to worker'})
+            
             client = self._find_client(device_id)
             if not client:
                 return jsonify({'success': False, 'error': 'Device not found'}), 404
@@ -136,19 +149,72 @@ class WebInterface:
         @self.app.route('/api/stats')
         def get_stats():
             """获取统计信息"""
+            supervisor = getattr(self.simulator, 'supervisor', None)
+            if supervisor:
+                # 多进程模式：汇总各工作进程的统计
+                stats = supervisor.get_stats()
+                stats['running'] = self.simulator.running
+                return jsonify({'success': True, 'stats': stats})
+            
             total = len(self.simulator.clients)
             registered = sum(1 for client in self.simulator.clients if client.registered)
             
+            stats = {
+                'total_devices': total,
+                'registered_devices': registered,
+                'offline_devices': total - registered,
+                'running': self.simulator.running
+            }
+            
+            # 设备启动进度（启动期间实时更新，完成后保留汇总）
+            fleet_starter = getattr(self.simulator, 'fleet_starter', None)
+            if fleet_starter and fleet_starter.progress:
+                stats['startup'] = fleet_starter.progress.snapshot()
+            
+            # 共享时间轮状态（等待中的定时任务数、触发延迟）
+            timer_wheel = getattr(self.simulator, 'timer_wheel', None)
+            if timer_wheel:
+                stats['timers'] = timer_wheel.stats()
+            
+            # Catalog / DeviceInfo 查询响应缓存命中统计
+            stats['response_cache'] = self.simulator.get_response_cache_stats()
+            
+            # 媒体会话数、编码进程数（fanout 模式下多个会话共享一个编码进程）
+            media_server = getattr(self.simulator, 'media_server', None)
+            if media_server:
+                stats['media'] = media_server.get_stats()
+            
             return jsonify({
                 'success': True,
-                'stats': {
-                    'total_devices': total,
-                    'registered_devices': registered,
-                    'offline_devices': total - registered,
-                    'running': self.simulator.running
-                }
+                'stats': stats
             })
         
+        @self.app.route('/api/streams')
+        def get_streams():
+            """获取媒体会话（replay 模式含每个会话的发送抖动和迟发包数）"""
+            supervisor = getattr(self.simulator, 'supervisor', None)
+            if supervisor:
+                return jsonify({'success': True, 'streams': supervisor.get_streams()})
+            
+            media_server = getattr(self.simulator, 'media_server', None)
+            streams = media_server.get_active_streams() if media_server else {}
+            return jsonify({'success': True, 'streams': streams})
+        
+        @self.app.route('/api/streams/<call_id>/log')
+        def get_stream_log(call_id):
+            """获取会话的 FFmpeg 进程状态和最后几行 stderr"""
+            supervisor = getattr(self.simulator, 'supervisor', None)
+            if supervisor:
+                # 多进程模式：取工作进程最近一次上报的会话日志
+                stream = supervisor.get_streams().get(call_id) or {}
+                log = {'status': stream.get('status', ''), 'log': stream['log']} if 'log' in stream else None
+            else:
+                media_server = getattr(self.simulator, 'media_server', None)
+                log = media_server.get_stream_log(call_id) if media_server else None
+            if log is None:
+                return jsonify({'success': False, 'error': 'No FFmpeg process for this stream'}), 404
+            return jsonify({'success': True, 'call_id': call_id, **log})
+        
         @self.app.route('/api/config/devices', methods=['GET'])
         def get_device_configs():
             """获取设备配置列表"""
@@ -274,10 +340,20 @@ class WebInterface:
                 
                 logger.info(f"Device {device_id} configuration updated")
                 
+                # 运行中的设备立即按新配置应答查询（并使其响应缓存失效）
+                applied = self._dispatch_to_worker(device_id, 'update_config', device_data)
+                if not applied:
+                    client = self._find_client(device_id)
+                    if client:
+                        client.update_device_config(device_data)
+                        applied = True
+                
                 return jsonify({
                     'success': True,
                     'message': 'Device configuration updated successfully',
-                    'note': 'Restart simulator to apply changes'
+                    'applied': applied,
+                    'note': 'Query responses use the new configuration immediately; '
+                            'restart simulator to apply SIP registration changes'
                 })
                 
             except Exception as e:
@@ -325,6 +401,11 @@ class WebInterface:
                 logger.error(f"Error deleting device config: {e}", exc_info=True)
                 return jsonify({'success': False, 'error': str(e)}), 500
     
+    def _dispatch_to_worker(self, device_id: str, action: str, config: Dict[str, Any] = None) -> bool:
+        """多进程模式下将设备操作转发给所在的工作进程"""
+        supervisor = getattr(self.simulator, 'supervisor', None)
+        return bool(supervisor) and supervisor.send_command(device_id, action, config)
+    
     def _find_client(self, device_id: str):
         """查找客户端"""
         for client in self.simulator.clients:
@@ -0,0 +1,358 @@
+"""
+多进程设备分片
+将设备列表分配到多个工作进程，父进程负责监控、崩溃重启和统计汇总
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+from utils import merge_latency
+
+logger = logging.getLogger(__name__)
+
+# 工作进程上报统计的间隔（秒）
+STATS_INTERVAL = 2.0
+# 崩溃重启的最大退避时间（秒）
+MAX_RESTART_BACKOFF = 30.0
+
+
+class WorkerHandle:
+    """父进程中的工作进程记录"""
+
+    def __init__(self, index: int, devices: List[Dict[str, Any]]):
+        """
+        初始化工作进程记录
+
+        Args:
+            index: 工作进程序号
+            devices: 分配给该进程的设备配置
+        """
+        self.index = index
+        self.devices = devices
+        self.process: Optional[multiprocessing.Process] = None
+        self.command_queue = None
+        self.restarts = 0
+        self.started_at = 0.0
+        self.next_restart = 0.0
+        # 最近一次上报的统计
+        self.registered: Dict[str, bool] = {}
+        self.stats: Dict[str, Any] = {}
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class WorkerSupervisor:
+    """工作进程监控器"""
+
+    def __init__(self, devices: List[Dict[str, Any]], num_workers: int):
+        """
+        初始化监控器
+
+        Args:
+            devices: 全部设备配置
+            num_workers: 工作进程数量
+        """
+        # 使用 spawn 启动，避免在已有线程（Web 界面等）的父进程中 fork
+        self.ctx = multiprocessing.get_context("spawn")
+        self.workers = [
+            WorkerHandle(index, devices[index::num_workers])
+            for index in range(num_workers)
+        ]
+        self.stats_queue = self.ctx.Queue()
+        self.stop_event = self.ctx.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stopping = False
+
+        logger.info(f"WorkerSupervisor initialized: {len(devices)} device(s) across {num_workers} worker(s)")
+
+    def start(self):
+        """启动所有工作进程和监控线程"""
+        for worker in self.workers:
+            self._spawn(worker)
+
+        self._thread = threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 15.0):
+        """
+        通知所有工作进程退出（注销设备），超时后强制终止
+
+        Args:
+            timeout: 等待退出的时间（秒）
+        """
+        # 与监控线程的重启互斥：此后不再重启，并取消退避中的重启
+        with self._lock:
+            self.stopping = True
+            for worker in self.workers:
+                worker.next_restart = 0.0
+        self.stop_event.set()
+
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    logger.warning(f"Worker {worker.index} did not exit in time, terminating")
+                    worker.process.terminate()
+                    worker.process.join(2)
+
+        logger.info("All workers stopped")
+
+    def _spawn(self, worker: WorkerHandle):
+        """启动（或重启）工作进程"""
+        worker.command_queue = self.ctx.Queue()
+        worker.process = self.ctx.Process(
+            target=worker_main,
+            args=(worker.index, worker.devices, self.stop_event, self.stats_queue, worker.command_queue),
+            name=f"gb28181-worker-{worker.index}",
+            daemon=True
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logger.info(f"Worker {worker.index} started (pid={worker.process.pid}, devices={len(worker.devices)})")
+
+    def _supervise(self):
+        """监控循环：收集统计并重启崩溃的工作进程"""
+        while not self.stopping:
+            self._drain_stats(timeout=1.0)
+
+            for worker in self.workers:
+                if self.stopping or worker.process is None or worker.process.is_alive():
+                    continue
+
+                now = time.monotonic()
+                if worker.next_restart == 0.0:
+                    # 刚发现退出：进程运行时间较短时指数退避，避免崩溃循环
+                    backoff = 0.0 if now - worker.started_at > MAX_RESTART_BACKOFF else \
+                        min(MAX_RESTART_BACKOFF, 2.0 ** min(worker.restarts, 5))
+                    worker.next_restart = now + backoff
+                    logger.error(f"Worker {worker.index} exited with code {worker.process.exitcode}, "
+                                 f"restarting in {backoff:.0f}s")
+                    with self._lock:
+                        worker.registered = {}
+
+                if now >= worker.next_restart:
+                    with self._lock:
+                        # 退避期间可能已开始停止
+                        if self.stopping:
+                            break
+                        worker.restarts += 1
+                        worker.next_restart = 0.0
+                        self._spawn(worker)
+
+    def _drain_stats(self, timeout: float):
+        """读取工作进程上报的统计"""
+        try:
+            report = self.stats_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+        while True:
+            worker = self.workers[report["worker"]]
+            with self._lock:
+                worker.registered = report["registered"]
+                worker.stats = report["stats"]
+            try:
+                report = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def find_worker(self, device_id: str) -> Optional[WorkerHandle]:
+        """查找设备所在的工作进程"""
+        for worker in self.workers:
+            if any(device.get("device_id") == device_id for device in worker.devices):
+                return worker
+        return None
+
+    def send_command(self, device_id: str, action: str, config: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        向设备所在的工作进程发送控制命令
+
+        Args:
+            device_id: 设备ID
+            action: 命令 (register/unregister/keepalive/update_config)
+            config: update_config 命令携带的新设备配置
+
+        Returns:
+            bool: 是否找到设备并成功投递
+        """
+        worker = self.find_worker(device_id)
+        if worker is None or not worker.alive:
+            return False
+        if action == "update_config":
+            # 同步更新父进程保存的配置，工作进程重启后沿用新配置
+            with self._lock:
+                worker.devices = [config if device.get("device_id") == device_id else device
+                                  for device in worker.devices]
+        worker.command_queue.put({"device_id": device_id, "action": action, "config": config})
+        return True
+
+    def get_devices(self) -> List[Dict[str, Any]]:
+        """
+        汇总所有工作进程的设备状态
+
+        Returns:
+            list: 设备信息列表
+        """
+        devices = []
+        with self._lock:
+            for worker in self.workers:
+                for device in worker.devices:
+                    if device.get("device_id") not in worker.registered:
+                        # 尚未启动或启动失败的设备不列出，与单进程模式一致
+                        continue
+                    registered = worker.registered[device.get("device_id")]
+                    devices.append({
+                        'device_id': device.get('device_id'),
+                        'name': device.get('name', 'Unknown'),
+                        'device_type': device.get('device_type', 'IPC'),
+                        'registered': registered,
+                        'status': 'online' if registered else 'offline',
+                        'manufacturer': device.get('manufacturer', 'SimCamera'),
+                        'model': device.get('model', 'SC-2000'),
+                        'channels': len(device.get('channels', [])),
+                        'worker': worker.index
+                    })
+        return devices
+
+    def get_streams(self) -> Dict[str, Dict[str, Any]]:
+        """
+        汇总所有工作进程的媒体会话（最近一次上报）
+
+        Returns:
+            dict: call_id -> 会话信息（含所在工作进程序号）
+        """
+        streams = {}
+        with self._lock:
+            for worker in self.workers:
+                for call_id, info in worker.stats.get("streams", {}).items():
+                    streams[call_id] = dict(info, worker=worker.index)
+        return streams
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        汇总所有工作进程的统计
+
+        Returns:
+            dict: 设备数、启动进度、时间轮状态和每个工作进程的状态
+        """
+        with self._lock:
+            total = sum(len(worker.registered) for worker in self.workers)
+            registered = sum(sum(1 for ok in worker.registered.values() if ok) for worker in self.workers)
+
+            startup = {"total": 0, "dispatched": 0, "in_flight": 0, "registered": 0, "failed": 0,
+                       "finished": True, "elapsed": 0.0}
+            timers = {"pending": 0, "fired": 0, "late_max_ms": 0.0}
+            response_cache = {"hits": 0, "misses": 0, "entries": 0}
+            media = {"streams": 0, "encoders": 0, "process_exits": 0, "encoders_behind": 0, "behind_alerts": 0,
+                     "packets_relayed": 0, "packets_sent": 0, "gop_bursts": 0,
+                     "late_packets": 0, "jitter_max_ms": 0.0, "tcp_connections": 0, "tcp_dropped": 0}
+            # 编码器来源 -> 各工作进程的首包延迟直方图
+            first_packet: Dict[str, List[Dict[str, Any]]] = {}
+            workers = []
+            for worker in self.workers:
+                progress = worker.stats.get("startup")
+                if progress:
+                    for key in ("total", "dispatched", "in_flight", "registered", "failed"):
+                        startup[key] += progress[key]
+                    startup["finished"] = startup["finished"] and progress["finished"]
+                    startup["elapsed"] = max(startup["elapsed"], progress["elapsed"])
+                else:
+                    startup["finished"] = False
+                wheel = worker.stats.get("timers")
+                if wheel:
+                    timers["pending"] += wheel["pending"]
+                    timers["fired"] += wheel["fired"]
+                    timers["late_max_ms"] = max(timers["late_max_ms"], wheel["late_max_ms"])
+                cache = worker.stats.get("response_cache")
+                if cache:
+                    for key in response_cache:
+                        response_cache[key] += cache[key]
+                streams = worker.stats.get("media")
+                if streams:
+                    for key in ("streams", "encoders", "process_exits", "encoders_behind", "behind_alerts",
+                                "packets_relayed", "packets_sent", "gop_bursts", "late_packets",
+                                "tcp_connections", "tcp_dropped"):
+                        media[key] += streams[key]
+                    media["jitter_max_ms"] = max(media["jitter_max_ms"], streams["jitter_max_ms"])
+                    for key in ("warm_idle", "warm_hits", "warm_misses"):
+                        if key in streams:
+                            media[key] = media.get(key, 0) + streams[key]
+                    for source, histogram in streams.get("first_packet_ms", {}).items():
+                        first_packet.setdefault(source, []).append(histogram)
+                workers.append({
+                    "index": worker.index,
+                    "pid": worker.process.pid if worker.process else None,
+                    "alive": worker.alive,
+                    "restarts": worker.restarts,
+                    "devices": len(worker.devices),
+                    "registered": sum(1 for ok in worker.registered.values() if ok),
+                })
+
+        if first_packet:
+            media["first_packet_ms"] = {source: merge_latency(histograms) for source, histograms in first_packet.items()}
+        startup["time_to_all_registered"] = (
+            startup["elapsed"] if startup["finished"] and startup["registered"] == startup["total"] else None
+        )
+        return {
+            'total_devices': total,
+            'registered_devices': registered,
+            'offline_devices': total - registered,
+            'startup': startup,
+            'timers': timers,
+            'response_cache': response_cache,
+            'media': media,
+            'workers': workers,
+        }
+
+
+def worker_main(index: int, devices: List[Dict[str, Any]], stop_event, stats_queue, command_queue):
+    """
+    工作进程入口：运行分配到的设备并定期上报统计
+
+    Args:
+        index: 工作进程序号
+        devices: 分配给该进程的设备配置
+        stop_event: 父进程的退出通知
+        stats_queue: 统计上报队列
+        command_queue: 控制命令队列
+    """
+    # Ctrl+C 由父进程统一处理；收到 SIGTERM 时仅本进程正常退出以注销设备
+    terminated = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.set())
+
+    from main import GB28181Simulator
+
+    simulator = GB28181Simulator(devices=devices, worker_index=index)
+    simulator.start_runtime()
+
+    def should_stop() -> bool:
+        return stop_event.is_set() or terminated.is_set() or os.getppid() != parent_pid
+
+    parent_pid = os.getppid()
+    try:
+        while not should_stop():
+            stats_queue.put({
+                "worker": index,
+                "registered": {client.device_id: client.registered for client in simulator.clients},
+                "stats": simulator.get_runtime_stats(),
+            })
+
+            deadline = time.monotonic() + STATS_INTERVAL
+            while not should_stop() and time.monotonic() < deadline:
+                try:
+                    command = command_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                simulator.execute_command(command.get("device_id"), command.get("action"), command.get("config"))
+    finally:
+        simulator.stop()
@@ -2,34 +2,134 @@
 GB28181 XML 消息构建器
 用于构建各种 GB28181 协议要求的 XML 消息
 """
+import re
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Union
 import xml.etree.ElementTree as ET
 
 
+# XML 声明（与原 ElementTree 路径输出一致）
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+# 预渲染时 SN 的占位值（不会出现在转义后的正常内容中）
+SN_SLOT = "\x00"
+# 按字节预算分片时为 SN 预留的长度
+SN_RESERVE = 20
+
+
+def escape_text(text: str) -> str:
+    """
+    按 ElementTree 的规则转义文本节点（& < >）
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        str: 转义后的文本
+    """
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def element(tag: str, text: Any) -> str:
+    """
+    渲染只含文本的元素，空文本与 ElementTree 一样输出为 <Tag />
+
+    Args:
+        tag: 元素名
+        text: 文本内容
+
+    Returns:
+        str: 元素字符串
+    """
+    if not text:
+        return f"<{tag} />"
+    return f"<{tag}>{escape_text(str(text))}</{tag}>"
+
+
+def timestamp_sn() -> str:
+    """以当前毫秒时间戳作为主动上报消息的 SN"""
+    return str(int(datetime.now().timestamp() * 1000))
+
+
+class PrerenderedXML:
+    """
+    除 SN 外内容固定的 XML 文档
+
+    预先渲染为 SN 元素前后两段，每次只拼接 SN 元素
+    """
+
+    __slots__ = ("_head", "_tail")
+
+    def __init__(self, document: str):
+        """
+        Args:
+            document: 以 SN_SLOT 作为 SN 渲染出的完整文档
+        """
+        self._head, _, self._tail = document.partition(element("SN", SN_SLOT))
+
+    def render(self, sn: str) -> str:
+        """
+        填入 SN 生成完整文档
+
+        Args:
+            sn: 命令序列号
+
+        Returns:
+            str: XML 字符串
+        """
+        return self._head + element("SN", sn) + self._tail
+
+
 class XMLBuilder:
-    """GB28181 XML 消息构建器"""
+    """
+    GB28181 XML 消息构建器
+
+    心跳、目录、设备信息和设备状态这几类高频消息结构固定，直接按字符串模板渲染
+    （转义规则与 ElementTree 相同，输出逐字节一致，见 scripts/bench_xml_builder.py），
+    其余低频消息仍使用 ElementTree 构建
+    """
     
     @staticmethod
-    def build_keepalive(device_id: str, status: str = "OK") -> str:
+    def build_keepalive(device_id: str, status: str = "OK", sn: str = None) -> str:
         """
         构建心跳消息
         
         Args:
             device_id: 设备ID
             status: 设备状态 (OK/ERROR)
+            sn: 命令序列号，默认使用当前毫秒时间戳
             
         Returns:
             str: XML 字符串
         """
-        root = ET.Element("Notify")
-        
-        ET.SubElement(root, "CmdType").text = "Keepalive"
-        ET.SubElement(root, "SN").text = str(int(datetime.now().timestamp() * 1000))
-        ET.SubElement(root, "DeviceID").text = device_id
-        ET.SubElement(root, "Status").text = status
+        return (
+            XML_DECLARATION
+            + "<Notify><CmdType>Keepalive</CmdType>"
+            + element("SN", timestamp_sn() if sn is None else sn)
+            + element("DeviceID", device_id)
+            + element("Status", status)
+            + "</Notify>"
+        )
+    
+    @staticmethod
+    def prerender_keepalive(device_id: str, status: str = "OK") -> PrerenderedXML:
+        """
+        预渲染设备的心跳消息，发送时只填入 SN
         
-        return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+        Args:
+            device_id: 设备ID
+            status: 设备状态 (OK/ERROR)
+            
+        Returns:
+            PrerenderedXML: 预渲染文档
+        """
+        return PrerenderedXML(XMLBuilder.build_keepalive(device_id, status, sn=SN_SLOT))
     
     @staticmethod
     def build_catalog_response(device_id: str, sn: str, channels: List[Dict[str, Any]]) -> str:
@@ -44,33 +144,84 @@ class XMLBuilder:
         Returns:
             str: XML 字符串
         """
-        root = ET.Element("Response")
+        items = XMLBuilder._catalog_items(device_id, channels)
+        return XMLBuilder._catalog_document(device_id, sn, len(channels), items)
+    
+    @staticmethod
+    def build_catalog_parts(device_id: str, sn: str, channels: List[Dict[str, Any]],
+                            max_body_bytes: Optional[int] = None) -> List[str]:
+        """
+        构建分片的目录查询响应，每片消息体不超过字节预算
         
-        ET.SubElement(root, "CmdType").text = "Catalog"
-        ET.SubElement(root, "SN").text = sn
-        ET.SubElement(root, "DeviceID").text = device_id
-        ET.SubElement(root, "SumNum").text = str(len(channels))
-        
-        device_list = ET.SubElement(root, "DeviceList")
-        device_list.set("Num", str(len(channels)))
-        
-        for channel in channels:
-            item = ET.SubElement(device_list, "Item")
-            ET.SubElement(item, "DeviceID").text = channel.get("channel_id", "")
-            ET.SubElement(item, "Name").text = channel.get("name", "Camera")
-            ET.SubElement(item, "Manufacturer").text = channel.get("manufacturer", "SimCamera")
-            ET.SubElement(item, "Model").text = channel.get("model", "SC-2000")
-            ET.SubElement(item, "Owner").text = "Owner"
-            ET.SubElement(item, "CivilCode").text = device_id[:9]
-            ET.SubElement(item, "Address").text = "Address"
-            ET.SubElement(item, "Parental").text = "0"
-            ET.SubElement(item, "ParentID").text = device_id
-            ET.SubElement(item, "SafetyWay").text = "0"
-            ET.SubElement(item, "RegisterWay").text = "1"
-            ET.SubElement(item, "Secrecy").text = "0"
-            ET.SubElement(item, "Status").text = "ON"
+        各分片的 SumNum 均为通道总数，DeviceList 的 Num 为本片通道数；
+        单个通道超出预算时独占一片
         
-        return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+        Args:
+            device_id: 设备ID
+            sn: 命令序列号
+            channels: 通道列表
+            max_body_bytes: 每片消息体的字节预算（UTF-8），为 None 时不分片
+            
+        Returns:
+            list: 各分片的 XML 字符串
+        """
+        total = len(channels)
+        items = XMLBuilder._catalog_items(device_id, channels)
+        if max_body_bytes is None or not items:
+            return [XMLBuilder._catalog_document(device_id, sn, total, items)]
+        
+        # 外层结构按最长的 Num 计算（以单个空 Item 渲染得到 Num="1"，再补足 total 的位数），
+        # 并为 SN 预留长度（缓存时以占位符渲染）
+        envelope = (len(XMLBuilder._catalog_document(device_id, "", total, [""]).encode("utf-8"))
+                    + len(str(total)) - 1 + SN_RESERVE)
+        budget = max_body_bytes - envelope
+        
+        parts = []
+        part, size = [], 0
+        for item in items:
+            item_size = len(item.encode("utf-8"))
+            if part and size + item_size > budget:
+                parts.append(XMLBuilder._catalog_document(device_id, sn, total, part))
+                part, size = [], 0
+            part.append(item)
+            size += item_size
+        parts.append(XMLBuilder._catalog_document(device_id, sn, total, part))
+        return parts
+    
+    @staticmethod
+    def _catalog_items(device_id: str, channels: List[Dict[str, Any]]) -> List[str]:
+        """渲染目录响应中每个通道的 Item 元素"""
+        # 每个通道相同的字段只渲染一次
+        common = (
+            "<Owner>Owner</Owner>"
+            + element("CivilCode", device_id[:9])
+            + "<Address>Address</Address><Parental>0</Parental>"
+            + element("ParentID", device_id)
+            + "<SafetyWay>0</SafetyWay><RegisterWay>1</RegisterWay><Secrecy>0</Secrecy><Status>ON</Status></Item>"
+        )
+        return [
+            "<Item>"
+            + element("DeviceID", channel.get("channel_id", ""))
+            + element("Name", channel.get("name", "Camera"))
+            + element("Manufacturer", channel.get("manufacturer", "SimCamera"))
+            + element("Model", channel.get("model", "SC-2000"))
+            + common
+            for channel in channels
+        ]
+    
+    @staticmethod
+    def _catalog_document(device_id: str, sn: str, sum_num: int, items: List[str]) -> str:
+        """将 Item 元素组装为完整的目录响应文档"""
+        head = (
+            XML_DECLARATION
+            + "<Response><CmdType>Catalog</CmdType>"
+            + element("SN", sn)
+            + element("DeviceID", device_id)
+            + f"<SumNum>{sum_num}</SumNum>"
+        )
+        if not items:
+            return head + '<DeviceList Num="0" /></Response>'
+        return head + f'<DeviceList Num="{len(items)}">' + "".join(items) + "</DeviceList></Response>"
     
     @staticmethod
     def build_device_info_response(device_id: str, sn: str, device_info: Dict[str, Any]) -> str:
@@ -85,18 +236,18 @@ class XMLBuilder:
         Returns:
             str: XML 字符串
         """
-        root = ET.Element("Response")
-        
-        ET.SubElement(root, "CmdType").text = "DeviceInfo"
-        ET.SubElement(root, "SN").text = sn
-        ET.SubElement(root, "DeviceID").text = device_id
-        ET.SubElement(root, "DeviceName").text = device_info.get("name", "SimCamera")
-        ET.SubElement(root, "Manufacturer").text = device_info.get("manufacturer", "SimCamera")
-        ET.SubElement(root, "Model").text = device_info.get("model", "SC-2000")
-        ET.SubElement(root, "Firmware").text = device_info.get("firmware", "V1.0.0")
-        ET.SubElement(root, "Channel").text = str(device_info.get("channel_count", 1))
-        
-        return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+        return (
+            XML_DECLARATION
+            + "<Response><CmdType>DeviceInfo</CmdType>"
+            + element("SN", sn)
+            + element("DeviceID", device_id)
+            + element("DeviceName", device_info.get("name", "SimCamera"))
+            + element("Manufacturer", device_info.get("manufacturer", "SimCamera"))
+            + element("Model", device_info.get("model", "SC-2000"))
+            + element("Firmware", device_info.get("firmware", "V1.0.0"))
+            + element("Channel", str(device_info.get("channel_count", 1)))
+            + "</Response>"
+        )
     
     @staticmethod
     def build_device_status_response(device_id: str, sn: str, status: str = "ON") -> str:
@@ -111,18 +262,30 @@ class XMLBuilder:
         Returns:
             str: XML 字符串
         """
-        root = ET.Element("Response")
-        
-        ET.SubElement(root, "CmdType").text = "DeviceStatus"
-        ET.SubElement(root, "SN").text = sn
-        ET.SubElement(root, "DeviceID").text = device_id
-        ET.SubElement(root, "Result").text = "OK"
-        ET.SubElement(root, "Online").text = "ONLINE" if status == "ON" else "OFFLINE"
-        ET.SubElement(root, "Status").text = status
-        ET.SubElement(root, "Encode").text = "ON"
-        ET.SubElement(root, "Record").text = "OFF"
+        return (
+            XML_DECLARATION
+            + "<Response><CmdType>DeviceStatus</CmdType>"
+            + element("SN", sn)
+            + element("DeviceID", device_id)
+            + "<Result>OK</Result>"
+            + ("<Online>ONLINE</Online>" if status == "ON" else "<Online>OFFLINE</Online>")
+            + element("Status", status)
+            + "<Encode>ON</Encode><Record>OFF</Record></Response>"
+        )
+    
+    @staticmethod
+    def prerender_device_status(device_id: str, status: str = "ON") -> PrerenderedXML:
+        """
+        预渲染设备的状态查询响应，应答时只填入 SN
         
-        return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
+        Args:
+            device_id: 设备ID
+            status: 设备状态 (ON/OFF)
+            
+        Returns:
+            PrerenderedXML: 预渲染文档
+        """
+        return PrerenderedXML(XMLBuilder.build_device_status_response(device_id, SN_SLOT, status))
     
     @staticmethod
     def build_device_control_response(device_id: str, sn: str, result: str = "OK") -> str:
@@ -187,6 +350,86 @@ class XMLBuilder:
         
         return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
     
+    @staticmethod
+    def build_record_info_parts(device_id: str, sn: str, sum_num: int, records: Iterable[Dict[str, Any]],
+                                max_body_bytes: Optional[int] = None) -> Iterator[str]:
+        """
+        逐片构建录像文件查询响应，记录按需从迭代器中读取，不整体生成
+        
+        各分片的 SumNum 均为录像总数，RecordList 的 Num 为本片录像数；
+        单片输出与 build_record_info_response 一致（没有录像时不含 RecordList）
+        
+        Args:
+            device_id: 设备ID
+            sn: 命令序列号
+            sum_num: 录像总数
+            records: 录像文件迭代器
+            max_body_bytes: 每片消息体的字节预算（UTF-8），为 None 时不分片
+            
+        Yields:
+            str: 各分片的 XML 字符串
+        """
+        head = (
+            XML_DECLARATION
+            + "<Response><CmdType>RecordInfo</CmdType>"
+            + element("SN", sn)
+            + element("DeviceID", device_id)
+            + f"<Name>RecordInfo</Name><SumNum>{sum_num}</SumNum>"
+        )
+        recorder = element("RecorderID", device_id)
+        # 外层结构按最长的 Num 计算
+        envelope = len(f'{head}<RecordList Num="{sum_num}"></RecordList></Response>'.encode("utf-8"))
+        budget = None if max_body_bytes is None else max_body_bytes - envelope
+        
+        part, size = [], 0
+        for record in records:
+            item = (
+                "<Item>"
+                + element("DeviceID", record.get("device_id", device_id))
+                + element("Name", record.get("name", "Record"))
+                + element("FilePath", record.get("file_path", ""))
+                + "<Address>Address</Address>"
+                + element("StartTime", record.get("start_time", ""))
+                + element("EndTime", record.get("end_time", ""))
+                + element("Secrecy", record.get("secrecy", "0"))
+                + element("Type", record.get("type", "time"))
+                + recorder
+                + element("FileSize", record.get("file_size", "0"))
+                + "</Item>"
+            )
+            item_size = len(item.encode("utf-8")) if budget is not None else 0
+            if part and budget is not None and size + item_size > budget:
+                yield f'{head}<RecordList Num="{len(part)}">{"".join(part)}</RecordList></Response>'
+                part, size = [], 0
+            part.append(item)
+            size += item_size
+        
+        if part:
+            yield f'{head}<RecordList Num="{len(part)}">{"".join(part)}</RecordList></Response>'
+        elif sum_num == 0:
+            yield head + "</Response>"
+    
+    @staticmethod
+    def build_media_status(device_id: str, notify_type: str = "121") -> str:
+        """
+        构建媒体通知消息（录像回放、下载发送完毕）
+        
+        Args:
+            device_id: 通道ID（INVITE SDP 的 u= 行）
+            notify_type: 通知类型，121 表示文件发送结束
+            
+        Returns:
+            str: XML 字符串
+        """
+        return (
+            XML_DECLARATION
+            + "<Notify><CmdType>MediaStatus</CmdType>"
+            + element("SN", timestamp_sn())
+            + element("DeviceID", device_id)
+            + element("NotifyType", notify_type)
+            + "</Notify>"
+        )
+    
     @staticmethod
     def build_alarm_notification(device_id: str, alarm_info: Dict[str, Any]) -> str:
         """
@@ -202,7 +445,7 @@ class XMLBuilder:
         root = ET.Element("Notify")
         
         ET.SubElement(root, "CmdType").text = "Alarm"
-        ET.SubElement(root, "SN").text = str(int(datetime.now().timestamp() * 1000))
+        ET.SubElement(root, "SN").text = timestamp_sn()
         ET.SubElement(root, "DeviceID").text = device_id
         ET.SubElement(root, "AlarmPriority").text = str(alarm_info.get("alarm_priority", 3))
         ET.SubElement(root, "AlarmMethod").text = alarm_info.get("alarm_method", "1")
@@ -255,3 +498,58 @@ def parse_xml_message(xml_str: str) -> Dict[str, Any]:
         
     except Exception as e:
         return {"error": f"XML parse error: {str(e)}", "raw": xml_str}
+
+
+# 处理器需要的查询字段
+QUERY_FIELDS = ("CmdType", "SN", "DeviceID", "PTZCmd", "StartTime", "EndTime")
+
+# 只含纯文本（无实体、无嵌套）的字段元素
+_FIELD_RE = re.compile(rb"<(" + b"|".join(name.encode() for name in QUERY_FIELDS) + rb")>([^<&]*)</\1>")
+# 根元素名（跳过 XML 声明）
+_ROOT_RE = re.compile(rb"<([A-Za-z_][\w.-]*)")
+_FIELD_OPENERS = tuple((name, b"<" + name.encode()) for name in QUERY_FIELDS)
+
+
+def parse_manscdp(data: Union[bytes, memoryview, str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    解析收到的 MANSCDP 查询/控制消息
+
+    只在原始字节中提取处理器需要的字段（QUERY_FIELDS），不构建元素树；
+    含注释、CDATA、命名空间、实体或字段带属性等非常规文档时回退到 parse_xml_message。
+    结果与 parse_xml_message 的字典格式一致（空元素的值为 None），可直接传给各处理器
+
+    Args:
+        data: 消息体（bytes/memoryview/str），或已解析的结果（原样返回）
+
+    Returns:
+        dict: 根元素名和查询字段
+    """
+    if isinstance(data, dict):
+        return data
+    if isinstance(data, str):
+        raw = data.encode("utf-8")
+    else:
+        # memoryview 不支持子串查找，消息体较小，拷贝一次
+        raw = bytes(data)
+
+    root = _ROOT_RE.search(raw)
+    if root is None or b"<!" in raw or raw[root.end():root.end() + 1] == b":":
+        return _parse_fallback(raw)
+
+    result = {"root_tag": root.group(1).decode("ascii")}
+    for match in _FIELD_RE.finditer(raw, root.end()):
+        name = match.group(1).decode("ascii")
+        if name not in result:
+            # 顶层字段在嵌套内容之前出现，保留第一个
+            result[name] = match.group(2).decode("utf-8", errors="ignore") or None
+
+    # 字段存在但未按纯文本形式匹配（<SN/>、带属性、含实体等）
+    for name, opener in _FIELD_OPENERS:
+        if name not in result and opener in raw:
+            return _parse_fallback(raw)
+    return result
+
+
+def _parse_fallback(raw: bytes) -> Dict[str, Any]:
+    """使用 ElementTree 完整解析（与原有路径一致：按 UTF-8 解码后解析）"""
+    return parse_xml_message(raw.decode("utf-8", errors="ignore"))